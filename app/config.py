@@ -1,5 +1,6 @@
 # app/config.py
-from typing import List, Optional
+from typing import Dict, List, Optional
+from pydantic import model_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 class Settings(BaseSettings):
@@ -16,6 +17,17 @@ class Settings(BaseSettings):
     JWT_REFRESH_SECRET: str = "dev-refresh-secret"
     JWT_ACCESS_MIN: int = 15
     JWT_REFRESH_DAYS: int = 7
+    # Rotation : clés supplémentaires par kid (JSON en env, ex: {"2025-10": "..."}).
+    # Les jetons signés sans kid restent vérifiés avec JWT_SECRET / JWT_REFRESH_SECRET.
+    JWT_KEYS: Dict[str, str] = {}
+    JWT_ACTIVE_KID: Optional[str] = None          # None = signe avec JWT_SECRET
+    JWT_REFRESH_KEYS: Dict[str, str] = {}
+    JWT_REFRESH_ACTIVE_KID: Optional[str] = None
+    TOKEN_CACHE_SIZE: int = 10000                 # claims vérifiés gardés en mémoire
+
+    # --- Hash Argon2 (~100 Mo par hash en cours) ---
+    HASH_WORKERS: int = 2
+    HASH_QUEUE_MAX: int = 32              # au-delà : 429
 
     # --- Mongo ---
     MONGO_URI: str | None = None 
@@ -28,6 +40,42 @@ class Settings(BaseSettings):
     AZURE_BLOB_CONTAINER_RAW: str = "raw"
     AZURE_BLOB_CONTAINER_PROCESSED: str = "processed"
     AZURE_QUEUE_NAME: str = "process-image"
+    AZURE_HTTP_POOL_SIZE: int = 64        # connexions keep-alive partagées Blob/Queue
+
+    # --- Uploads ---
+    MAX_UPLOAD_MB: int = 15
+    UPLOAD_BLOCK_SIZE: int = 1024 * 1024  # taille d'un bloc stagé (octets)
+    UPLOAD_MAX_CONCURRENCY: int = 4       # blocs en vol par upload
+
+    # --- Feed ---
+    AUTHOR_CACHE_SIZE: int = 5000
+    AUTHOR_CACHE_TTL_SECONDS: float = 300.0
+    TIMELINE_CAP: int = 500               # entrées max par timeline following
+    TIMELINE_BACKFILL: int = 20           # posts recopiés lors d'un follow
+    FANOUT_MAX_FOLLOWERS: int = 5000      # au-delà : auteur servi en pull
+    WORLD_FEED_CACHE_SECONDS: float = 10.0   # pages du feed world partagées entre utilisateurs
+    WORLD_FEED_CACHE_PAGES: int = 256
+
+    # --- Référentiel véhicules (si la collection cars est vide) ---
+    CARS_DATA_DIR: str = "data/cars"      # img/ + makes.json
+
+    # --- Notification fin de traitement (long-poll / SSE) ---
+    NOTIFY_POLL_SECONDS: float = 1.0      # si pas de change stream Mongo
+    NOTIFY_POLL_OVERLAP_SECONDS: float = 30.0   # relit les écritures tardives (workers concurrents)
+    POST_WAIT_MAX_SECONDS: int = 30
+
+    # --- Outbox (jobs de traitement) ---
+    OUTBOX_BATCH: int = 100
+    OUTBOX_POLL_SECONDS: float = 1.0
+    OUTBOX_LEASE_SECONDS: int = 60
+
+    # --- Enqueuer groupé (enveloppes multi-jobs) ---
+    ENQUEUE_LINGER_MS: int = 20
+    ENQUEUE_MAX_JOBS: int = 32            # jobs max par message (une invocation de Function)
+
+    # --- Classements ---
+    LEADERBOARD_SNAPSHOT_SECONDS: float = 60.0
+    LEADERBOARD_REPLAY_OVERLAP_SECONDS: float = 300.0   # rattrapage : relu avant le filigrane
 
     # --- URLs IA ---
     IA_BLUR_URL: str | None = None
@@ -43,5 +91,16 @@ class Settings(BaseSettings):
         extra="ignore",   # ignore les variables env inconnues
     )
 
+    @model_validator(mode="after")
+    def _check_active_kids(self):
+        # kid actif absent du trousseau : refus au démarrage plutôt qu'un 500 au login
+        for kid, keys, name in (
+            (self.JWT_ACTIVE_KID, self.JWT_KEYS, "JWT_KEYS"),
+            (self.JWT_REFRESH_ACTIVE_KID, self.JWT_REFRESH_KEYS, "JWT_REFRESH_KEYS"),
+        ):
+            if kid and kid not in keys:
+                raise ValueError(f"kid actif {kid!r} absent de {name}")
+        return self
+
 settings = Settings()
 
@@ -1,12 +1,13 @@
 from motor.motor_asyncio import AsyncIOMotorClient
 from .config import settings
+from .services.metrics import MongoCommandTimer
 
 _client: AsyncIOMotorClient | None = None
 
 def get_db_client() -> AsyncIOMotorClient:
     global _client
     if _client is None:
-        _client = AsyncIOMotorClient(settings.MONGO_URI)
+        _client = AsyncIOMotorClient(settings.MONGO_URI, event_listeners=[MongoCommandTimer()])
     return _client
 
 def get_db():
@@ -1,26 +1,65 @@
+import hashlib
+import time
+from collections import OrderedDict
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import jwt
 from jwt import ExpiredSignatureError
 from .config import settings
+from .utils.security import verification_key
 
 bearer = HTTPBearer(auto_error=False)
 
+class VerifiedTokenCache:
+    """
+    LRU des access tokens déjà vérifiés : sha256(token) -> (exp, sub).
+    Une entrée n'est jamais servie après `exp` ; le décodage complet reprend alors
+    (avec sa leeway) comme pour un jeton inconnu.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[bytes, tuple[int, str]]" = OrderedDict()
+
+    def get(self, digest: bytes) -> str | None:
+        hit = self._data.get(digest)
+        if hit is None:
+            return None
+        exp, sub = hit
+        if exp <= time.time():
+            del self._data[digest]
+            return None
+        self._data.move_to_end(digest)
+        return sub
+
+    def put(self, digest: bytes, exp: int, sub: str) -> None:
+        self._data[digest] = (exp, sub)
+        self._data.move_to_end(digest)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+_verified = VerifiedTokenCache(settings.TOKEN_CACHE_SIZE)
+
 async def get_current_user_id(creds: HTTPAuthorizationCredentials = Depends(bearer)) -> str:
     if not creds:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="not_authenticated")
     token = creds.credentials
+    digest = hashlib.sha256(token.encode()).digest()
+    sub = _verified.get(digest)
+    if sub is not None:
+        return sub
     try:
         payload = jwt.decode(
             token,
-            settings.JWT_SECRET,
+            verification_key(token, "access"),
             algorithms=["HS256"],
             options={"require": ["exp", "iat"]},
             leeway=60,
         )
-        return str(payload["sub"])
+        sub = str(payload["sub"])
+        _verified.put(digest, int(payload["exp"]), sub)
+        return sub
     except ExpiredSignatureError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="token_expired")
     except jwt.PyJWTError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="invalid_token")
-
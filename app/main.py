@@ -1,15 +1,64 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
 from .config import settings
-from .routers import health, auth, uploads
+from .routers import health, auth, uploads, users, cars, leaderboard
 from .deps import get_db
 from .utils.mongo_indexes import ensure_indexes
-from app.deps import get_db
-from app.utils.mongo_indexes import ensure_indexes
+from .services.az_storage import open_storage, close_storage
+from .services.likes_service import migrate_embedded_likes
+from .services.auth_service import backfill_refresh_expiry
+from .services.hashing import HashingBusy, shutdown_hashing
+from .services.notifier import notifier
+from .services.car_catalog import load_catalog
+from .services.leaderboard_service import leaderboards
+from .services.outbox import relay, supports_transactions
+from .services.enqueuer import enqueuer
+from .services.world_feed_cache import world_feed
+from .services import metrics
 from app.routers import posts as posts_router
 from .routers.images import router as images_router
 
-app = FastAPI(title=settings.API_TITLE, version=settings.API_VERSION)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    print(f"[Startup] env={settings.APP_ENV}, version={settings.API_VERSION}")
+    db = get_db()
+    print(f"[Startup] JWT_SECRET len={len(settings.JWT_SECRET)} JWT_REFRESH_SECRET len={len(settings.JWT_REFRESH_SECRET)} "
+          f"access_min={settings.JWT_ACCESS_MIN} refresh_days={settings.JWT_REFRESH_DAYS}")
+    try:
+        await db.command("ping")
+        await ensure_indexes(db)
+        await migrate_embedded_likes(db)
+        await backfill_refresh_expiry(db)
+        relay.transactions = await supports_transactions(db)
+        print("[Startup] Mongo OK, indexes ensured")
+    except Exception as e:
+        print(f"[Startup][WARN] Mongo unreachable, skipping indexes: {e}")
+    try:
+        await open_storage()
+        print("[Startup] Azure Storage OK (clients async partagés)")
+    except Exception as e:
+        print(f"[Startup][WARN] Azure Storage unavailable: {e}")
+    catalog, source = await load_catalog(db)
+    print(f"[Startup] Car catalog: {len(catalog)} models from {source} (version {catalog.version})")
+    notifier.start(db)
+    leaderboards.start(db)
+    world_feed.start()
+    relay.start(db)
+    yield
+    await relay.stop()
+    await enqueuer.close()
+    await world_feed.stop()
+    await leaderboards.stop(db)
+    await notifier.stop()
+    await close_storage()
+    shutdown_hashing()
+
+
+app = FastAPI(title=settings.API_TITLE, version=settings.API_VERSION, lifespan=lifespan)
 
 # CORS large en dev
 app.add_middleware(
@@ -20,23 +69,25 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# latence par route (gabarit) -> GET /metrics
+app.add_middleware(metrics.MetricsMiddleware)
+
+@app.exception_handler(HashingBusy)
+async def hashing_busy_handler(request: Request, exc: HashingBusy):
+    return JSONResponse(status_code=429, content={"detail": "too_many_requests"}, headers={"Retry-After": "1"})
+
 # Routes
 app.include_router(health.router,  prefix="/v1/health",  tags=["health"])
 app.include_router(auth.router,    prefix="/v1/auth",    tags=["auth"])
 app.include_router(uploads.router, prefix="/v1/uploads", tags=["uploads"])
+app.include_router(users.router,   prefix="/v1/users",   tags=["users"])
+app.include_router(cars.router,    prefix="/v1/cars",    tags=["cars"])
+app.include_router(leaderboard.router, prefix="/v1/leaderboard", tags=["leaderboard"])
 app.include_router(posts_router.router, prefix="/v1/posts", tags=["posts"])
 app.include_router(images_router,  prefix="/v1/images",  tags=["images"])
 app.include_router(posts_router.router, prefix="/posts", tags=["posts"])  
 
-@app.on_event("startup")
-async def on_startup():
-    print(f"[Startup] env={settings.APP_ENV}, version={settings.API_VERSION}")
-    db = get_db()
-    print(f"[Startup] JWT_SECRET len={len(settings.JWT_SECRET)} JWT_REFRESH_SECRET len={len(settings.JWT_REFRESH_SECRET)} "
-          f"access_min={settings.JWT_ACCESS_MIN} refresh_days={settings.JWT_REFRESH_DAYS}")
-    try:
-        await db.command("ping")
-        await ensure_indexes(db)
-        print("[Startup] Mongo OK, indexes ensured")
-    except Exception as e:
-        print(f"[Startup][WARN] Mongo unreachable, skipping indexes: {e}")
+
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
@@ -4,11 +4,12 @@ from bson import ObjectId
 from ..deps import get_db
 from ..deps_auth import get_current_user_id
 from ..services.auth_service import (
-    hash_password, verify_password, normalize_username,
-    issue_tokens, rotate_refresh, revoke_refresh, generate_recovery_code
+    hash_password, verify_password, hash_recovery_code, verify_recovery_code,
+    normalize_username, issue_tokens, rotate_refresh, revoke_refresh, generate_recovery_code
 )
-from argon2 import PasswordHasher
+from ..services.hashing import offload
 from datetime import datetime
+import asyncio
 
 router = APIRouter()
 
@@ -38,11 +39,15 @@ async def signup(body: SignupRequest, db=Depends(get_db)):
     if exists:
         raise HTTPException(409, "username_taken")
     rec = generate_recovery_code()
+    password_hash, recovery_code_hash = await asyncio.gather(
+        offload(hash_password, body.password),
+        offload(hash_recovery_code, rec),
+    )
     doc = {
         "username": username,
         "username_ci": username_ci,
-        "password_hash": hash_password(body.password),
-        "recovery_code_hash": PasswordHasher().hash(rec),
+        "password_hash": password_hash,
+        "recovery_code_hash": recovery_code_hash,
         "display_name": body.display_name,
         "avatar_url": None,
         "showcase": [], "followers": [], "following": [],
@@ -57,7 +62,7 @@ async def signup(body: SignupRequest, db=Depends(get_db)):
 async def login(body: LoginRequest, db=Depends(get_db)):
     _, username_ci = normalize_username(body.username)
     user = await db.users.find_one({"username_ci": username_ci})
-    if not user or not verify_password(body.password, user["password_hash"]):
+    if not user or not await offload(verify_password, body.password, user["password_hash"]):
         raise HTTPException(401, "bad_credentials")
     toks = await issue_tokens(db, str(user["_id"]))
     return {"access_token": toks["access_token"], "refresh_token": toks["refresh_token"], "user": {
@@ -68,7 +73,8 @@ async def login(body: LoginRequest, db=Depends(get_db)):
 async def refresh(body: RefreshRequest, db=Depends(get_db)):
     try:
         toks = await rotate_refresh(db, body.refresh_token)
-        return {"access_token": toks["access_token"]}
+        # le refresh token présenté est consommé : le client doit garder le nouveau
+        return {"access_token": toks["access_token"], "refresh_token": toks["refresh_token"]}
     except ValueError as e:
         raise HTTPException(401, str(e))
 
@@ -83,11 +89,10 @@ async def reset(body: ResetRequest, db=Depends(get_db)):
     user = await db.users.find_one({"username_ci": username_ci})
     if not user:
         raise HTTPException(404, "user_not_found")
-    try:
-        PasswordHasher().verify(user["recovery_code_hash"], body.recovery_code)
-    except Exception:
+    if not await offload(verify_recovery_code, body.recovery_code, user["recovery_code_hash"]):
         raise HTTPException(400, "bad_recovery")
-    await db.users.update_one({"_id": user["_id"]}, {"$set":{"password_hash": hash_password(body.new_password)}})
+    password_hash = await offload(hash_password, body.new_password)
+    await db.users.update_one({"_id": user["_id"]}, {"$set":{"password_hash": password_hash}})
     return {"ok": True}
     
 @router.get("/me-test")
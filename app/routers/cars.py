@@ -0,0 +1,41 @@
+import hashlib
+from typing import Optional
+
+from fastapi import APIRouter, Request, Response
+
+from ..services.car_catalog import get_catalog
+
+router = APIRouter()
+
+# le référentiel ne change qu'au redémarrage : ETag = version du catalogue + requête
+CACHE_CONTROL = "public, max-age=300"
+
+
+def _not_modified(request: Request, response: Response, key: str) -> bool:
+    etag = f'"{get_catalog().version}-{hashlib.sha1(key.encode()).hexdigest()[:12]}"'
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CACHE_CONTROL
+    inm = request.headers.get("if-none-match") or ""
+    return etag in {t.strip() for t in inm.split(",")} or inm.strip() == "*"
+
+
+@router.get("")
+async def search_cars(
+    request: Request,
+    response: Response,
+    q: str = "",
+    brand: Optional[str] = None,
+    limit: int = 20,
+):
+    limit = max(1, min(100, limit))
+    if _not_modified(request, response, f"search|{q}|{brand or ''}|{limit}"):
+        return Response(status_code=304, headers=dict(response.headers))
+    items = get_catalog().search(q, brand, limit)
+    return {"items": items, "version": get_catalog().version}
+
+
+@router.get("/brands")
+async def list_brands(request: Request, response: Response):
+    if _not_modified(request, response, "brands"):
+        return Response(status_code=304, headers=dict(response.headers))
+    return {"items": get_catalog().brands, "version": get_catalog().version}
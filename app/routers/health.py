@@ -1,5 +1,10 @@
 from fastapi import APIRouter
 from datetime import datetime, timezone
+from ..services.hashing import hashing_stats
+from ..services.notifier import notifier
+from ..services.outbox import relay
+from ..services.enqueuer import enqueuer
+from ..services.world_feed_cache import world_feed
 
 router = APIRouter()
 
@@ -7,3 +12,18 @@ router = APIRouter()
 async def health():
     return {"status": "ok", "time": datetime.now(timezone.utc).isoformat()}
 
+@router.get("/hashing")
+async def hashing():
+    return hashing_stats()
+
+@router.get("/notifier")
+async def notifier_stats():
+    return notifier.stats()
+
+@router.get("/outbox")
+async def outbox_stats():
+    return {**relay.stats(), "enqueuer": enqueuer.stats()}
+
+@router.get("/feed")
+async def feed_cache_stats():
+    return world_feed.stats()
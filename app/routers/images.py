@@ -1,21 +1,16 @@
 # app/routers/images.py
 from __future__ import annotations
 
-import json
 import logging
 import os
-import re
-from datetime import datetime, timezone
 from typing import Optional, List
-from uuid import uuid4
 
 from fastapi import APIRouter, UploadFile, File, HTTPException, status
 
-from azure.storage.blob import BlobServiceClient, ContentSettings
-from azure.storage.queue import QueueClient
-from azure.storage.queue._message_encoding import TextBase64EncodePolicy
-
 from app.config import settings
+from app.services import az_storage
+from app.services.enqueuer import enqueuer
+from app.services.storage_service import create_blob_name
 
 router = APIRouter()
 
@@ -23,59 +18,6 @@ router = APIRouter()
 # Helpers connexion / utils
 # ------------------------------
 
-def _conn_str() -> str:
-    """
-    Ordre de priorité :
-      1) settings.AZURE_STORAGE_CONN
-      2) env AzureWebJobsStorage
-      3) env StorageConn
-      4) fallback (AZURE_STORAGE_ACCOUNT + AZURE_STORAGE_KEY)
-    """
-    c = (
-        (getattr(settings, "AZURE_STORAGE_CONN", None) or "").strip()
-        or (os.getenv("AzureWebJobsStorage") or "").strip()
-        or (os.getenv("StorageConn") or "").strip()
-    )
-    if not c:
-        acc = (
-            getattr(settings, "AZURE_STORAGE_ACCOUNT", None)
-            or os.getenv("AZURE_STORAGE_ACCOUNT")
-            or ""
-        ).strip()
-        key = (
-            getattr(settings, "AZURE_STORAGE_KEY", None)
-            or os.getenv("AZURE_STORAGE_KEY")
-            or ""
-        ).strip()
-        if acc and key:
-            c = (
-                f"DefaultEndpointsProtocol=https;"
-                f"AccountName={acc};AccountKey={key};EndpointSuffix=core.windows.net"
-            )
-    if not c:
-        raise RuntimeError(
-            "Aucune chaîne de connexion Azure Storage trouvée "
-            "(AZURE_STORAGE_CONN / AzureWebJobsStorage / StorageConn)."
-        )
-    return c
-
-
-def _account_from_conn_string(cs: str) -> Optional[str]:
-    m = re.search(r"AccountName=([^;]+)", cs or "")
-    return m.group(1) if m else None
-
-
-def _guess_ext(content_type: str) -> str:
-    ct = (content_type or "").lower()
-    if ct in ("image/jpeg", "image/jpg"):
-        return ".jpg"
-    if ct == "image/png":
-        return ".png"
-    if ct == "image/webp":
-        return ".webp"
-    return ""
-
-
 def _public_blob_url(account: Optional[str], container: str, blob_name: str) -> Optional[str]:
     # Valable si le conteneur est public (sinon juste indicatif)
     if not account:
@@ -95,14 +37,13 @@ QUEUE_NAME = getattr(settings, "AZURE_QUEUE_NAME", "process-image") or "process-
 
 @router.get("/diag")
 def images_diag():
-    cs = (
-        (getattr(settings, "AZURE_STORAGE_CONN", None) or "").strip()
-        or (os.getenv("AzureWebJobsStorage") or "").strip()
-        or (os.getenv("StorageConn") or "").strip()
-    )
+    try:
+        cs = az_storage.conn_str()
+    except RuntimeError:
+        cs = ""
     return {
         "storage_conn_present": bool(cs),
-        "account_hint": _account_from_conn_string(cs),
+        "account_hint": az_storage.account_from_conn_string(cs),
         "raw_container": RAW_CONT,
         "processed_container": PROC_CONT,
         "queue": QUEUE_NAME,
@@ -110,17 +51,11 @@ def images_diag():
 
 
 @router.get("/diag/queue-peek")
-def diag_queue_peek(limit: int = 3):
+async def diag_queue_peek(limit: int = 3):
     """Petit coup d'œil non destructif dans la queue (max 32 côté service)."""
-    conn = _conn_str()
-    q = QueueClient.from_connection_string(
-        conn,
-        queue_name=QUEUE_NAME,
-        message_encode_policy=TextBase64EncodePolicy(),
-    )
-    msgs = list(q.peek_messages(max_messages=min(max(limit, 1), 32)))
+    peek_count = await az_storage.peek_queue(limit)
     # On ne retourne pas le contenu exact pour éviter d’exposer des payloads en clair
-    return {"queue": QUEUE_NAME, "peek_count": len(msgs)}
+    return {"queue": QUEUE_NAME, "peek_count": peek_count}
 
 
 # ------------------------------
@@ -138,47 +73,32 @@ async def upload_image(
         raise HTTPException(status_code=415, detail=f"Type non supporté: {file.content_type}")
 
     # nommage: YYYYMMDD/uuid.ext
-    today = datetime.now(timezone.utc).strftime("%Y%m%d")
-    ext = _guess_ext(file.content_type) or os.path.splitext(file.filename)[1] or ".jpg"
-    blob_name = f"{today}/{uuid4().hex}{ext}"
+    blob_name = create_blob_name(file.content_type)
+    account = az_storage.account_from_conn_string(az_storage.conn_str())
 
-    # Connexion Storage
-    conn = _conn_str()
-    account = _account_from_conn_string(conn)
+    max_bytes = settings.MAX_UPLOAD_MB * 1024 * 1024
+    if file.size is not None and file.size > max_bytes:
+        raise HTTPException(status_code=413, detail="payload_too_large")
 
-    # Upload dans RAW
-    bsc = BlobServiceClient.from_connection_string(conn)
-    raw_client = bsc.get_blob_client(container=RAW_CONT, blob=blob_name)
-
-    data = await file.read()
-    if not data:
-        raise HTTPException(status_code=400, detail="Fichier vide.")
-
-    raw_client.upload_blob(
-        data,
-        overwrite=True,
-        content_settings=ContentSettings(content_type=file.content_type),
-    )
-
-    # Enqueue le message pour la Function (Base64 requis par host.json)
-    q = QueueClient.from_connection_string(
-        conn,
-        queue_name=QUEUE_NAME,
-        message_encode_policy=TextBase64EncodePolicy(),
-    )
+    # Upload dans RAW en streaming (blocs stagés en parallèle, mémoire bornée)
     try:
-        q.create_queue()
-    except Exception:
-        pass
+        await az_storage.upload_raw_stream(blob_name, file, file.content_type, max_bytes)
+    except ValueError as e:
+        if str(e) == "payload_too_large":
+            raise HTTPException(status_code=413, detail="payload_too_large")
+        if str(e) == "empty_file":
+            raise HTTPException(status_code=400, detail="Fichier vide.")
+        raise
 
+    # Enqueue le message pour la Function (Base64 requis par host.json)
     payload = {
         "post_id": (post_id or "000000000000000000000000"),
         "blob_name": blob_name,
     }
 
     try:
-        send_result = q.send_message(json.dumps(payload))
-        msg_id = getattr(send_result, "id", None)  # string attendue
+        # regroupé avec les autres jobs des ~20 ms suivantes (enveloppe multi-jobs)
+        msg_id = await enqueuer.enqueue(payload["post_id"], blob_name)
     except Exception as e:
         logging.exception("Queue send_message failed")
         raise HTTPException(status_code=502, detail=f"Queue send failed: {e}")
@@ -199,7 +119,7 @@ async def upload_image(
 
 
 @router.get("/status")
-def status_image(blob_name: str):
+async def status_image(blob_name: str):
     """
     Vérifie si l’image traitée existe dans 'processed'.
     Tente plusieurs suffixes si besoin (.png/.jpg) car la Function peut ré-encoder.
@@ -207,9 +127,7 @@ def status_image(blob_name: str):
     if not blob_name or "/" not in blob_name:
         raise HTTPException(status_code=400, detail="blob_name invalide")
 
-    conn = _conn_str()
-    account = _account_from_conn_string(conn)
-    bsc = BlobServiceClient.from_connection_string(conn)
+    account = az_storage.account_from_conn_string(az_storage.conn_str())
 
     # Essaye tel quel + variantes d’extension
     candidates: List[str] = [blob_name]
@@ -217,8 +135,7 @@ def status_image(blob_name: str):
         candidates += [f"{blob_name}.png", f"{blob_name}.jpg", f"{blob_name}.jpeg"]
 
     for name in candidates:
-        proc_client = bsc.get_blob_client(container=PROC_CONT, blob=name)
-        if proc_client.exists():
+        if await az_storage.processed_blob_exists(name):
             return {
                 "blob_name": name,
                 "processed_exists": True,
@@ -0,0 +1,60 @@
+from bson import ObjectId
+from fastapi import APIRouter, Depends, HTTPException
+
+from ..deps import get_db
+from ..deps_auth import get_current_user_id
+from ..services.feed_service import load_authors
+from ..services.leaderboard_service import leaderboards
+
+router = APIRouter()
+
+PERIODS = ("all", "weekly")
+
+
+async def _render(db, standings: dict) -> dict:
+    authors = await load_authors(db, [uid for _, uid, _ in standings["top"]])
+    return {
+        "period": standings["period"],
+        "items": [
+            {
+                "rank": rank,
+                "user": authors.get(uid) or {"id": uid, "name": "Unknown", "avatar_url": None},
+                "points": points,
+            }
+            for rank, uid, points in standings["top"]
+        ],
+        "me": standings["me"],
+    }
+
+
+def _period(period: str) -> str:
+    if period not in PERIODS:
+        raise HTTPException(400, "bad_period")
+    return period
+
+
+@router.get("/global")
+async def global_board(limit: int = 50, user_id: str = Depends(get_current_user_id), db=Depends(get_db)):
+    limit = max(1, min(100, limit))
+    return await _render(db, leaderboards.standings("all", user_id, limit))
+
+
+@router.get("/weekly")
+async def weekly_board(limit: int = 50, user_id: str = Depends(get_current_user_id), db=Depends(get_db)):
+    limit = max(1, min(100, limit))
+    return await _render(db, leaderboards.standings("weekly", user_id, limit))
+
+
+@router.get("/friends")
+async def friends_board(
+    period: str = "all",
+    limit: int = 50,
+    user_id: str = Depends(get_current_user_id),
+    db=Depends(get_db),
+):
+    limit = max(1, min(100, limit))
+    friend_ids = [
+        str(f["followee_id"])
+        async for f in db.follows.find({"follower_id": ObjectId(user_id)}, {"followee_id": 1})
+    ]
+    return await _render(db, leaderboards.friends(user_id, friend_ids, _period(period), limit))
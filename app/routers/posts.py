@@ -1,38 +1,50 @@
 # app/routers/posts.py
 from __future__ import annotations
 
+import asyncio
+import json
 from datetime import datetime
-from random import choices
 from typing import Optional
 
 from bson import ObjectId
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
 
 from ..config import settings
 from ..deps import get_db
 from ..deps_auth import get_current_user_id
 from ..models.post import PostCreate
+from ..services.capture_service import count_capture, uncount_capture
+from ..services.feed_service import Keyset, build_feed_page, decode_cursor, encode_cursor
+from ..services.likes_service import like, unlike
+from ..services.notifier import notifier
+from ..services.outbox import insert_with_job, process_image_job, relay
+from ..services.timeline_service import following_page
+from ..services.world_feed_cache import render_world_page, world_feed
 from ..services.storage_service import public_url
-
-# Azure Queue (Base64 policy requise pour matcher host.json côté Function)
-from azure.storage.queue import QueueClient
-from azure.storage.queue._message_encoding import TextBase64EncodePolicy
+from ..utils.fast_json import FastJSONResponse
 
 router = APIRouter()
 
-QUEUE_NAME = "process-image"
-
 
-def _user_public(u) -> dict:
-    return {
-        "id": str(u["_id"]),
-        "name": u.get("display_name") or u.get("username") or "Unknown",
-        "avatar_url": u.get("avatar_url"),
-    }
+async def _feed_cursor(db, cursor: Optional[str]) -> Optional[Keyset]:
+    if not cursor:
+        return None
+    if ObjectId.is_valid(cursor):
+        # ancien curseur (id du dernier post) : on retrouve sa date une fois
+        p = await db.posts.find_one({"_id": ObjectId(cursor)}, {"created_at": 1})
+        if p and p.get("created_at"):
+            return p["created_at"], p["_id"]
+        raise HTTPException(400, "bad_cursor")
+    try:
+        return decode_cursor(cursor)
+    except ValueError:
+        raise HTTPException(400, "bad_cursor")
 
 
 @router.get("/feed")
 async def get_feed(
+    request: Request,
     scope: str = "world",
     limit: int = 20,
     cursor: Optional[str] = None,
@@ -40,31 +52,20 @@ async def get_feed(
     db=Depends(get_db),
 ):
     limit = max(1, min(50, limit))
-    q = {}
-    if cursor:
-        q["_id"] = {"$lt": ObjectId(cursor)}
-
-    cur = db.posts.find(q).sort([("created_at", -1), ("_id", -1)]).limit(limit)
-    items = []
-    async for p in cur:
-        img = p.get("processed_blob_url") or p.get("raw_blob_url")
-        items.append(
-            {
-                "id": str(p["_id"]),
-                "user": {"id": str(p["user_id"]), "name": "Unknown", "avatar_url": None},
-                "image_url": img,
-                "rarity": p.get("rarity") or "common",
-                "taken_at": (p.get("taken_at") or p.get("created_at")).isoformat() + "Z",
-                "city": p.get("city"),
-                "country": p.get("country"),
-                "make": (p.get("vehicle") or {}).get("make") or "Unknown",
-                "model": (p.get("vehicle") or {}).get("model") or "Unknown",
-                "likes_count": len(p.get("likes") or []),
-                "liked_by_me": False,  # simplifié; ajoute ta logique si besoin
-            }
-        )
-    next_cursor = items[-1]["id"] if len(items) == limit else None
-    return {"items": items, "next_cursor": next_cursor}
+    before = await _feed_cursor(db, cursor)
+    if scope != "following":
+        # page partagée (cache) + liked_by_me de l'utilisateur ; ETag par utilisateur
+        body, etag = await render_world_page(db, user_id, cursor, before, limit)
+        headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+        inm = request.headers.get("if-none-match") or ""
+        if etag in {t.strip() for t in inm.split(",")}:
+            return Response(status_code=304, headers=headers)
+        return Response(body, media_type="application/json", headers=headers)
+
+    posts = await following_page(db, user_id, limit, before)
+    items = await build_feed_page(db, posts, user_id)
+    next_cursor = encode_cursor(posts[-1]) if len(posts) == limit else None
+    return FastJSONResponse({"items": items, "next_cursor": next_cursor})
 
 
 @router.post("/{post_id}/like")
@@ -73,9 +74,10 @@ async def like_post(
     user_id: str = Depends(get_current_user_id),
     db=Depends(get_db),
 ):
-    await db.posts.update_one(
-        {"_id": ObjectId(post_id)}, {"$addToSet": {"likes": ObjectId(user_id)}}
-    )
+    try:
+        await like(db, ObjectId(user_id), ObjectId(post_id))
+    except LookupError:
+        raise HTTPException(404, "post_not_found")
     return {"ok": True}
 
 
@@ -85,9 +87,7 @@ async def unlike_post(
     user_id: str = Depends(get_current_user_id),
     db=Depends(get_db),
 ):
-    await db.posts.update_one(
-        {"_id": ObjectId(post_id)}, {"$pull": {"likes": ObjectId(user_id)}}
-    )
+    await unlike(db, ObjectId(user_id), ObjectId(post_id))
     return {"ok": True}
 
 
@@ -114,27 +114,6 @@ async def report_post(
     return {"ok": True}
 
 
-def enqueue_process(post_id: str, blob_name: str) -> None:
-    """
-    Enqueue le traitement pour la Function Azure.
-    IMPORTANT : encodage Base64 pour matcher host.json (messageEncoding=Base64).
-    """
-    conn = settings.AZURE_STORAGE_CONN  # <- utilise la bonne variable d'env
-    q = QueueClient.from_connection_string(
-        conn,
-        queue_name=QUEUE_NAME,
-        message_encode_policy=TextBase64EncodePolicy(),
-    )
-    try:
-        q.create_queue()
-    except Exception:
-        pass
-    payload = {"post_id": post_id, "blob_name": blob_name}
-    import json as _json
-
-    q.send_message(_json.dumps(payload))
-
-
 @router.post("")
 async def create_post(
     body: PostCreate,
@@ -145,8 +124,11 @@ async def create_post(
     if not raw_url:
         raise HTTPException(400, "bad_blob_name")
 
+    uid = ObjectId(user_id)
+    now = datetime.utcnow()
     doc = {
-        "user_id": ObjectId(user_id),
+        "_id": ObjectId(),
+        "user_id": uid,
         "blob_name": body.blob_name,
         "raw_blob_url": raw_url,
         "processed_blob_url": None,
@@ -157,29 +139,43 @@ async def create_post(
         "country": None,
         "vehicle": {"make": "Unknown", "model": "Unknown"},
         "rarity": "common",
-        "likes": [],
+        "likes_count": 0,
         "reports": [],
-        "created_at": datetime.utcnow(),
+        "created_at": now,
     }
-    res = await db.posts.insert_one(doc)
-    post_id = str(res.inserted_id)
+    job = process_image_job(doc["_id"], body.blob_name, now)
+    if relay.transactions:
+        # post + job outbox + compteur du jour : tout ou rien. with_transaction
+        # rejoue les conflits d'écriture (deux captures le même jour se
+        # disputent capture_days) au lieu de les renvoyer en 500.
+        async def write(s):
+            await insert_with_job(db, doc, job, session=s)
+            return await count_capture(db, uid, now, session=s)
+
+        async with await db.client.start_session() as s:
+            todays = await s.with_transaction(write)
+    else:
+        # sans transaction : en parallèle, compteur annulé si le post n'est pas inséré
+        inserted, todays = await asyncio.gather(
+            insert_with_job(db, doc, job), count_capture(db, uid, now), return_exceptions=True
+        )
+        if isinstance(inserted, BaseException):
+            if not isinstance(todays, BaseException):
+                await uncount_capture(db, uid, now)
+            raise inserted
+    post_id = str(doc["_id"])
+    world_feed.invalidate_post(now, doc["_id"])
 
-    # push dans la queue pour traitement
-    enqueue_process(post_id, body.blob_name)
+    # envoi dans la queue par le relais outbox (retenté jusqu'au succès)
+    relay.notify()
 
     # --- capture_result minimal pour l’app ---
-    today0 = datetime.utcnow().date()
-    todays = await db.posts.count_documents(
-        {
-            "user_id": ObjectId(user_id),
-            "created_at": {
-                "$gte": datetime(today0.year, today0.month, today0.day)
-            },
-        }
-    )
-    new_for_user = todays <= 1
+    # compteur indisponible : on suppose une capture de plus dans la journée
+    new_for_user = not isinstance(todays, BaseException) and todays <= 1
 
-    rarity = choices(["common", "rare", "epic", "legendary"], weights=[85, 10, 4, 1])[0]
+    # rareté réelle calculée par le worker (statistiques de captures) : connue
+    # à la fin du traitement, cf. GET /{id}/wait
+    rarity = "common"
 
     return {
         "id": post_id,
@@ -193,17 +189,71 @@ async def create_post(
     }
 
 
-@router.get("/{post_id}")
-async def get_post(post_id: str, user_id: str = Depends(get_current_user_id), db=Depends(get_db)):
+def _post_oid(post_id: str) -> ObjectId:
     try:
-        _id = ObjectId(post_id)
+        return ObjectId(post_id)
     except Exception:
         raise HTTPException(400, "bad_post_id")
 
-    # include 'ai' in projection so we can return tags if available
+
+@router.get("/{post_id}/wait")
+async def wait_post(
+    post_id: str,
+    timeout: int = 25,
+    user_id: str = Depends(get_current_user_id),
+    db=Depends(get_db),
+):
+    """
+    Long-poll : répond dès que le post passe en "processed" (ou tout de suite
+    s'il l'est déjà) ; sinon {"status": "pending"} après `timeout` s, à relancer.
+    """
+    _id = _post_oid(post_id)
+    if not await db.posts.find_one({"_id": _id}, {"_id": 1}):
+        raise HTTPException(404, "post_not_found")
+    timeout = max(1, min(settings.POST_WAIT_MAX_SECONDS, timeout))
+    event = await notifier.wait(db, _id, timeout)
+    return event or {"id": post_id, "status": "pending"}
+
+
+@router.get("/{post_id}/events")
+async def post_events(
+    post_id: str,
+    request: Request,
+    user_id: str = Depends(get_current_user_id),
+    db=Depends(get_db),
+):
+    """
+    Server-Sent Events : un commentaire keep-alive toutes les 15 s, puis un
+    événement `processed` et fin du flux.
+    """
+    _id = _post_oid(post_id)
+    if not await db.posts.find_one({"_id": _id}, {"_id": 1}):
+        raise HTTPException(404, "post_not_found")
+
+    async def stream():
+        yield "retry: 3000\n\n"
+        while not await request.is_disconnected():
+            event = await notifier.wait(db, _id, 15)
+            if event:
+                yield f"event: processed\ndata: {json.dumps(event)}\n\n"
+                return
+            yield ": keep-alive\n\n"
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/{post_id}")
+async def get_post(post_id: str, user_id: str = Depends(get_current_user_id), db=Depends(get_db)):
+    _id = _post_oid(post_id)
+
+    # only ai.tags (not the raw predict payload) so we can return tags if available
     p = await db.posts.find_one(
         {"_id": _id},
-        {"_id": 1, "status": 1, "processed_blob_url": 1, "vehicle": 1, "rarity": 1, "ai": 1}
+        {"_id": 1, "status": 1, "processed_blob_url": 1, "vehicle": 1, "rarity": 1, "ai.tags": 1, "images": 1}
     )
     if not p:
         raise HTTPException(404, "post_not_found")
@@ -211,11 +261,12 @@ async def get_post(post_id: str, user_id: str = Depends(get_current_user_id), db
     ai = p.get("ai") or {}
     tags = (ai.get("tags") or [])[:8]  # keep it short for UI
 
-    return {
+    return FastJSONResponse({
         "id": str(_id),
         "status": p.get("status", "pending"),
         "processed_blob_url": p.get("processed_blob_url"),
+        "images": p.get("images"),  # {thumb, feed, full} en WebP, absent pour les anciens posts
         "vehicle": p.get("vehicle") or {"make": "Unknown", "model": "Unknown"},
         "rarity": p.get("rarity", "common"),
         "tags": tags,
-    }
+    })
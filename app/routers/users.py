@@ -0,0 +1,28 @@
+from bson import ObjectId
+from fastapi import APIRouter, Depends, HTTPException
+from ..deps import get_db
+from ..deps_auth import get_current_user_id
+from ..services.timeline_service import follow, unfollow
+
+router = APIRouter()
+
+def _oid(v: str) -> ObjectId:
+    try:
+        return ObjectId(v)
+    except Exception:
+        raise HTTPException(400, "bad_user_id")
+
+@router.post("/{target_id}/follow")
+async def follow_user(target_id: str, user_id: str = Depends(get_current_user_id), db=Depends(get_db)):
+    target = _oid(target_id)
+    if str(target) == user_id:
+        raise HTTPException(400, "cannot_follow_self")
+    if not await db.users.find_one({"_id": target}, {"_id": 1}):
+        raise HTTPException(404, "user_not_found")
+    created = await follow(db, ObjectId(user_id), target)
+    return {"ok": True, "created": created}
+
+@router.delete("/{target_id}/follow")
+async def unfollow_user(target_id: str, user_id: str = Depends(get_current_user_id), db=Depends(get_db)):
+    removed = await unfollow(db, ObjectId(user_id), _oid(target_id))
+    return {"ok": True, "removed": removed}
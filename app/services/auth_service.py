@@ -1,11 +1,13 @@
 from argon2 import PasswordHasher
 from argon2.low_level import Type
 from motor.motor_asyncio import AsyncIOMotorDatabase
-from datetime import datetime
+from datetime import datetime, timezone
 import jwt
-from ..utils.security import create_access_token, create_refresh_token
+from ..utils.security import create_access_token, create_refresh_token, verification_key
 
+# Fonctions synchrones et coûteuses : à appeler via services.hashing.offload
 ph = PasswordHasher(time_cost=2, memory_cost=102400, parallelism=8, hash_len=32, type=Type.ID)
+rc_ph = PasswordHasher()  # recovery codes (paramètres par défaut, comme avant)
 
 def hash_password(pw: str) -> str:
     return ph.hash(pw)
@@ -16,34 +18,65 @@ def verify_password(pw: str, h: str) -> bool:
     except Exception:
         return False
 
+def hash_recovery_code(code: str) -> str:
+    return rc_ph.hash(code)
+
+def verify_recovery_code(code: str, h: str) -> bool:
+    try:
+        return rc_ph.verify(h, code)
+    except Exception:
+        return False
+
 def normalize_username(u: str) -> tuple[str,str]:
     return u, u.lower()
 
+def _expires_at(exp: int) -> datetime:
+    # date BSON pour l'index TTL (expireAfterSeconds=0)
+    return datetime.fromtimestamp(exp, timezone.utc)
+
 async def issue_tokens(db: AsyncIOMotorDatabase, user_id: str) -> dict:
     access = create_access_token(user_id)
     refresh, jti, exp = create_refresh_token(user_id)
     await db.refresh_tokens.insert_one({
-        "user_id": user_id, "jti": jti, "exp": exp, "revoked": False, "created_at": datetime.utcnow()
+        "user_id": user_id, "jti": jti, "exp": exp, "expires_at": _expires_at(exp),
+        "revoked": False, "created_at": datetime.utcnow()
     })
     return {"access_token": access, "refresh_token": refresh}
 
 async def rotate_refresh(db: AsyncIOMotorDatabase, refresh_token: str) -> dict:
-    from ..config import settings
+    """
+    Rotation en un aller-retour : la session garde son document et on y remplace
+    le jti courant. Un jti qui ne correspond plus (déjà tourné, révoqué, inconnu)
+    est une réutilisation -> toutes les sessions de l'utilisateur sont révoquées.
+    """
     try:
-        payload = jwt.decode(refresh_token, settings.JWT_REFRESH_SECRET, algorithms=["HS256"])
+        payload = jwt.decode(refresh_token, verification_key(refresh_token, "refresh"), algorithms=["HS256"])
     except jwt.PyJWTError:
         raise ValueError("invalid_refresh")
-    row = await db.refresh_tokens.find_one({"user_id": payload["sub"], "jti": payload.get("jti")})
-    if not row or row.get("revoked"):
-        await db.refresh_tokens.update_many({"user_id": payload.get("sub")}, {"$set":{"revoked": True}})
+    sub = payload["sub"]
+    access = create_access_token(sub)
+    refresh, jti, exp = create_refresh_token(sub)
+    row = await db.refresh_tokens.find_one_and_update(
+        {"user_id": sub, "jti": payload.get("jti"), "revoked": False},
+        {"$set": {"jti": jti, "exp": exp, "expires_at": _expires_at(exp), "rotated_at": datetime.utcnow()}},
+        projection={"_id": 1},
+    )
+    if row is None:
+        await db.refresh_tokens.update_many({"user_id": sub}, {"$set":{"revoked": True}})
         raise ValueError("reuse_detected")
-    await db.refresh_tokens.update_one({"_id": row["_id"]}, {"$set": {"revoked": True}})
-    return await issue_tokens(db, payload["sub"])
+    return {"access_token": access, "refresh_token": refresh}
+
+async def backfill_refresh_expiry(db: AsyncIOMotorDatabase) -> int:
+    """Migration idempotente : ajoute `expires_at` (TTL) aux anciennes sessions."""
+    res = await db.refresh_tokens.update_many(
+        {"expires_at": {"$exists": False}},
+        [{"$set": {"expires_at": {"$toDate": {"$multiply": ["$exp", 1000]}}}}],
+    )
+    return res.modified_count
 
 async def revoke_refresh(db: AsyncIOMotorDatabase, refresh_token: str):
-    from ..config import settings
     try:
-        payload = jwt.decode(refresh_token, settings.JWT_REFRESH_SECRET, algorithms=["HS256"])
+        payload = jwt.decode(refresh_token, verification_key(refresh_token, "refresh"), algorithms=["HS256"])
         await db.refresh_tokens.update_one({"user_id": payload["sub"], "jti": payload.get("jti")}, {"$set": {"revoked": True}})
     except jwt.PyJWTError:
         return
@@ -1,74 +1,228 @@
 # app/services/az_storage.py
+import asyncio
+import base64
 import json
-import uuid
-from datetime import datetime
-from typing import Tuple, Optional
+import os
+import re
+from typing import Optional
 
-from azure.storage.blob import BlobServiceClient, ContentSettings
-from azure.storage.queue import QueueClient
-from azure.storage.queue._message_encoding import (
-    TextBase64EncodePolicy, TextBase64DecodePolicy
-)
+import aiohttp
+from azure.core.exceptions import ResourceExistsError
+from azure.core.pipeline.transport import AioHttpTransport
+from azure.storage.blob import BlobBlock, ContentSettings
+from azure.storage.blob.aio import BlobServiceClient
+from azure.storage.queue import TextBase64EncodePolicy, TextBase64DecodePolicy
+from azure.storage.queue.aio import QueueClient
 
 from app.config import settings
+from app.services.metrics import AZURE_HOOKS
 
-# --- Clients singletons -------------------------------------------------------
+# --- Clients partagés (async) -------------------------------------------------
+# Une seule session aiohttp (pool de connexions keep-alive) sert de transport à
+# tous les clients Blob/Queue. Ouverts/fermés dans le lifespan de l'app.
+_session: Optional[aiohttp.ClientSession] = None
 _blob_service_client: Optional[BlobServiceClient] = None
 _queue_client: Optional[QueueClient] = None
 
-def get_blob_service() -> BlobServiceClient:
-    global _blob_service_client
-    if _blob_service_client is None:
-        _blob_service_client = BlobServiceClient.from_connection_string(
-            settings.AZURE_STORAGE_CONN
+
+def conn_str() -> str:
+    """
+    Ordre de priorité :
+      1) settings.AZURE_STORAGE_CONN
+      2) env AzureWebJobsStorage
+      3) env StorageConn
+      4) fallback (AZURE_STORAGE_ACCOUNT + AZURE_STORAGE_KEY)
+    """
+    c = (
+        (settings.AZURE_STORAGE_CONN or "").strip()
+        or (os.getenv("AzureWebJobsStorage") or "").strip()
+        or (os.getenv("StorageConn") or "").strip()
+    )
+    if not c:
+        acc = (settings.AZURE_STORAGE_ACCOUNT or os.getenv("AZURE_STORAGE_ACCOUNT") or "").strip()
+        key = (settings.AZURE_STORAGE_KEY or os.getenv("AZURE_STORAGE_KEY") or "").strip()
+        if acc and key:
+            c = (
+                f"DefaultEndpointsProtocol=https;"
+                f"AccountName={acc};AccountKey={key};EndpointSuffix=core.windows.net"
+            )
+    if not c:
+        raise RuntimeError(
+            "Aucune chaîne de connexion Azure Storage trouvée "
+            "(AZURE_STORAGE_CONN / AzureWebJobsStorage / StorageConn)."
         )
-    return _blob_service_client
+    return c
 
-def get_queue_client() -> QueueClient:
-    global _queue_client
-    if _queue_client is None:
+
+def conn_parts(cs: str) -> dict:
+    """Parse 'AccountName=...;AccountKey=...;...' en dict."""
+    parts = {}
+    for seg in (cs or "").split(";"):
+        if "=" in seg:
+            k, v = seg.split("=", 1)
+            parts[k.strip()] = v.strip()
+    return parts
+
+
+def account_from_conn_string(cs: str) -> Optional[str]:
+    m = re.search(r"AccountName=([^;]+)", cs or "")
+    return m.group(1) if m else None
+
+
+def account_url() -> str:
+    """URL du service Blob (respecte BlobEndpoint, ex: Azurite), sans appel réseau."""
+    parts = conn_parts(conn_str())
+    if parts.get("BlobEndpoint"):
+        return parts["BlobEndpoint"].rstrip("/")
+    proto = parts.get("DefaultEndpointsProtocol", "https")
+    suffix = parts.get("EndpointSuffix", "core.windows.net")
+    return f"{proto}://{parts.get('AccountName')}.blob.{suffix}"
+
+
+def _transport() -> AioHttpTransport:
+    # session_owner=False : fermer un client ne ferme pas la session partagée
+    return AioHttpTransport(session=_session, session_owner=False)
+
+
+async def open_storage() -> None:
+    global _session, _blob_service_client, _queue_client
+    if _blob_service_client is not None:
+        return
+    cs = conn_str()
+    _session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=settings.AZURE_HTTP_POOL_SIZE, ttl_dns_cache=300)
+    )
+    try:
+        _blob_service_client = BlobServiceClient.from_connection_string(cs, transport=_transport(), **AZURE_HOOKS)
         _queue_client = QueueClient.from_connection_string(
-            settings.AZURE_STORAGE_CONN,
+            cs,
             queue_name=settings.AZURE_QUEUE_NAME,
-            message_encode_policy=TextBase64EncodePolicy(),
+            message_encode_policy=TextBase64EncodePolicy(),  # Base64 requis par host.json
             message_decode_policy=TextBase64DecodePolicy(),
+            transport=_transport(),
+            **AZURE_HOOKS,
         )
-        # s’assure que la queue existe (idempotent)
-        _queue_client.create_queue(exist_ok=True)
+        # s’assure que la queue existe (une seule fois, au démarrage)
+        try:
+            await _queue_client.create_queue(retry_total=0)
+        except ResourceExistsError:
+            pass
+    except BaseException:
+        # échec au démarrage : rien d'ouvert ni de global à moitié initialisé
+        await close_storage()
+        raise
+
+
+async def close_storage() -> None:
+    global _session, _blob_service_client, _queue_client
+    if _queue_client is not None:
+        await _queue_client.close()
+    if _blob_service_client is not None:
+        await _blob_service_client.close()
+    if _session is not None:
+        await _session.close()
+    _session = _blob_service_client = _queue_client = None
+
+
+def get_blob_service() -> BlobServiceClient:
+    if _blob_service_client is None:
+        raise RuntimeError("Azure Storage non initialisé (open_storage)")
+    return _blob_service_client
+
+
+def get_queue_client() -> QueueClient:
+    if _queue_client is None:
+        raise RuntimeError("Azure Storage non initialisé (open_storage)")
     return _queue_client
 
+
 # --- Helpers ------------------------------------------------------------------
-def build_blob_name(original_filename: str) -> str:
-    # 20250902/uuid4.ext
-    ext = ""
-    if "." in (original_filename or ""):
-        ext = "." + original_filename.rsplit(".", 1)[1].lower()
-    date_prefix = datetime.utcnow().strftime("%Y%m%d")
-    return f"{date_prefix}/{uuid.uuid4().hex}{ext}"
-
-def upload_raw_bytes(blob_name: str, data: bytes, content_type: str) -> str:
+async def upload_raw_stream(blob_name: str, stream, content_type: str, max_bytes: int) -> int:
     """
-    Upload dans le conteneur RAW. Retourne l'URL du blob.
+    Upload en streaming dans RAW : lit `stream` (objet avec `async read(n)`, ex. UploadFile)
+    par blocs de UPLOAD_BLOCK_SIZE, stage jusqu'à UPLOAD_MAX_CONCURRENCY blocs en parallèle
+    puis commit la liste. Mémoire par requête ≈ bloc * (concurrence + 1), quelle que soit
+    la taille de l'image. Retourne la taille totale.
+
+    Lève ValueError("empty_file") / ValueError("payload_too_large") ; dans ce cas rien
+    n'est commité (Azure purge les blocs non commités).
     """
-    bsc = get_blob_service()
-    blob = bsc.get_blob_client(
+    block_size = settings.UPLOAD_BLOCK_SIZE
+    blob = get_blob_service().get_blob_client(
         container=settings.AZURE_BLOB_CONTAINER_RAW,
         blob=blob_name
     )
-    blob.upload_blob(
-        data,
-        overwrite=True,
-        content_settings=ContentSettings(content_type=content_type)
-    )
-    return blob.url
+    content_settings = ContentSettings(content_type=content_type)
 
-def enqueue_process_image(post_id: str, blob_name: str) -> str:
+    chunk = await stream.read(block_size)
+    if not chunk:
+        raise ValueError("empty_file")
+    if len(chunk) > max_bytes:
+        raise ValueError("payload_too_large")
+    if len(chunk) < block_size:
+        # petite image : un seul appel, pas de block list
+        await blob.upload_blob(chunk, overwrite=True, content_settings=content_settings)
+        return len(chunk)
+
+    sem = asyncio.Semaphore(settings.UPLOAD_MAX_CONCURRENCY)
+    block_list: list[BlobBlock] = []
+    tasks: list[asyncio.Task] = []
+
+    async def _stage(block_id: str, data: bytes) -> None:
+        try:
+            await blob.stage_block(block_id, data, length=len(data))
+        finally:
+            sem.release()
+
+    total = 0
+    try:
+        while chunk:
+            total += len(chunk)
+            if total > max_bytes:
+                raise ValueError("payload_too_large")
+            await sem.acquire()
+            for t in tasks:
+                if t.done() and t.exception():
+                    sem.release()
+                    raise t.exception()
+            # ids de même longueur (exigence Azure), ordonnés par position
+            block_id = base64.b64encode(f"{len(block_list):08d}".encode()).decode()
+            block_list.append(BlobBlock(block_id=block_id))
+            tasks.append(asyncio.create_task(_stage(block_id, chunk)))
+            chunk = await stream.read(block_size)
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+    await blob.commit_block_list(block_list, content_settings=content_settings)
+    return total
+
+
+async def enqueue_jobs(jobs: list[dict]) -> str:
     """
-    Enqueue JSON {"post_id": "...", "blob_name": "..."} dans process-image.
-    Retourne l'id du message.
+    Un seul message pour plusieurs jobs : enveloppe {"v": 2, "jobs": [...]}
+    (acceptée par la Function et le worker). Un job seul garde le format simple.
     """
-    qc = get_queue_client()
-    payload = json.dumps({"post_id": post_id, "blob_name": blob_name})
-    resp = qc.send_message(payload)
+    if len(jobs) == 1:
+        payload = json.dumps(jobs[0])
+    else:
+        payload = json.dumps({"v": 2, "jobs": jobs})
+    resp = await get_queue_client().send_message(payload)
     return resp.id
 
+
+async def processed_blob_exists(blob_name: str) -> bool:
+    blob = get_blob_service().get_blob_client(
+        container=settings.AZURE_BLOB_CONTAINER_PROCESSED,
+        blob=blob_name
+    )
+    return await blob.exists()
+
+
+async def peek_queue(limit: int) -> int:
+    """Nombre de messages visibles (peek non destructif, max 32 côté service)."""
+    msgs = await get_queue_client().peek_messages(max_messages=min(max(limit, 1), 32))
+    return len(msgs)
@@ -0,0 +1,39 @@
+# app/services/capture_service.py
+"""
+Compteur de captures par utilisateur et par jour (UTC) pour le capture_result
+de POST /v1/posts : un document `capture_days` {_id: "<user_id>:<YYYYMMDD>"}
+incrémenté atomiquement, au lieu d'un count_documents sur les posts du jour.
+Les documents expirent (TTL sur expires_at) deux jours après leur création.
+"""
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument
+
+COUNTER_TTL = timedelta(days=2)
+
+
+def _day_id(user_id: ObjectId, at: datetime) -> str:
+    return f"{user_id}:{at:%Y%m%d}"
+
+
+async def count_capture(db: AsyncIOMotorDatabase, user_id: ObjectId, at: datetime, session=None) -> int:
+    """Incrémente le compteur du jour et retourne le nombre de captures, celle-ci incluse."""
+    doc = await db.capture_days.find_one_and_update(
+        {"_id": _day_id(user_id, at)},
+        {
+            "$inc": {"count": 1},
+            "$setOnInsert": {"user_id": user_id, "expires_at": at + COUNTER_TTL},
+        },
+        upsert=True,
+        projection={"count": 1},
+        return_document=ReturnDocument.AFTER,
+        session=session,
+    )
+    return doc["count"]
+
+
+async def uncount_capture(db: AsyncIOMotorDatabase, user_id: ObjectId, at: datetime) -> None:
+    """Annule un count_capture dont le post n'a pas pu être inséré."""
+    await db.capture_days.update_one({"_id": _day_id(user_id, at)}, {"$inc": {"count": -1}})
@@ -0,0 +1,188 @@
+# app/services/car_catalog.py
+"""
+Référentiel des véhicules, chargé une fois au démarrage et servi depuis la
+mémoire (autocomplete "choisis ta voiture", écrans de collection).
+
+Source : collection `cars` (brand / model / body_type) ; si elle est vide, les
+noms de data/cars/img (marque déduite via data/cars/makes.json).
+
+Recherche :
+  - préfixe : liste triée des suffixes de mots ("mercedes-benz c class",
+    "c class", "class") parcourue par bisect -> "cla", "benz c", "class" ;
+  - floue (fautes de frappe) : trigrammes, quand le préfixe ne suffit pas.
+"""
+import bisect
+import hashlib
+import json
+import logging
+import os
+import re
+import unicodedata
+from collections import defaultdict
+from typing import Optional
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from ..config import settings
+
+log = logging.getLogger("car_catalog")
+
+FUZZY_MIN_SCORE = 0.3
+
+
+def normalize(text: str) -> str:
+    """Minuscules, sans accents ni ponctuation : "Citroën C-Elysée" -> "citroen c elysee"."""
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(c for c in text if not unicodedata.combining(c)).lower()
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", text).split())
+
+
+def _trigrams(text: str) -> set[str]:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _slug(text: str) -> str:
+    return normalize(text).replace(" ", "-")
+
+
+class CarCatalog:
+    def __init__(self, cars: list[dict]):
+        # ordre stable (marque, modèle) : c'est aussi l'ordre des résultats à score égal
+        self.cars = sorted(cars, key=lambda c: (normalize(c["brand"]), normalize(c["model"]), c.get("body_type") or ""))
+        self._names = [normalize(f"{c['brand']} {c['model']}") for c in self.cars]
+        self._brand_keys = [normalize(c["brand"]) for c in self.cars]
+
+        suffixes = []
+        for i, name in enumerate(self._names):
+            words = name.split()
+            for w in range(len(words)):
+                suffixes.append((" ".join(words[w:]), i))
+        suffixes.sort()
+        self._suffix_keys = [s for s, _ in suffixes]
+        self._suffix_ids = [i for _, i in suffixes]
+
+        # trigrammes du nom complet et du modèle seul ("mustng" -> "Mustang GT")
+        self._fuzzy_ids: list[int] = []
+        self._fuzzy_sizes: list[int] = []
+        grams = defaultdict(list)
+        for i, c in enumerate(self.cars):
+            for key in {self._names[i], normalize(c["model"])}:
+                k = len(self._fuzzy_ids)
+                key_grams = _trigrams(key)
+                self._fuzzy_ids.append(i)
+                self._fuzzy_sizes.append(len(key_grams))
+                for g in key_grams:
+                    grams[g].append(k)
+        self._grams = dict(grams)
+
+        self.brands = sorted({c["brand"] for c in self.cars}, key=normalize)
+        digest = hashlib.sha1(json.dumps(self.cars, sort_keys=True, default=str).encode()).hexdigest()
+        self.version = digest[:16]
+
+    def __len__(self) -> int:
+        return len(self.cars)
+
+    def _prefix(self, q: str) -> list[int]:
+        out, seen = [], set()
+        i = bisect.bisect_left(self._suffix_keys, q)
+        while i < len(self._suffix_keys) and self._suffix_keys[i].startswith(q):
+            idx = self._suffix_ids[i]
+            if idx not in seen:
+                seen.add(idx)
+                out.append(idx)
+            i += 1
+        # correspondance depuis le début du nom d'abord, puis ordre alphabétique
+        out.sort(key=lambda idx: (not self._names[idx].startswith(q), idx))
+        return out
+
+    def _fuzzy(self, q: str, limit: int, exclude: set[int]) -> list[int]:
+        qgrams = _trigrams(q)
+        hits = defaultdict(int)
+        for g in qgrams:
+            for k in self._grams.get(g, ()):
+                hits[k] += 1
+        best: dict[int, float] = {}
+        for k, common in hits.items():
+            idx = self._fuzzy_ids[k]
+            if idx in exclude:
+                continue
+            score = common / (len(qgrams) + self._fuzzy_sizes[k] - common)  # Jaccard
+            if score >= FUZZY_MIN_SCORE and score > best.get(idx, 0.0):
+                best[idx] = score
+        return sorted(best, key=lambda idx: (-best[idx], idx))[:limit]
+
+    def search(self, q: str = "", brand: Optional[str] = None, limit: int = 20) -> list[dict]:
+        nq = normalize(q)
+        brand_n = normalize(brand) if brand else None
+        if not nq:
+            ids = [i for i, b in enumerate(self._brand_keys) if not brand_n or b == brand_n]
+            return [self.cars[i] for i in ids[:limit]]
+
+        ids = self._prefix(nq)
+        if brand_n:
+            ids = [i for i in ids if self._brand_keys[i] == brand_n]
+        ids = ids[:limit]
+        if len(ids) < limit and len(nq) >= 3:
+            fuzzy = self._fuzzy(nq, limit * 4 if brand_n else limit, set(ids))
+            if brand_n:
+                fuzzy = [i for i in fuzzy if self._brand_keys[i] == brand_n]
+            ids += fuzzy[:limit - len(ids)]
+        return [self.cars[i] for i in ids]
+
+
+def _car(doc: dict) -> dict:
+    brand, model = doc["brand"], doc["model"]
+    return {
+        "id": str(doc.get("_id") or _slug(f"{brand} {model} {doc.get('body_type') or ''}")),
+        "brand": brand,
+        "model": model,
+        "body_type": doc.get("body_type"),
+    }
+
+
+def _from_images(data_dir: str) -> list[dict]:
+    img_dir = os.path.join(data_dir, "img")
+    with open(os.path.join(data_dir, "makes.json"), encoding="utf-8") as fh:
+        makes = json.load(fh)
+    prefixes = sorted(makes, key=len, reverse=True)
+    cars = []
+    for f in os.listdir(img_dir):
+        stem, ext = os.path.splitext(f)
+        if ext.lower() not in (".jpg", ".jpeg", ".png", ".webp"):
+            continue
+        brand, model = "Unknown", stem.strip()
+        for p in prefixes:
+            if stem.startswith(p + " "):
+                brand, model = makes[p], stem[len(p) + 1:].strip()
+                break
+        cars.append(_car({"brand": brand, "model": model}))
+    return cars
+
+
+_catalog = CarCatalog([])
+
+
+async def load_catalog(db: AsyncIOMotorDatabase) -> tuple[CarCatalog, str]:
+    """(Re)charge le référentiel ; appelé au démarrage. Retourne (catalogue, source)."""
+    global _catalog
+    cars: list[dict] = []
+    source = "mongo"
+    try:
+        async for doc in db.cars.find({}, {"brand": 1, "model": 1, "body_type": 1}):
+            if doc.get("brand") and doc.get("model"):
+                cars.append(_car(doc))
+    except Exception as e:
+        log.warning("cars collection unreadable: %s", e)
+    if not cars:
+        source = settings.CARS_DATA_DIR
+        try:
+            cars = _from_images(settings.CARS_DATA_DIR)
+        except OSError as e:
+            log.warning("car catalog fallback unavailable: %s", e)
+    _catalog = CarCatalog(cars)
+    return _catalog, source
+
+
+def get_catalog() -> CarCatalog:
+    return _catalog
@@ -0,0 +1,92 @@
+# app/services/enqueuer.py
+"""
+Enqueuer groupé : les jobs de traitement soumis pendant ENQUEUE_LINGER_MS
+partent dans un seul message de queue, l'enveloppe {"v": 2, "jobs": [...]}
+(un job seul garde l'ancien format {"post_id", "blob_name"}).
+
+Envoi dès que ENQUEUE_MAX_JOBS jobs ou ENVELOPE_MAX_BYTES sont atteints, sinon
+à l'expiration du délai. Le message est encodé en Base64 (host.json) : 48 Ko
+de JSON donnent 64 Ko, la limite d'un message Azure Queue.
+"""
+import asyncio
+import json
+import logging
+from typing import Optional
+
+from ..config import settings
+from .az_storage import enqueue_jobs
+
+log = logging.getLogger("enqueuer")
+
+ENVELOPE_MAX_BYTES = 48 * 1024 - 64   # marge pour {"v":2,"jobs":[]}
+
+
+class CoalescingEnqueuer:
+    def __init__(self, linger_ms: int, max_jobs: int, max_bytes: int = ENVELOPE_MAX_BYTES):
+        self.linger = linger_ms / 1000
+        self.max_jobs = max(1, max_jobs)
+        self.max_bytes = max_bytes
+        self._buf: list[tuple[dict, asyncio.Future]] = []
+        self._bytes = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._sending: set[asyncio.Task] = set()
+        self.messages = 0
+        self.jobs = 0
+
+    async def enqueue(self, post_id: str, blob_name: str) -> str:
+        """Retourne l'id du message qui porte le job (partagé par toute l'enveloppe)."""
+        job = {"post_id": post_id, "blob_name": blob_name}
+        size = len(json.dumps(job)) + 2   # + séparateur ", " dans la liste
+        if self._buf and self._bytes + size > self.max_bytes:
+            self._flush()
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._buf.append((job, fut))
+        self._bytes += size
+        if len(self._buf) >= self.max_jobs:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.linger, self._flush)
+        return await fut
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._buf:
+            return
+        batch, self._buf, self._bytes = self._buf, [], 0
+        task = asyncio.create_task(self._send(batch))
+        self._sending.add(task)
+        task.add_done_callback(self._sending.discard)
+
+    async def _send(self, batch: list[tuple[dict, asyncio.Future]]) -> None:
+        try:
+            msg_id = await enqueue_jobs([job for job, _ in batch])
+        except Exception as e:
+            log.warning("envelope send failed (%d jobs): %s", len(batch), e)
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        self.messages += 1
+        self.jobs += len(batch)
+        for _, fut in batch:
+            if not fut.done():
+                fut.set_result(msg_id)
+
+    async def close(self) -> None:
+        self._flush()
+        if self._sending:
+            await asyncio.gather(*self._sending, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "messages": self.messages,
+            "jobs": self.jobs,
+            "jobs_per_message": round(self.jobs / self.messages, 2) if self.messages else None,
+            "buffered": len(self._buf),
+        }
+
+
+enqueuer = CoalescingEnqueuer(settings.ENQUEUE_LINGER_MS, settings.ENQUEUE_MAX_JOBS)
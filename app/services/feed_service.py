@@ -0,0 +1,152 @@
+# app/services/feed_service.py
+import base64
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Iterable, Optional
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from ..config import settings
+from .likes_service import liked_post_ids
+
+# Champs réellement rendus par le feed : jamais les tableaux likes/reports
+FEED_PROJECTION = {
+    "_id": 1,
+    "user_id": 1,
+    "processed_blob_url": 1,
+    "raw_blob_url": 1,
+    "images": 1,
+    "rarity": 1,
+    "taken_at": 1,
+    "created_at": 1,
+    "city": 1,
+    "country": 1,
+    "vehicle.make": 1,
+    "vehicle.model": 1,
+    "likes_count": 1,
+}
+
+FEED_SORT = [("created_at", -1), ("_id", -1)]  # = post_feed_idx
+
+AUTHOR_PROJECTION = {"_id": 1, "display_name": 1, "username": 1, "avatar_url": 1}
+
+
+# ---------- Curseur keyset (created_at, _id) ----------
+_EPOCH = datetime(1970, 1, 1)
+Keyset = tuple[datetime, ObjectId]
+
+
+def encode_cursor(p: dict) -> str:
+    """Curseur opaque du dernier post d'une page : "<created_at en ms>.<_id>" en base64 url."""
+    ms = (p["created_at"] - _EPOCH) // timedelta(milliseconds=1)
+    return base64.urlsafe_b64encode(f"{ms}.{p['_id']}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Keyset:
+    """Inverse de encode_cursor ; ValueError si le curseur est invalide."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        ms, oid = raw.split(".", 1)
+        return _EPOCH + timedelta(milliseconds=int(ms)), ObjectId(oid)
+    except Exception as e:
+        raise ValueError("bad_cursor") from e
+
+
+def keyset_filter(before: Optional[Keyset]) -> dict:
+    """
+    Posts strictement après `before` dans l'ordre (created_at desc, _id desc).
+    La borne `created_at <= t` est un intervalle sur le préfixe de post_feed_idx :
+    le scan démarre au curseur, quelle que soit la profondeur de la page.
+    """
+    if before is None:
+        return {}
+    created_at, oid = before
+    return {
+        "created_at": {"$lte": created_at},
+        "$or": [{"created_at": {"$lt": created_at}}, {"_id": {"$lt": oid}}],
+    }
+
+
+def user_public(u) -> dict:
+    return {
+        "id": str(u["_id"]),
+        "name": u.get("display_name") or u.get("username") or "Unknown",
+        "avatar_url": u.get("avatar_url"),
+    }
+
+
+class AuthorCache:
+    """Petit cache LRU (avec TTL) des auteurs publics, partagé par le process."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[str, tuple[float, dict]]" = OrderedDict()
+
+    def get(self, user_id: str) -> dict | None:
+        hit = self._data.get(user_id)
+        if hit is None:
+            return None
+        expires, author = hit
+        if expires < time.monotonic():
+            del self._data[user_id]
+            return None
+        self._data.move_to_end(user_id)
+        return author
+
+    def put(self, user_id: str, author: dict) -> None:
+        self._data[user_id] = (time.monotonic() + self.ttl, author)
+        self._data.move_to_end(user_id)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+
+_authors = AuthorCache(settings.AUTHOR_CACHE_SIZE, settings.AUTHOR_CACHE_TTL_SECONDS)
+
+
+async def load_authors(db: AsyncIOMotorDatabase, user_ids: Iterable) -> dict[str, dict]:
+    """Auteurs publics par id : cache d'abord, puis un seul `$in` pour les manquants."""
+    out: dict[str, dict] = {}
+    missing: list[ObjectId] = []
+    for uid in {str(u) for u in user_ids}:
+        author = _authors.get(uid)
+        if author is not None:
+            out[uid] = author
+        else:
+            missing.append(ObjectId(uid))
+    if missing:
+        async for u in db.users.find({"_id": {"$in": missing}}, AUTHOR_PROJECTION):
+            author = user_public(u)
+            _authors.put(author["id"], author)
+            out[author["id"]] = author
+    return out
+
+
+def feed_item(p: dict, author: dict | None, liked_by_me: bool = False) -> dict:
+    vehicle = p.get("vehicle") or {}
+    uid = str(p["user_id"])
+    images = p.get("images") or {}
+    return {
+        "id": str(p["_id"]),
+        "user": author or {"id": uid, "name": "Unknown", "avatar_url": None},
+        # dérivé 1080px si le worker l'a produit, sinon l'image traitée pleine taille
+        "image_url": images.get("feed") or p.get("processed_blob_url") or p.get("raw_blob_url"),
+        "images": images or None,
+        "rarity": p.get("rarity") or "common",
+        "taken_at": (p.get("taken_at") or p.get("created_at")).isoformat() + "Z",
+        "city": p.get("city"),
+        "country": p.get("country"),
+        "make": vehicle.get("make") or "Unknown",
+        "model": vehicle.get("model") or "Unknown",
+        "likes_count": p.get("likes_count") or 0,
+        "liked_by_me": liked_by_me,
+    }
+
+
+async def build_feed_page(db: AsyncIOMotorDatabase, posts: list[dict], user_id: str) -> list[dict]:
+    authors = await load_authors(db, [p["user_id"] for p in posts])
+    liked = await liked_post_ids(db, user_id, [p["_id"] for p in posts])
+    return [feed_item(p, authors.get(str(p["user_id"])), p["_id"] in liked) for p in posts]
+
@@ -0,0 +1,113 @@
+# app/services/hashing.py
+"""
+Exécuteur dédié aux hash Argon2 (coûteux en CPU et ~100 Mo de RAM chacun).
+
+Les hash tournent dans un pool de HASH_WORKERS threads (argon2-cffi relâche le
+GIL), jamais sur la boucle asyncio. Au plus HASH_WORKERS hash simultanés, donc
+une mémoire bornée ; au-delà, HASH_QUEUE_MAX demandes attendent et les
+suivantes sont refusées (HashingBusy -> 429).
+"""
+import asyncio
+import statistics
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from ..config import settings
+
+
+class HashingBusy(Exception):
+    """File d'attente des hash pleine : la requête doit être rejetée (429)."""
+
+
+class HashingExecutor:
+    def __init__(self, workers: int, max_queue: int):
+        self.workers = max(1, workers)
+        self.max_queue = max(0, max_queue)
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="argon2")
+        self._lock = threading.Lock()
+        self._pending = 0      # en file + en cours (décrémenté quand le thread a fini)
+        self._running = 0
+        self.completed = 0
+        self.rejected = 0
+        self._latency = deque(maxlen=512)   # attente + hash (s)
+        self._hash_time = deque(maxlen=512)  # hash seul (s)
+
+    def _timed(self, fn: Callable, args: tuple) -> Any:
+        with self._lock:
+            self._running += 1
+        t0 = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            dt = time.perf_counter() - t0
+            with self._lock:
+                self._running -= 1
+                self._hash_time.append(dt)
+
+    def _done(self, t_submit: float) -> None:
+        with self._lock:
+            self._pending -= 1
+            self.completed += 1
+            self._latency.append(time.perf_counter() - t_submit)
+
+    async def run(self, fn: Callable, *args) -> Any:
+        with self._lock:
+            if self._pending >= self.workers + self.max_queue:
+                self.rejected += 1
+                raise HashingBusy()
+            self._pending += 1
+        t_submit = time.perf_counter()
+        fut = self._pool.submit(self._timed, fn, args)
+        # callback côté thread : le compteur reste juste même si la requête est annulée
+        fut.add_done_callback(lambda _: self._done(t_submit))
+        return await asyncio.wrap_future(fut)
+
+    def stats(self) -> dict:
+        with self._lock:
+            latency = list(self._latency)
+            hash_time = list(self._hash_time)
+            out = {
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "running": self._running,
+                "queued": max(0, self._pending - self._running),
+                "completed": self.completed,
+                "rejected": self.rejected,
+            }
+        out["latency_ms"] = _summary(latency)
+        out["hash_ms"] = _summary(hash_time)
+        return out
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _summary(samples: list[float]) -> dict:
+    if not samples:
+        return {"avg": None, "p50": None, "p95": None, "max": None}
+    ms = sorted(s * 1000 for s in samples)
+    return {
+        "avg": round(statistics.fmean(ms), 2),
+        "p50": round(ms[len(ms) // 2], 2),
+        "p95": round(ms[min(len(ms) - 1, int(len(ms) * 0.95))], 2),
+        "max": round(ms[-1], 2),
+    }
+
+
+_executor = HashingExecutor(settings.HASH_WORKERS, settings.HASH_QUEUE_MAX)
+
+
+async def offload(fn: Callable, *args) -> Any:
+    """Exécute `fn(*args)` (hash/verify Argon2) hors de la boucle d'événements."""
+    return await _executor.run(fn, *args)
+
+
+def hashing_stats() -> dict:
+    return _executor.stats()
+
+
+def shutdown_hashing() -> None:
+    _executor.shutdown()
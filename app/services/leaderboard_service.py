@@ -0,0 +1,335 @@
+# app/services/leaderboard_service.py
+"""
+Classements (all-time, semaine ISO, amis) tenus en mémoire, sans `$group` par
+requête. La collection `posts` fait foi : toutes les LEADERBOARD_SNAPSHOT_SECONDS
+un balayage (processed_at_idx) compte les posts traités non marqués
+`leaderboard_counted` depuis filigrane - LEADERBOARD_REPLAY_OVERLAP_SECONDS
+(écriture en retard, décalage d'horloge). Les événements du notifier ne sont
+qu'un raccourci de latence : un événement perdu (abonné en retard, change
+stream relancé) est rattrapé au balayage suivant.
+
+- RankedBoard : dict user -> points + liste triée (-points, user_id) ; top N
+  par slice, rang par bisect (O(log n)).
+- Persistance : chaque snapshot écrit des deltas `$inc` dans `leaderboard`
+  {user_id, period, points, updated_at} pour les posts pas encore comptés,
+  les marque `leaderboard_counted` et avance le filigrane dans
+  `leaderboard_meta`. Avec transactions, tout est dans une transaction
+  (with_transaction) qui relit les marques : plusieurs instances de l'API
+  peuvent écrire, un post n'est compté que par une seule. Sans transaction,
+  une seule instance écrit (bail `writer` dans `leaderboard_meta`), les autres
+  ne font que tenir leur classement en mémoire.
+"""
+import asyncio
+import bisect
+import logging
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Optional
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from ..config import settings
+from .notifier import notifier
+from .outbox import relay
+
+log = logging.getLogger("leaderboard")
+
+RARITY_POINTS = {"common": 10, "rare": 25, "epic": 50, "legendary": 100}
+ALL_TIME = "all"
+COUNTED_CHUNK = 1000   # ids par requête de marquage / relecture des marques
+WRITER_LEASE_SNAPSHOTS = 3   # sans transaction : bail d'écriture = 3 périodes de snapshot
+SWEEP_PROJECTION = {"user_id": 1, "rarity": 1, "processed_at": 1}
+EPOCH = datetime(1970, 1, 1)
+
+
+def capture_points(rarity: Optional[str]) -> int:
+    return RARITY_POINTS.get((rarity or "common").lower(), RARITY_POINTS["common"])
+
+
+def week_period(at: datetime) -> str:
+    year, week, _ = at.isocalendar()
+    return f"week:{year}-W{week:02d}"
+
+
+class RankedBoard:
+    def __init__(self, period: str):
+        self.period = period
+        self._points: dict[str, int] = {}
+        self._order: list[tuple[int, str]] = []   # (-points, user_id), trié
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+    def set(self, user_id: str, points: int) -> None:
+        old = self._points.get(user_id)
+        if old is not None:
+            i = bisect.bisect_left(self._order, (-old, user_id))
+            del self._order[i]
+        self._points[user_id] = points
+        bisect.insort(self._order, (-points, user_id))
+
+    def add(self, user_id: str, delta: int) -> None:
+        self.set(user_id, self._points.get(user_id, 0) + delta)
+
+    def points(self, user_id: str) -> int:
+        return self._points.get(user_id, 0)
+
+    def rank(self, user_id: str) -> Optional[int]:
+        pts = self._points.get(user_id)
+        if pts is None:
+            return None
+        return bisect.bisect_left(self._order, (-pts, user_id)) + 1
+
+    def top(self, n: int) -> list[tuple[int, str, int]]:
+        return [(i + 1, uid, -neg) for i, (neg, uid) in enumerate(self._order[:n])]
+
+
+class Leaderboards:
+    def __init__(self, replay_overlap: float = 300.0, seen_max: int = 50_000):
+        self.all_time = RankedBoard(ALL_TIME)
+        self.weekly = RankedBoard(week_period(datetime.utcnow()))
+        self.watermark: Optional[datetime] = None   # début du dernier balayage complet
+        self.replay_overlap = timedelta(seconds=replay_overlap)
+        self.counted_since = EPOCH              # posts traités après : marqués s'ils sont comptés
+        self.loaded = False
+        # posts comptés en mémoire, à écrire : post_id -> (user_id, points, semaine)
+        self._pending: dict[str, tuple[str, int, str]] = {}
+        self._unmarked: set[str] = set()         # sans transaction : points écrits, marquage à refaire
+        self._persisted: Optional[datetime] = None
+        # doublons en mémoire (événement et balayage) ; entre redémarrages,
+        # c'est le marquage leaderboard_counted qui fait foi
+        self._seen: "OrderedDict[str, None]" = OrderedDict()
+        self._seen_max = seen_max
+        self._owner = uuid.uuid4().hex
+        self._tasks: list[asyncio.Task] = []
+        self._queue: Optional[asyncio.Queue] = None
+
+    # ---------- mises à jour ----------
+    def record(self, post_id: str, user_id: str, rarity: Optional[str], processed_at: datetime) -> bool:
+        if post_id in self._seen or post_id in self._pending or post_id in self._unmarked:
+            return False
+        self._seen[post_id] = None
+        if len(self._seen) > self._seen_max:
+            self._seen.popitem(last=False)
+
+        pts = capture_points(rarity)
+        period = week_period(processed_at)
+        self._pending[post_id] = (user_id, pts, period)
+        self.all_time.add(user_id, pts)
+        if period > self.weekly.period:
+            self._roll_week(period)
+        if period == self.weekly.period:
+            self.weekly.add(user_id, pts)
+        return True
+
+    def _roll_week(self, period: str) -> None:
+        # nouvelle semaine : l'ancienne reste dans Mongo (les deltas en retard y vont encore)
+        self.weekly = RankedBoard(period)
+
+    def _record_event(self, event: dict) -> None:
+        if event.get("status") != "processed" or not event.get("user_id") or not event.get("processed_at"):
+            return
+        processed_at = datetime.fromisoformat(event["processed_at"].rstrip("Z"))
+        self.record(event["id"], event["user_id"], event.get("rarity"), processed_at)
+
+    # ---------- chargement / persistance ----------
+    async def load(self, db: AsyncIOMotorDatabase) -> None:
+        # repart de zéro : un essai précédent interrompu ne doit rien laisser
+        self.all_time = RankedBoard(ALL_TIME)
+        self.weekly = RankedBoard(week_period(datetime.utcnow()))
+        self._seen.clear()
+        self._pending.clear()
+        self._unmarked.clear()
+        meta = await db.leaderboard_meta.find_one({"_id": "watermark"})
+        self.watermark = self._persisted = meta.get("as_of") if meta else None
+        # filigrane antérieur au marquage des posts : pas de recouvrement avant lui (il recompterait)
+        self.counted_since = meta.get("counted_since", self.watermark) if meta else EPOCH
+        async for row in db.leaderboard.find({"period": {"$in": [ALL_TIME, self.weekly.period]}}):
+            board = self.all_time if row["period"] == ALL_TIME else self.weekly
+            board.set(str(row["user_id"]), row["points"])
+        n = await self.sweep(db)   # tout l'historique au premier démarrage
+        self.loaded = True
+        log.info("leaderboards loaded: %d players, %d this week, %d captures replayed",
+                 len(self.all_time), len(self.weekly), n)
+
+    async def sweep(self, db: AsyncIOMotorDatabase) -> int:
+        """Compte les posts traités non marqués depuis le filigrane (moins le recouvrement)."""
+        started = datetime.utcnow()
+        since = self.counted_since
+        if self.watermark is not None:
+            since = max(self.watermark - self.replay_overlap, since)
+        q = {"status": "processed", "leaderboard_counted": {"$ne": True}, "processed_at": {"$gt": since}}
+        n = 0
+        async for p in db.posts.find(q, SWEEP_PROJECTION).sort("processed_at", 1):
+            if p.get("user_id"):
+                n += self.record(str(p["_id"]), str(p["user_id"]), p.get("rarity"), p["processed_at"])
+        if self.watermark is None or started > self.watermark:
+            self.watermark = started
+        return n
+
+    async def snapshot(self, db: AsyncIOMotorDatabase) -> int:
+        if not self.loaded:
+            return 0  # pas de filigrane écrit avant la fin du rattrapage
+        pending, watermark = dict(self._pending), self.watermark
+        if not pending and not self._unmarked and watermark == self._persisted:
+            return 0
+        now = datetime.utcnow()
+        if relay.transactions:
+            async with await db.client.start_session() as s:
+                # relue et rejouée en entier sur les erreurs transitoires (conflit
+                # avec une autre instance qui compte les mêmes posts, commit incertain)
+                n = await s.with_transaction(lambda s: self._write(db, pending, watermark, now, s))
+        elif await self._lease(db, now):
+            n = await self._write(db, pending, watermark, now)
+        else:
+            # une autre instance écrit : oublier ce qu'elle a déjà compté
+            for pid in await self._counted_among(db, pending):
+                self._pending.pop(pid, None)
+            return 0
+        for pid in pending:
+            self._pending.pop(pid, None)
+        self._persisted = watermark
+        return n
+
+    async def _write(self, db: AsyncIOMotorDatabase, pending: dict, watermark: Optional[datetime],
+                     now: datetime, session=None) -> int:
+        counted = await self._counted_among(db, pending, session)
+        fresh = [pid for pid in pending if pid not in counted]
+        deltas: dict[tuple[str, str], int] = {}
+        for pid in fresh:
+            user_id, pts, period = pending[pid]
+            for key in ((user_id, ALL_TIME), (user_id, period)):
+                deltas[key] = deltas.get(key, 0) + pts
+        ops = [UpdateOne(
+            {"user_id": ObjectId(uid), "period": period},
+            {"$inc": {"points": pts}, "$set": {"updated_at": now}},
+            upsert=True,
+        ) for (uid, period), pts in deltas.items()]
+        if ops:
+            await db.leaderboard.bulk_write(ops, ordered=False, session=session)
+        if session is None:
+            # sans transaction un $inc ne se rejoue pas : si le marquage
+            # échoue, seul lui est refait au snapshot suivant
+            for pid in pending:
+                self._pending.pop(pid, None)
+            self._unmarked.update(fresh)
+            fresh = list(self._unmarked)
+        ids = [ObjectId(pid) for pid in fresh]
+        for i in range(0, len(ids), COUNTED_CHUNK):
+            await db.posts.update_many({"_id": {"$in": ids[i:i + COUNTED_CHUNK]}},
+                                       {"$set": {"leaderboard_counted": True}}, session=session)
+        if session is None:
+            self._unmarked.difference_update(fresh)
+        if watermark is not None:
+            await db.leaderboard_meta.update_one(
+                {"_id": "watermark"},
+                {"$max": {"as_of": watermark}, "$min": {"counted_since": self.counted_since}},
+                upsert=True, session=session,
+            )
+        return len(ops)
+
+    async def _counted_among(self, db: AsyncIOMotorDatabase, post_ids, session=None) -> set[str]:
+        ids = [ObjectId(pid) for pid in post_ids]
+        counted: set[str] = set()
+        for i in range(0, len(ids), COUNTED_CHUNK):
+            q = {"_id": {"$in": ids[i:i + COUNTED_CHUNK]}, "leaderboard_counted": True}
+            async for d in db.posts.find(q, {"_id": 1}, session=session):
+                counted.add(str(d["_id"]))
+        return counted
+
+    async def _lease(self, db: AsyncIOMotorDatabase, now: datetime) -> bool:
+        """Sans transaction : bail d'écriture unique, renouvelé à chaque snapshot."""
+        until = now + timedelta(seconds=WRITER_LEASE_SNAPSHOTS * settings.LEADERBOARD_SNAPSHOT_SECONDS)
+        try:
+            await db.leaderboard_meta.update_one(
+                {"_id": "writer", "$or": [{"owner": self._owner}, {"until": {"$lt": now}}]},
+                {"$set": {"owner": self._owner, "until": until}},
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            return False   # bail tenu par une autre instance
+        return True
+
+    # ---------- tâches de fond ----------
+    def start(self, db: AsyncIOMotorDatabase) -> None:
+        # abonnement avant le chargement : les captures traitées pendant le
+        # rattrapage attendent dans la file (doublons écartés par _seen) ;
+        # celles que la file n'a pas pu garder viennent du balayage suivant
+        self._queue = notifier.subscribe()
+        self._tasks = [
+            asyncio.create_task(self._consume(db), name="leaderboard-events"),
+            asyncio.create_task(self._snapshot_loop(db), name="leaderboard-snapshot"),
+        ]
+
+    async def stop(self, db: AsyncIOMotorDatabase) -> None:
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._queue is not None:
+            notifier.unsubscribe(self._queue)
+            self._queue = None
+        try:
+            await self.snapshot(db)
+        except Exception as e:
+            log.warning("final leaderboard snapshot failed: %s", e)
+
+    async def _consume(self, db: AsyncIOMotorDatabase) -> None:
+        while not self.loaded:
+            try:
+                await self.load(db)
+            except Exception as e:
+                # les captures manquées seront rattrapées depuis le filigrane
+                log.warning("leaderboards not restored yet: %s", e)
+                await asyncio.sleep(settings.LEADERBOARD_SNAPSHOT_SECONDS)
+        while True:
+            event = await self._queue.get()
+            try:
+                self._record_event(event)
+            except Exception as e:
+                log.warning("leaderboard event skipped: %s", e)
+
+    async def _snapshot_loop(self, db: AsyncIOMotorDatabase) -> None:
+        while True:
+            await asyncio.sleep(settings.LEADERBOARD_SNAPSHOT_SECONDS)
+            try:
+                if self.loaded:
+                    await self.sweep(db)
+                await self.snapshot(db)
+            except Exception as e:
+                log.warning("leaderboard snapshot failed: %s", e)
+
+    # ---------- lecture ----------
+    def board(self, period: str) -> RankedBoard:
+        if period == "weekly":
+            current = week_period(datetime.utcnow())
+            if current > self.weekly.period:
+                self._roll_week(current)
+            return self.weekly
+        return self.all_time
+
+    def standings(self, period: str, user_id: str, limit: int) -> dict:
+        board = self.board(period)
+        return {
+            "period": board.period,
+            "top": board.top(limit),
+            "me": {"rank": board.rank(user_id), "points": board.points(user_id)},
+        }
+
+    def friends(self, user_id: str, friend_ids: list[str], period: str, limit: int) -> dict:
+        board = self.board(period)
+        players = sorted({user_id, *friend_ids}, key=lambda uid: (-board.points(uid), uid))
+        ranked = [(i + 1, uid, board.points(uid)) for i, uid in enumerate(players)]
+        me = next(r for r in ranked if r[1] == user_id)
+        return {
+            "period": board.period,
+            "top": ranked[:limit],
+            "me": {"rank": me[0], "points": me[2]},
+        }
+
+
+leaderboards = Leaderboards(settings.LEADERBOARD_REPLAY_OVERLAP_SECONDS)
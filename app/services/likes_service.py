@@ -0,0 +1,67 @@
+# app/services/likes_service.py
+from datetime import datetime
+from typing import Iterable
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+
+async def like(db: AsyncIOMotorDatabase, user_id: ObjectId, post_id: ObjectId) -> bool:
+    """
+    Un like = un document dans `likes` (index unique user_post_unique) + `$inc`
+    atomique de `posts.likes_count`. Retourne False si déjà liké.
+    Lève LookupError si le post n'existe pas.
+    """
+    try:
+        await db.likes.insert_one({"user_id": user_id, "post_id": post_id, "created_at": datetime.utcnow()})
+    except DuplicateKeyError:
+        return False
+    res = await db.posts.update_one({"_id": post_id}, {"$inc": {"likes_count": 1}})
+    if not res.matched_count:
+        await db.likes.delete_one({"user_id": user_id, "post_id": post_id})
+        raise LookupError("post_not_found")
+    return True
+
+
+async def unlike(db: AsyncIOMotorDatabase, user_id: ObjectId, post_id: ObjectId) -> bool:
+    res = await db.likes.delete_one({"user_id": user_id, "post_id": post_id})
+    if not res.deleted_count:
+        return False
+    await db.posts.update_one({"_id": post_id}, {"$inc": {"likes_count": -1}})
+    return True
+
+
+async def liked_post_ids(db: AsyncIOMotorDatabase, user_id: str, post_ids: Iterable[ObjectId]) -> set[ObjectId]:
+    """Parmi `post_ids`, ceux likés par `user_id` : une requête indexée par page."""
+    ids = list(post_ids)
+    if not ids:
+        return set()
+    cur = db.likes.find({"user_id": ObjectId(user_id), "post_id": {"$in": ids}}, {"_id": 0, "post_id": 1})
+    return {d["post_id"] async for d in cur}
+
+
+async def migrate_embedded_likes(db: AsyncIOMotorDatabase) -> int:
+    """
+    Migration idempotente : déplace les anciens tableaux `posts.likes` vers la
+    collection `likes` et initialise `likes_count` là où il manque.
+    """
+    moved = 0
+    now = datetime.utcnow()
+    async for p in db.posts.find({"likes": {"$exists": True}}, {"_id": 1, "likes": 1}):
+        likers = p.get("likes") or []
+        if likers:
+            try:
+                await db.likes.insert_many(
+                    [{"user_id": u, "post_id": p["_id"], "created_at": now} for u in likers],
+                    ordered=False,
+                )
+            except BulkWriteError as e:
+                # 11000 = doublons d'une migration interrompue
+                if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+                    raise
+        count = await db.likes.count_documents({"post_id": p["_id"]})
+        await db.posts.update_one({"_id": p["_id"]}, {"$set": {"likes_count": count}, "$unset": {"likes": ""}})
+        moved += 1
+    await db.posts.update_many({"likes_count": {"$exists": False}}, {"$set": {"likes_count": 0}})
+    return moved
@@ -0,0 +1,145 @@
+# app/services/metrics.py
+"""
+Métriques Prometheus de l'API (GET /metrics, format texte 0.0.4), sans
+dépendance : histogrammes en mémoire, par process.
+
+- http_request_duration_seconds{method, route, status} : middleware ASGI,
+  `route` = gabarit ("/v1/posts/{post_id}"), pas l'URL brute ;
+- mongo_command_duration_seconds{command, outcome} : listener de commandes
+  pymongo (durée mesurée par le driver) ;
+- azure_request_duration_seconds{service, method, status} : hooks
+  raw_request / raw_response des clients Azure Storage (chaque essai).
+"""
+import threading
+import time
+from typing import Iterable
+from urllib.parse import urlsplit
+
+from pymongo import monitoring
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Histogram:
+    def __init__(self, name: str, doc: str, labels: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.doc = doc
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series: dict[tuple, list] = {}   # valeurs de labels -> [n par bucket..., somme, total]
+        self._lock = threading.Lock()          # observé aussi depuis les threads pymongo
+        REGISTRY.append(self)
+
+    def observe(self, seconds: float, *label_values: str) -> None:
+        i = 0
+        while i < len(self.buckets) and seconds > self.buckets[i]:
+            i += 1
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 3)
+            series[i] += 1
+            series[-2] += seconds
+            series[-1] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = {k: list(v) for k, v in self._series.items()}
+        for values, series in sorted(snapshot.items()):
+            base = ",".join(f'{k}="{_escape(v)}"' for k, v in zip(self.labels, values))
+            sep = "," if base else ""
+            cum = 0
+            for le, n in zip(self.buckets, series):
+                cum += n
+                lines.append(f'{self.name}_bucket{{{base}{sep}le="{le}"}} {cum}')
+            lines.append(f'{self.name}_bucket{{{base}{sep}le="+Inf"}} {series[-1]}')
+            lines.append(f"{self.name}_sum{{{base}}} {series[-2]:.6f}")
+            lines.append(f"{self.name}_count{{{base}}} {series[-1]}")
+        return lines
+
+
+REGISTRY: list[Histogram] = []
+
+
+def render() -> str:
+    return "\n".join(line for h in REGISTRY for line in h.render()) + "\n"
+
+
+HTTP_LATENCY = Histogram("http_request_duration_seconds", "API request latency", ("method", "route", "status"))
+MONGO_LATENCY = Histogram("mongo_command_duration_seconds", "MongoDB command latency", ("command", "outcome"))
+AZURE_LATENCY = Histogram("azure_request_duration_seconds", "Azure Storage request latency",
+                          ("service", "method", "status"))
+
+
+class MetricsMiddleware:
+    """Middleware ASGI pur (compatible SSE / streaming, contrairement à BaseHTTPMiddleware)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        t0 = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_LATENCY.observe(time.perf_counter() - t0, scope["method"], _route_template(scope), str(status))
+
+
+def _route_template(scope) -> str:
+    """"/v1/posts/6650.../wait" -> "/v1/posts/{post_id}/wait" (scope["route"].path) ; "unmatched" sinon."""
+    template = getattr(scope.get("route"), "path", None)
+    if template is None:
+        return "unmatched"
+    # routeurs imbriqués (FastAPI récent) : route.path sans le préfixe d'include_router,
+    # repris tel quel de l'URL (préfixes littéraux, un segment par paramètre)
+    depth = len([seg for seg in template.split("/") if seg])
+    segments = [seg for seg in scope["path"].split("/") if seg]
+    prefix = "".join(f"/{seg}" for seg in segments[:len(segments) - depth])
+    return prefix + template or "/"
+
+
+class MongoCommandTimer(monitoring.CommandListener):
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        pass
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        MONGO_LATENCY.observe(event.duration_micros / 1e6, event.command_name, "ok")
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        MONGO_LATENCY.observe(event.duration_micros / 1e6, event.command_name, "error")
+
+
+_START_KEY = "metrics_start"
+
+
+def _on_azure_request(request) -> None:
+    request.context[_START_KEY] = time.perf_counter()
+
+
+def _on_azure_response(response) -> None:
+    t0 = response.context.get(_START_KEY)
+    if t0 is None:
+        return
+    req = response.http_request
+    service = (urlsplit(req.url).hostname or "").split(".")[1:2] or ["unknown"]
+    AZURE_LATENCY.observe(time.perf_counter() - t0, service[0], req.method, str(response.http_response.status_code))
+
+
+# kwargs des clients Azure Storage (BlobServiceClient / QueueClient)
+AZURE_HOOKS = {"raw_request_hook": _on_azure_request, "raw_response_hook": _on_azure_response}
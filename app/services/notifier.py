@@ -0,0 +1,182 @@
+# app/services/notifier.py
+"""
+Notification de fin de traitement des posts (status -> "processed").
+
+Un seul observateur par process API alimente tous les clients en attente :
+  - change stream Mongo sur `posts` (replica set / Atlas) ;
+  - sinon, poller qui suit `processed_at` toutes les NOTIFY_POLL_SECONDS, en
+    relisant les NOTIFY_POLL_OVERLAP_SECONDS précédentes (dédoublonnées par id) :
+    deux workers qui écrivent en parallèle ne committent pas dans l'ordre de
+    leurs `processed_at`.
+
+Les requêtes s'abonnent en mémoire (`wait(post_id)`) ; les services qui
+veulent tous les événements (classements, caches) passent par `subscribe()`.
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo.errors import OperationFailure, PyMongoError
+
+from ..config import settings
+
+log = logging.getLogger("notifier")
+
+EVENT_FIELDS = ("user_id", "status", "processed_blob_url", "images", "vehicle", "rarity", "created_at",
+                "processed_at")
+EVENT_PROJECTION = {f: 1 for f in EVENT_FIELDS}
+
+
+def post_event(doc: dict) -> dict:
+    """Événement sérialisable (JSON) à partir d'un document post."""
+    vehicle = doc.get("vehicle") or {}
+    created_at, processed_at = doc.get("created_at"), doc.get("processed_at")
+    return {
+        "id": str(doc["_id"]),
+        "user_id": str(doc["user_id"]) if doc.get("user_id") else None,
+        "status": doc.get("status", "pending"),
+        "processed_blob_url": doc.get("processed_blob_url"),
+        "images": doc.get("images"),
+        "vehicle": {"make": vehicle.get("make") or "Unknown", "model": vehicle.get("model") or "Unknown"},
+        "rarity": doc.get("rarity") or "common",
+        "created_at": created_at.isoformat() + "Z" if isinstance(created_at, datetime) else None,
+        "processed_at": processed_at.isoformat() + "Z" if isinstance(processed_at, datetime) else None,
+    }
+
+
+class ProcessingNotifier:
+    def __init__(self, poll_seconds: float, poll_overlap: float = 30.0, subscriber_queue: int = 1000):
+        self.poll_seconds = poll_seconds
+        self.poll_overlap = timedelta(seconds=poll_overlap)
+        self.subscriber_queue = subscriber_queue
+        self._waiters: dict[str, set[asyncio.Future]] = {}
+        self._subscribers: set[asyncio.Queue] = set()
+        self._task: Optional[asyncio.Task] = None
+        self.mode = "stopped"
+        self.delivered = 0
+
+    # ---------- abonnements ----------
+    async def wait(self, db: AsyncIOMotorDatabase, post_id: ObjectId, timeout: float) -> Optional[dict]:
+        """
+        Événement du post dès qu'il est traité (tout de suite s'il l'est déjà),
+        None au bout de `timeout` secondes.
+        """
+        key = str(post_id)
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(key, set()).add(fut)
+        try:
+            # lecture après inscription : pas de fenêtre où l'événement serait perdu
+            doc = await db.posts.find_one({"_id": post_id, "status": "processed"}, EVENT_PROJECTION)
+            if doc:
+                return post_event(doc)
+            return await asyncio.wait_for(fut, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            waiters = self._waiters.get(key)
+            if waiters is not None:
+                waiters.discard(fut)
+                if not waiters:
+                    del self._waiters[key]
+
+    def subscribe(self) -> asyncio.Queue:
+        # au mieux : un abonné en retard (file pleine) perd des événements, et
+        # le change stream relancé ne reprend pas là où il s'était arrêté
+        q: asyncio.Queue = asyncio.Queue(maxsize=self.subscriber_queue)
+        self._subscribers.add(q)
+        return q
+
+    def unsubscribe(self, q: asyncio.Queue) -> None:
+        self._subscribers.discard(q)
+
+    def publish(self, event: dict) -> None:
+        for fut in self._waiters.pop(event["id"], ()):
+            if not fut.done():
+                fut.set_result(event)
+                self.delivered += 1
+        for q in self._subscribers:
+            try:
+                q.put_nowait(event)
+            except asyncio.QueueFull:
+                log.warning("notifier subscriber lagging, event %s dropped", event["id"])
+
+    # ---------- observateur ----------
+    def start(self, db: AsyncIOMotorDatabase) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(db), name="processing-notifier")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.mode = "stopped"
+
+    async def _run(self, db: AsyncIOMotorDatabase) -> None:
+        while True:
+            try:
+                await self._watch(db)
+            except OperationFailure as e:
+                # Mongo standalone / émulateur : pas de change streams
+                log.info("change streams unavailable (%s), polling every %.1fs", e.code, self.poll_seconds)
+                await self._poll(db)
+            except asyncio.CancelledError:
+                raise
+            except PyMongoError as e:
+                log.warning("notifier watch interrupted: %s", e)
+                await asyncio.sleep(self.poll_seconds)
+
+    async def _watch(self, db: AsyncIOMotorDatabase) -> None:
+        # seulement le passage à "processed" : pas les likes, ni un retraitement
+        # (le worker ne réécrit processed_at que la première fois)
+        pipeline = [{"$match": {
+            "$or": [
+                {"operationType": "update", "updateDescription.updatedFields.processed_at": {"$exists": True}},
+                {"operationType": "replace"},
+            ],
+            "fullDocument.status": "processed",
+        }}]
+        async with db.posts.watch(pipeline, full_document="updateLookup") as stream:
+            self.mode = "change_stream"
+            async for change in stream:
+                doc = change.get("fullDocument")
+                if doc:
+                    self.publish(post_event(doc))
+
+    async def _poll(self, db: AsyncIOMotorDatabase) -> None:
+        self.mode = "poll"
+        since = datetime.utcnow()
+        published: dict[ObjectId, datetime] = {}   # posts déjà publiés encore dans la fenêtre relue
+        while True:
+            await asyncio.sleep(self.poll_seconds)
+            try:
+                # pas de limit : la fenêtre relue borne le volume (overlap x débit des workers)
+                q = {"status": "processed", "processed_at": {"$gt": since - self.poll_overlap}}
+                async for doc in db.posts.find(q, EVENT_PROJECTION).sort("processed_at", 1):
+                    since = max(since, doc["processed_at"])
+                    if doc["_id"] in published:
+                        continue
+                    published[doc["_id"]] = doc["processed_at"]
+                    self.publish(post_event(doc))
+            except PyMongoError as e:
+                log.warning("notifier poll failed: %s", e)
+            floor = since - self.poll_overlap
+            published = {k: t for k, t in published.items() if t > floor}
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "waiting_posts": len(self._waiters),
+            "waiters": sum(len(w) for w in self._waiters.values()),
+            "subscribers": len(self._subscribers),
+            "delivered": self.delivered,
+        }
+
+
+notifier = ProcessingNotifier(settings.NOTIFY_POLL_SECONDS, settings.NOTIFY_POLL_OVERLAP_SECONDS)
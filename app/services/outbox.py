@@ -0,0 +1,217 @@
+# app/services/outbox.py
+"""
+Outbox des jobs de traitement : le message de queue est écrit dans `outbox`
+avec le post (transaction si Mongo la supporte), puis un relais en tâche de
+fond l'envoie. Un envoi raté est retenté avec backoff : plus de post bloqué
+en "pending" parce que la queue était indisponible au moment de la capture.
+
+Relais (lifespan) :
+  - réveillé à chaque capture (`notify`) ou toutes les OUTBOX_POLL_SECONDS ;
+  - réserve un lot de OUTBOX_BATCH jobs dus (bail OUTBOX_LEASE_SECONDS, donc
+    plusieurs instances de l'API peuvent tourner sans double envoi) ;
+  - passe tout le lot à l'enqueuer groupé (enveloppes multi-jobs envoyées en
+    parallèle) et marque les jobs "sent" (purgés par TTL), ou les replanifie en
+    cas d'échec ;
+  - sans transaction, le job est écrit en "draft" (jamais réservé) avant le
+    post, puis passé en "pending" : les brouillons plus vieux que
+    OUTBOX_LEASE_SECONDS sont promus si leur post existe, supprimés sinon.
+"""
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+
+from ..config import settings
+from .enqueuer import enqueuer
+
+log = logging.getLogger("outbox")
+
+MAX_BACKOFF_SECONDS = 300
+
+
+def process_image_job(post_id: ObjectId, blob_name: str, now: datetime) -> dict:
+    # _id = post : un job par post, rejouer l'écriture ne le duplique pas
+    return {
+        "_id": post_id,
+        "kind": "process_image",
+        "payload": {"post_id": str(post_id), "blob_name": blob_name},
+        "status": "pending",
+        "attempts": 0,
+        "available_at": now,
+        "created_at": now,
+    }
+
+
+async def supports_transactions(db: AsyncIOMotorDatabase) -> bool:
+    """Replica set ou mongos : les transactions multi-documents sont possibles."""
+    hello = await db.command("hello")
+    return bool(hello.get("setName") or hello.get("msg") == "isdbgrid")
+
+
+async def insert_with_job(db: AsyncIOMotorDatabase, doc: dict, job: dict, session=None) -> None:
+    """Insère le post et son job, dans une transaction si possible (celle de `session` si fournie)."""
+    if session is not None:
+        await db.posts.insert_one(doc, session=session)
+        await db.outbox.insert_one(job, session=session)
+        return
+    if relay.transactions:
+        async with await db.client.start_session() as s:
+            # rejouée sur TransientTransactionError / UnknownTransactionCommitResult
+            await s.with_transaction(lambda s: insert_with_job(db, doc, job, session=s))
+        return
+    # sans transaction : le job d'abord (un post sans job resterait "pending"
+    # pour toujours), en brouillon pour que le relais ne l'envoie pas avant
+    # que le post existe.
+    await db.outbox.insert_one({**job, "status": "draft"})
+    try:
+        await db.posts.insert_one(doc)
+    except Exception:
+        await db.outbox.delete_one({"_id": job["_id"]})
+        raise
+    try:
+        await db.outbox.update_one({"_id": job["_id"], "status": "draft"}, {"$set": {"status": job["status"]}})
+    except Exception as e:
+        # le post existe : le relais promouvra le brouillon (_sweep_drafts)
+        log.warning("outbox: draft %s left for the sweeper: %s", job["_id"], e)
+
+
+class OutboxRelay:
+    def __init__(self):
+        self.transactions = False
+        self.sent = 0
+        self.failed = 0
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._owner = uuid.uuid4().hex
+        self._swept_at: Optional[datetime] = None
+
+    def notify(self) -> None:
+        self._wake.set()
+
+    def start(self, db: AsyncIOMotorDatabase) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(db), name="outbox-relay")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self, db: AsyncIOMotorDatabase) -> None:
+        while True:
+            try:
+                n = await self.drain_once(db)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.warning("outbox relay error: %s", e)
+                n = 0
+            if n >= settings.OUTBOX_BATCH:
+                continue  # rafale : lot suivant sans attendre
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), settings.OUTBOX_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _claim(self, db: AsyncIOMotorDatabase, now: datetime) -> list[dict]:
+        due = {"$or": [
+            {"status": "pending", "available_at": {"$lte": now}},
+            {"status": "sending", "lease_until": {"$lt": now}},   # relais mort en cours d'envoi
+        ]}
+        ids = [d["_id"] async for d in db.outbox.find(due, {"_id": 1})
+               .sort("available_at", 1).limit(settings.OUTBOX_BATCH)]
+        if not ids:
+            return []
+        token = uuid.uuid4().hex
+        await db.outbox.update_many(
+            {"_id": {"$in": ids}, **due},
+            {"$set": {
+                "status": "sending",
+                "lease_until": now + timedelta(seconds=settings.OUTBOX_LEASE_SECONDS),
+                "lease_token": token,
+                "owner": self._owner,
+            }},
+        )
+        # seuls les jobs réellement réservés par ce passage (une autre instance a pu en prendre)
+        return await db.outbox.find({"lease_token": token}).to_list(length=len(ids))
+
+    async def _sweep_drafts(self, db: AsyncIOMotorDatabase, now: datetime) -> None:
+        """Brouillons abandonnés (process arrêté entre les écritures) : promus si le post existe, sinon supprimés."""
+        stale = {"status": "draft", "available_at": {"$lt": now - timedelta(seconds=settings.OUTBOX_LEASE_SECONDS)}}
+        ids = [d["_id"] async for d in db.outbox.find(stale, {"_id": 1}).limit(settings.OUTBOX_BATCH)]
+        if not ids:
+            return
+        posted = {p["_id"] async for p in db.posts.find({"_id": {"$in": ids}}, {"_id": 1})}
+        orphans = [i for i in ids if i not in posted]
+        if posted:
+            await db.outbox.update_many({"_id": {"$in": list(posted)}, "status": "draft"},
+                                        {"$set": {"status": "pending", "available_at": now}})
+        if orphans:
+            await db.outbox.delete_many({"_id": {"$in": orphans}, "status": "draft"})
+        log.info("outbox: drafts promoted=%d dropped=%d", len(posted), len(orphans))
+
+    async def drain_once(self, db: AsyncIOMotorDatabase) -> int:
+        now = datetime.utcnow()
+        if not self.transactions and (
+            self._swept_at is None or now - self._swept_at >= timedelta(seconds=settings.OUTBOX_LEASE_SECONDS)
+        ):
+            self._swept_at = now
+            await self._sweep_drafts(db, now)
+        jobs = await self._claim(db, now)
+        if not jobs:
+            return 0
+
+        results = await asyncio.gather(
+            *(enqueuer.enqueue(j["payload"]["post_id"], j["payload"]["blob_name"]) for j in jobs),
+            return_exceptions=True,
+        )
+
+        done = datetime.utcnow()
+        ops = []
+        for job, res in zip(jobs, results):
+            if isinstance(res, BaseException):
+                attempts = job.get("attempts", 0) + 1
+                backoff = min(MAX_BACKOFF_SECONDS, 2 ** attempts)
+                ops.append(UpdateOne({"_id": job["_id"], "lease_token": job["lease_token"]}, {
+                    "$set": {
+                        "status": "pending",
+                        "attempts": attempts,
+                        "available_at": done + timedelta(seconds=backoff),
+                        "last_error": str(res)[:300],
+                    },
+                    "$unset": {"lease_until": "", "lease_token": "", "owner": ""},
+                }))
+            else:
+                ops.append(UpdateOne({"_id": job["_id"], "lease_token": job["lease_token"]}, {
+                    "$set": {"status": "sent", "sent_at": done, "message_id": res},
+                    "$unset": {"lease_until": "", "lease_token": "", "owner": ""},
+                }))
+        await db.outbox.bulk_write(ops, ordered=False)
+
+        failed = sum(isinstance(r, BaseException) for r in results)
+        self.sent += len(jobs) - failed
+        self.failed += failed
+        if failed:
+            log.warning("outbox: %d/%d sends failed, rescheduled", failed, len(jobs))
+        return len(jobs)
+
+    def stats(self) -> dict:
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "transactions": self.transactions,
+            "sent": self.sent,
+            "failed": self.failed,
+        }
+
+
+relay = OutboxRelay()
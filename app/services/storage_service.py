@@ -1,42 +1,23 @@
 # app/services/storage_service.py
 from datetime import datetime, timedelta
-from azure.storage.blob import BlobServiceClient, generate_blob_sas, BlobSasPermissions
+from azure.storage.blob import generate_blob_sas, BlobSasPermissions
 from ..config import settings
+from .az_storage import account_url, conn_parts, conn_str
 import re, uuid, datetime as dt
 
 SAFE_MIME = {"image/jpeg","image/png","image/webp"}
-EXT = {"image/jpeg": ".jpg", "image/png": ".png", "image/webp": ".webp"}
-
-_client: BlobServiceClient | None = None
+EXT = {"image/jpeg": ".jpg", "image/jpg": ".jpg", "image/png": ".png", "image/webp": ".webp"}
 
 def _clean_path(*parts: str) -> str:
     # join sans double slash
     cleaned = [p.strip("/") for p in parts if p is not None]
     return "/".join(cleaned)
-    
-def _account_info_from_conn_str(cs: str) -> tuple[str | None, str | None]:
-    parts = {}
-    for seg in cs.split(";"):
-        if "=" in seg:
-            k, v = seg.split("=", 1)
-            parts[k.strip()] = v.strip()
-    return parts.get("AccountName"), parts.get("AccountKey")
-
-def _svc() -> BlobServiceClient:
-    global _client
-    if _client is None:
-        _client = BlobServiceClient.from_connection_string(settings.AZURE_STORAGE_CONN)
-    return _client
 
 def _account_info_from_conn_str(cs: str) -> tuple[str | None, str | None]:
     """
     Parse 'AccountName=...;AccountKey=...;...' from a standard storage connection string.
     """
-    parts = {}
-    for seg in cs.split(";"):
-        if "=" in seg:
-            k, v = seg.split("=", 1)
-            parts[k.strip()] = v.strip()
+    parts = conn_parts(cs)
     return parts.get("AccountName"), parts.get("AccountKey")
 
 def sanitize(name: str) -> str:
@@ -51,7 +32,7 @@ def create_sas_for_upload(blob_name: str, mime: str, size_max_mb: int, minutes:
         raise ValueError("bad_mime")
 
     # Récupère AccountName/AccountKey depuis la connection string
-    account_name, account_key = _account_info_from_conn_str(settings.AZURE_STORAGE_CONN)
+    account_name, account_key = _account_info_from_conn_str(conn_str())
     if not account_name or not account_key:
         raise ValueError("missing_account_key")
 
@@ -73,7 +54,7 @@ def create_sas_for_upload(blob_name: str, mime: str, size_max_mb: int, minutes:
     )
 
     # Construit l’URL finale propre (sans //)
-    base = _svc().url.rstrip("/")  # ex: https://<account>.blob.core.windows.net
+    base = account_url()  # ex: https://<account>.blob.core.windows.net
     url = f"{base}/{_clean_path(container, blob_name)}?{sas}"
 
     return {
@@ -84,6 +65,6 @@ def create_sas_for_upload(blob_name: str, mime: str, size_max_mb: int, minutes:
     }
     
 def public_url(container: str, blob_name: str) -> str:
-    base = _svc().url.rstrip("/")
+    base = account_url()
     return f"{base}/{_clean_path(container, blob_name)}"
 
@@ -0,0 +1,128 @@
+# app/services/timeline_service.py
+"""
+Feed `scope=following` : timelines précalculées par follower.
+
+- push : le worker ajoute chaque post traité dans `timelines[follower]`
+  (tableau plafonné à TIMELINE_CAP, trié par created_at desc) ;
+- pull : un auteur avec plus de FANOUT_MAX_FOLLOWERS followers passe en
+  `fanout: "pull"` ; ses followers le gardent dans `pull_authors` et ses posts
+  sont lus à la demande (index user_created) puis fusionnés.
+"""
+from datetime import datetime
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from ..config import settings
+from .feed_service import FEED_PROJECTION, FEED_SORT, Keyset, keyset_filter
+
+
+def _entry(p: dict) -> dict:
+    return {"post_id": p["_id"], "author_id": p["user_id"], "created_at": p["created_at"]}
+
+
+def _push(entries: list[dict]) -> dict:
+    return {
+        "$push": {
+            "items": {
+                "$each": entries,
+                "$sort": {"created_at": -1},
+                "$slice": settings.TIMELINE_CAP,
+            }
+        },
+        "$set": {"updated_at": datetime.utcnow()},
+    }
+
+
+async def follow(db: AsyncIOMotorDatabase, follower: ObjectId, followee: ObjectId) -> bool:
+    """Crée la relation ; retourne False si elle existait déjà."""
+    try:
+        await db.follows.insert_one(
+            {"follower_id": follower, "followee_id": followee, "created_at": datetime.utcnow()}
+        )
+    except DuplicateKeyError:
+        return False
+
+    author = await db.users.find_one_and_update(
+        {"_id": followee},
+        {"$inc": {"followers_count": 1}},
+        projection={"followers_count": 1, "fanout": 1},
+        return_document=ReturnDocument.AFTER,
+    )
+    if author and author.get("fanout") != "pull" and author.get("followers_count", 0) > settings.FANOUT_MAX_FOLLOWERS:
+        await _switch_to_pull(db, followee)
+        author["fanout"] = "pull"
+
+    if author and author.get("fanout") == "pull":
+        await db.timelines.update_one(
+            {"_id": follower},
+            {"$addToSet": {"pull_authors": followee}, "$set": {"updated_at": datetime.utcnow()}},
+            upsert=True,
+        )
+    else:
+        # amorce la timeline avec les derniers posts de l'auteur suivi
+        recent = await db.posts.find(
+            {"user_id": followee, "status": "processed"}, {"_id": 1, "user_id": 1, "created_at": 1}
+        ).sort(FEED_SORT).limit(settings.TIMELINE_BACKFILL).to_list(length=settings.TIMELINE_BACKFILL)
+        if recent:
+            await db.timelines.update_one({"_id": follower}, _push([_entry(p) for p in recent]), upsert=True)
+    return True
+
+
+async def unfollow(db: AsyncIOMotorDatabase, follower: ObjectId, followee: ObjectId) -> bool:
+    res = await db.follows.delete_one({"follower_id": follower, "followee_id": followee})
+    if not res.deleted_count:
+        return False
+    await db.users.update_one({"_id": followee}, {"$inc": {"followers_count": -1}})
+    await db.timelines.update_one(
+        {"_id": follower},
+        {"$pull": {"items": {"author_id": followee}, "pull_authors": followee}},
+    )
+    return True
+
+
+async def _switch_to_pull(db: AsyncIOMotorDatabase, author_id: ObjectId) -> None:
+    """Bascule unique d'un auteur très suivi en mode pull (le worker arrête le fan-out)."""
+    await db.users.update_one({"_id": author_id}, {"$set": {"fanout": "pull"}})
+    ops = []
+    async for f in db.follows.find({"followee_id": author_id}, {"follower_id": 1}):
+        ops.append(UpdateOne(
+            {"_id": f["follower_id"]},
+            {"$addToSet": {"pull_authors": author_id}},
+            upsert=True,
+        ))
+        if len(ops) >= 1000:
+            await db.timelines.bulk_write(ops, ordered=False)
+            ops = []
+    if ops:
+        await db.timelines.bulk_write(ops, ordered=False)
+
+
+async def following_page(db: AsyncIOMotorDatabase, user_id: str, limit: int, before: Keyset | None) -> list[dict]:
+    """Une page du feed following : posts projetés (FEED_PROJECTION), triés desc."""
+    tl = await db.timelines.find_one({"_id": ObjectId(user_id)}, {"items": 1, "pull_authors": 1})
+    if not tl:
+        return []
+
+    ids = []
+    for it in tl.get("items") or []:
+        if before is None or (it["created_at"], it["post_id"]) < before:
+            ids.append(it["post_id"])
+            if len(ids) == limit:
+                break
+
+    posts: dict[ObjectId, dict] = {}
+    if ids:
+        async for p in db.posts.find({"_id": {"$in": ids}}, FEED_PROJECTION):
+            posts[p["_id"]] = p
+
+    pull_authors = tl.get("pull_authors") or []
+    if pull_authors:
+        q = {"user_id": {"$in": pull_authors}, "status": "processed", **keyset_filter(before)}
+        async for p in db.posts.find(q, FEED_PROJECTION).sort(FEED_SORT).limit(limit):
+            posts.setdefault(p["_id"], p)
+
+    page = sorted(posts.values(), key=lambda p: (p["created_at"], p["_id"]), reverse=True)
+    return page[:limit]
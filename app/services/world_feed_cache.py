@@ -0,0 +1,190 @@
+# app/services/world_feed_cache.py
+"""
+Cache en mémoire des pages du feed `scope=world`, identiques pour tous les
+utilisateurs.
+
+- Une page = items JSON prérendus en deux variantes (liked_by_me false/true) ;
+  par requête, seul le `liked_by_me` est superposé (une requête `likes`
+  indexée), puis le corps est assemblé par concaténation.
+- Clé = (curseur, limit) : les curseurs keyset sont stables, les pages
+  profondes se partagent aussi. LRU de WORLD_FEED_CACHE_PAGES pages, TTL
+  WORLD_FEED_CACHE_SECONDS (likes_count).
+- Invalidation : chaque post traité (événements du notifier) ou créé par ce
+  process invalide les pages dont l'intervalle (created_at, _id) le contient.
+- Un seul chargement Mongo par clé à la fois : les requêtes concurrentes
+  attendent le même résultat.
+"""
+import asyncio
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from ..config import settings
+from ..utils.fast_json import dumps
+from .feed_service import FEED_PROJECTION, FEED_SORT, Keyset, encode_cursor, feed_item, keyset_filter, load_authors
+from .likes_service import liked_post_ids
+from .notifier import notifier
+
+log = logging.getLogger("world_feed")
+
+
+@dataclass
+class WorldPage:
+    post_ids: list[ObjectId]
+    fragments: list[tuple[bytes, bytes]]   # item JSON : (liked_by_me false, true)
+    tail: bytes                            # `],"next_cursor":...}`
+    tag: str
+    upper: Optional[Keyset]                # curseur de la page (exclu), None = tête du feed
+    lower: Optional[Keyset]                # dernier item, None = fin du feed
+    expires: float
+
+    def covers(self, key: Keyset) -> bool:
+        return (self.upper is None or key < self.upper) and (self.lower is None or key >= self.lower)
+
+    def render(self, liked: set[ObjectId]) -> tuple[bytes, str]:
+        """(corps JSON, ETag) pour un utilisateur."""
+        mask = 0
+        parts = []
+        for i, (pid, (plain, with_like)) in enumerate(zip(self.post_ids, self.fragments)):
+            if pid in liked:
+                mask |= 1 << i
+                parts.append(with_like)
+            else:
+                parts.append(plain)
+        body = b'{"items":[' + b",".join(parts) + self.tail
+        return body, f'"{self.tag}-{mask:x}"'
+
+
+async def _load_page(db: AsyncIOMotorDatabase, before: Optional[Keyset], limit: int) -> WorldPage:
+    cur = db.posts.find(keyset_filter(before), FEED_PROJECTION).sort(FEED_SORT).limit(limit)
+    posts = await cur.to_list(length=limit)
+    authors = await load_authors(db, [p["user_id"] for p in posts])
+    fragments = []
+    for p in posts:
+        item = feed_item(p, authors.get(str(p["user_id"])))
+        fragments.append((dumps(item), dumps({**item, "liked_by_me": True})))
+    full = len(posts) == limit
+    tail = b'],"next_cursor":' + dumps(encode_cursor(posts[-1]) if full else None) + b"}"
+    digest = hashlib.sha1(b"".join(f for f, _ in fragments) + tail).hexdigest()[:16]
+    return WorldPage(
+        post_ids=[p["_id"] for p in posts],
+        fragments=fragments,
+        tail=tail,
+        tag=digest,
+        upper=before,
+        lower=(posts[-1]["created_at"], posts[-1]["_id"]) if full else None,
+        expires=time.monotonic() + settings.WORLD_FEED_CACHE_SECONDS,
+    )
+
+
+class WorldFeedCache:
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._pages: "OrderedDict[tuple, WorldPage]" = OrderedDict()
+        self._loading: dict[tuple, asyncio.Task] = {}
+        self._generation = 0     # incrémenté à chaque invalidation : un chargement en cours ne s'installe pas
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    async def page(self, db: AsyncIOMotorDatabase, cursor: Optional[str], before: Optional[Keyset],
+                   limit: int) -> WorldPage:
+        key = (cursor or "", limit)
+        page = self._pages.get(key)
+        if page is not None and page.expires > time.monotonic():
+            self._pages.move_to_end(key)
+            self.hits += 1
+            return page
+
+        task = self._loading.get(key)
+        if task is None:
+            self.misses += 1
+            task = asyncio.create_task(self._fill(db, key, before, limit))
+            self._loading[key] = task
+        else:
+            self.hits += 1
+        # shield : un client qui se déconnecte n'annule pas le chargement partagé
+        return await asyncio.shield(task)
+
+    async def _fill(self, db: AsyncIOMotorDatabase, key: tuple, before: Optional[Keyset], limit: int) -> WorldPage:
+        generation = self._generation
+        try:
+            page = await _load_page(db, before, limit)
+        finally:
+            self._loading.pop(key, None)
+        if generation == self._generation:
+            self._pages[key] = page
+            self._pages.move_to_end(key)
+            while len(self._pages) > self.maxsize:
+                self._pages.popitem(last=False)
+        return page
+
+    def invalidate_post(self, created_at: datetime, post_id: ObjectId) -> int:
+        """Retire les pages dont l'intervalle contient ce post (nouveau ou modifié)."""
+        self._generation += 1
+        key = (created_at, post_id)
+        stale = [k for k, page in self._pages.items() if page.covers(key)]
+        for k in stale:
+            del self._pages[k]
+        self.invalidations += len(stale)
+        return len(stale)
+
+    def clear(self) -> None:
+        self._generation += 1
+        self._pages.clear()
+
+    # ---------- tâche de fond ----------
+    def start(self) -> None:
+        if self._task is None:
+            self._queue = notifier.subscribe()
+            self._task = asyncio.create_task(self._consume(), name="world-feed-invalidation")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._queue is not None:
+            notifier.unsubscribe(self._queue)
+            self._queue = None
+
+    async def _consume(self) -> None:
+        while True:
+            event = await self._queue.get()
+            try:
+                if event.get("created_at"):
+                    created_at = datetime.fromisoformat(event["created_at"].rstrip("Z"))
+                    self.invalidate_post(created_at, ObjectId(event["id"]))
+                else:
+                    self.clear()
+            except Exception as e:
+                log.warning("world feed invalidation failed, cache cleared: %s", e)
+                self.clear()
+
+    def stats(self) -> dict:
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "pages": len(self._pages),
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+        }
+
+
+world_feed = WorldFeedCache(settings.WORLD_FEED_CACHE_PAGES)
+
+
+async def render_world_page(db: AsyncIOMotorDatabase, user_id: str, cursor: Optional[str],
+                            before: Optional[Keyset], limit: int) -> tuple[bytes, str]:
+    page = await world_feed.page(db, cursor, before, limit)
+    liked = await liked_post_ids(db, user_id, page.post_ids)
+    return page.render(liked)
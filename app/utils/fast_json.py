@@ -0,0 +1,28 @@
+# app/utils/fast_json.py
+"""
+Réponses JSON des routes chaudes (feed, post) : sérialisées par orjson quand
+il est installé, sinon par le JSONResponse standard.
+
+Les routes retournent directement `FastJSONResponse(payload)` : FastAPI ne
+repasse alors pas le contenu dans jsonable_encoder.
+"""
+import json
+from typing import Any
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # facultatif
+    orjson = None
+
+
+def dumps(content: Any) -> bytes:
+    if orjson is None:
+        return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+    return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
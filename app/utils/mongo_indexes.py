@@ -3,3 +3,18 @@ from motor.motor_asyncio import AsyncIOMotorDatabase
 async def ensure_indexes(db: AsyncIOMotorDatabase):
     await db.posts.create_index([("created_at",-1), ("_id",-1)], name="post_feed_idx")
     await db.turbodex.create_index([("user_id",1), ("vehicle_key",1)], name="user_vehicle_unique", unique=True)
+    await db.posts.create_index([("user_id",1), ("created_at",-1)], name="user_created")
+    await db.posts.create_index([("processed_at",1)], name="processed_at_idx", sparse=True)
+    await db.posts.create_index([("blob_name",1)], name="blob_name_idx")
+    await db.follows.create_index([("follower_id",1), ("followee_id",1)], name="follow_unique", unique=True)
+    await db.follows.create_index([("followee_id",1)], name="by_followee")
+    await db.likes.create_index([("user_id",1), ("post_id",1)], name="user_post_unique", unique=True)
+    await db.likes.create_index([("post_id",1)], name="likes_by_post")
+    await db.refresh_tokens.create_index([("user_id",1), ("jti",1)], name="user_jti_unique", unique=True)
+    await db.refresh_tokens.create_index([("expires_at",1)], name="ttl_by_expires", expireAfterSeconds=0)
+    await db.leaderboard.create_index([("user_id",1), ("period",1)], name="user_period_unique", unique=True)
+    await db.leaderboard.create_index([("period",1), ("points",-1)], name="period_points_desc")
+    await db.capture_days.create_index([("expires_at",1)], name="ttl_by_expires", expireAfterSeconds=0)
+    await db.outbox.create_index([("status",1), ("available_at",1)], name="outbox_due")
+    await db.outbox.create_index([("lease_token",1)], name="outbox_lease", sparse=True)
+    await db.outbox.create_index([("sent_at",1)], name="ttl_by_sent", expireAfterSeconds=86400)
@@ -17,6 +17,31 @@ def _safe_minutes(val, default=15) -> int:
         v = default
     return v
 
+def _keyring(kind: str) -> tuple[dict, str | None, str]:
+    if kind == "refresh":
+        return settings.JWT_REFRESH_KEYS, settings.JWT_REFRESH_ACTIVE_KID, settings.JWT_REFRESH_SECRET
+    return settings.JWT_KEYS, settings.JWT_ACTIVE_KID, settings.JWT_SECRET
+
+def _encode(payload: dict, kind: str) -> str:
+    keys, kid, legacy = _keyring(kind)
+    if kid:
+        return jwt.encode(payload, keys[kid], algorithm="HS256", headers={"kid": kid})
+    return jwt.encode(payload, legacy, algorithm="HS256")
+
+def verification_key(token: str, kind: str = "access") -> str:
+    """
+    Clé de vérification choisie par le `kid` de l'en-tête (sans kid : secret historique).
+    Lève jwt.InvalidTokenError si le kid est inconnu.
+    """
+    keys, _, legacy = _keyring(kind)
+    kid = jwt.get_unverified_header(token).get("kid")
+    if kid is None:
+        return legacy
+    try:
+        return keys[kid]
+    except KeyError:
+        raise jwt.InvalidTokenError("unknown_kid")
+
 def create_access_token(sub: str) -> str:
     iat = now_utc()
     mins = _safe_minutes(settings.JWT_ACCESS_MIN, default=15)
@@ -27,7 +52,7 @@ def create_access_token(sub: str) -> str:
         "iat": int(iat.timestamp()),
         "exp": int(exp.timestamp()),
     }
-    return jwt.encode(payload, settings.JWT_SECRET, algorithm="HS256")
+    return _encode(payload, "access")
 
 def create_refresh_token(sub: str) -> tuple[str, str, int]:
     jti = new_jti()
@@ -40,5 +65,5 @@ def create_refresh_token(sub: str) -> tuple[str, str, int]:
         "iat": int(iat.timestamp()),
         "exp": int(exp.timestamp()),
     }
-    token = jwt.encode(payload, settings.JWT_REFRESH_SECRET, algorithm="HS256")
+    token = _encode(payload, "refresh")
     return token, jti, int(exp.timestamp())
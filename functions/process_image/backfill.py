@@ -0,0 +1,270 @@
+"""
+Retraitement en masse du container raw (nouvelle version du blur / predict)
+et rejeu de la queue poison.
+
+    cd functions
+    python -m process_image.backfill raw --from 20250801 --to 20250831 --workers 32 --rate 40
+    python -m process_image.backfill poison --limit 500
+
+raw : liste raw/ par préfixe de jour (YYYYMMDD/), retrouve les posts des
+blobs (un `find` par page), passe les jobs au pipeline de la Function
+(`process_job`) sur un pool de threads limité à --rate jobs/s, puis écrit
+chaque page en `bulk_write` (`flush_outcomes`). La page suivante est déjà en
+cours pendant l'écriture de la précédente.
+
+Reprise : le checkpoint JSON garde, par jour, le dernier blob dont la page est
+écrite dans Mongo, et les blobs en échec (retentés au passage suivant).
+Relancer la même commande repart de là. Un checkpoint vaut pour une
+AI_MODEL_VERSION (fichier par défaut backfill-v<version>.json, version
+vérifiée au chargement) : la version suivante repart du début. Les blobs sans post (upload abandonné) sont ignorés sauf --orphans.
+
+poison : renvoie les messages de <queue>-poison dans la queue principale
+(traités ensuite par la Function / le worker, avec leurs retries).
+"""
+import argparse
+import itertools
+import json
+import logging
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Iterator, Optional
+
+from .pipeline import AI_MODEL_VERSION, RAW_CONT, Clients, JobFailed, flush_outcomes, process_job
+from .worker import MAX_BATCH, POISON_QUEUE_NAME, QUEUE_NAME, _queue
+
+logger = logging.getLogger("process_image.backfill")
+
+DAY_RE = re.compile(r"^\d{8}$")
+PAGE_SIZE = 200          # blobs par page : un find posts + un flush Mongo
+LIST_PAGE_SIZE = 5000    # max du service Blob par appel de listing
+MAX_FAILED_KEPT = 1000   # blobs en échec gardés par jour dans le checkpoint
+
+
+class RateLimiter:
+    """Seau à jetons : `rate` opérations/s en moyenne, rafale d'une seconde. 0 = illimité."""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.capacity = max(1.0, rate)
+        self.tokens = self.capacity
+        self._last = time.monotonic()
+
+    def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self._last) * self.rate)
+            self._last = now
+            if self.tokens >= 1.0:
+                self.tokens -= 1.0
+                return
+            time.sleep((1.0 - self.tokens) / self.rate)
+
+
+class Checkpoint:
+    """{"model_version": v, "days": {"20250801": {"after": blob, "done": bool, "processed": n, "failed": [...]}}}"""
+
+    def __init__(self, path: Optional[str], model_version: str = AI_MODEL_VERSION):
+        self.path = path
+        self.model_version = model_version
+        self.days: dict = {}
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as fh:
+                data = json.load(fh)
+            if data.get("model_version") != model_version:
+                # jours "done" pour une autre version : les reprendre sauterait tout le retraitement
+                raise ValueError(f"checkpoint {path} is for AI_MODEL_VERSION={data.get('model_version')!r}, "
+                                 f"not {model_version!r}")
+            self.days = data.get("days", {})
+
+    def day(self, day: str) -> dict:
+        return self.days.setdefault(day, {"after": None, "done": False, "processed": 0, "failed": []})
+
+    def save(self) -> None:
+        if not self.path:
+            return
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump({"model_version": self.model_version, "days": self.days,
+                       "updated_at": datetime.utcnow().isoformat() + "Z"}, fh, indent=1)
+        os.replace(tmp, self.path)  # atomique : jamais de checkpoint à moitié écrit
+
+
+def list_days(container, day_from: Optional[str], day_to: Optional[str]) -> list[str]:
+    """Préfixes YYYYMMDD présents dans raw/ (un listing avec délimiteur), bornés par --from / --to."""
+    if day_from and day_to:
+        start, end = datetime.strptime(day_from, "%Y%m%d"), datetime.strptime(day_to, "%Y%m%d")
+        return [(start + timedelta(days=i)).strftime("%Y%m%d") for i in range((end - start).days + 1)]
+    days = []
+    for item in container.walk_blobs(delimiter="/"):
+        day = item.name.rstrip("/")
+        if DAY_RE.match(day) and (not day_from or day >= day_from) and (not day_to or day <= day_to):
+            days.append(day)
+    return sorted(days)
+
+
+def iter_pages(container, day: str, after: Optional[str], size: int = PAGE_SIZE) -> Iterator[list[str]]:
+    """Noms de blobs du jour, par pages de `size`, strictement après `after` (ordre du listing)."""
+    page: list[str] = []
+    for blob in container.list_blobs(name_starts_with=f"{day}/", results_per_page=LIST_PAGE_SIZE):
+        if after and blob.name <= after:
+            continue
+        page.append(blob.name)
+        if len(page) >= size:
+            yield page
+            page = []
+    if page:
+        yield page
+
+
+def jobs_for(db, names: list[str], force: bool, orphans: bool) -> list[dict]:
+    """Un job par blob de la page ; post_id retrouvé par blob_name (index blob_name_idx)."""
+    posts = {}
+    if db is not None:
+        for p in db.posts.find({"blob_name": {"$in": names}}, {"_id": 1, "blob_name": 1}):
+            posts[p["blob_name"]] = str(p["_id"])
+    jobs = []
+    for name in names:
+        post_id = posts.get(name)
+        if post_id or orphans:
+            jobs.append({"post_id": post_id, "blob_name": name, "force": force})
+    return jobs
+
+
+def backfill_raw(clients: Clients, days: list[str], checkpoint: Checkpoint, workers: int, rate: float,
+                 force: bool = False, orphans: bool = False, dry_run: bool = False) -> dict:
+    container = clients.blob.get_container_client(RAW_CONT)
+    limiter = RateLimiter(rate)
+    totals = {"listed": 0, "submitted": 0, "processed": 0, "failed": 0}
+    t0 = time.perf_counter()
+
+    def complete(batch) -> None:
+        day, last, futures = batch
+        outcomes, failed = [], []
+        for name, f in futures:
+            try:
+                outcomes.append(f.result())
+            except JobFailed:
+                failed.append(name)
+        flush_outcomes(clients.db, outcomes)   # lève : le checkpoint n'avance pas
+        state = checkpoint.day(day)
+        state["after"] = last
+        state["processed"] += len(outcomes)
+        state["failed"] = (state["failed"] + failed)[-MAX_FAILED_KEPT:]
+        checkpoint.save()
+        totals["processed"] += len(outcomes)
+        totals["failed"] += len(failed)
+        elapsed = time.perf_counter() - t0
+        logger.info("%s up to %s: processed=%d failed=%d (%.1f jobs/s)",
+                    day, last, totals["processed"], totals["failed"], totals["processed"] / elapsed)
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="backfill") as pool:
+        for day in days:
+            state = checkpoint.day(day)
+            if state["done"] and not state["failed"]:
+                continue
+            # blobs en échec lors d'un passage précédent : retentés en premier
+            retry, state["failed"] = state["failed"], []
+            pages = itertools.chain([retry] if retry else [], iter_pages(container, day, state["after"]))
+            pending = None
+            for i, names in enumerate(pages):
+                totals["listed"] += len(names)
+                if dry_run:
+                    continue
+                futures = []
+                for job in jobs_for(clients.db, names, force, orphans):
+                    limiter.acquire()
+                    futures.append((job["blob_name"], pool.submit(process_job, clients, job)))
+                totals["submitted"] += len(futures)
+                # page de retry : ne fait pas avancer le filigrane
+                last = names[-1] if (i > 0 or not retry) else state["after"]
+                if pending is not None:
+                    complete(pending)
+                pending = (day, last, futures)
+            if pending is not None:
+                complete(pending)
+            if not dry_run:
+                state["done"] = True
+                checkpoint.save()
+    return totals
+
+
+def replay_poison(limit: int, rate: float, dry_run: bool = False) -> int:
+    poison, queue = _queue(POISON_QUEUE_NAME), _queue(QUEUE_NAME)
+    try:
+        if dry_run:
+            return poison.get_queue_properties().approximate_message_count
+        limiter = RateLimiter(rate)
+        moved = 0
+        while moved < limit:
+            n = min(MAX_BATCH, limit - moved)
+            msgs = list(poison.receive_messages(messages_per_page=n, max_messages=n, visibility_timeout=120))
+            if not msgs:
+                break
+            for m in msgs:
+                limiter.acquire()
+                queue.send_message(m.content)
+                poison.delete_message(m)   # après l'envoi : au pire un doublon, jamais une perte
+                moved += 1
+            logger.info("poison: %d messages requeued to %s", moved, QUEUE_NAME)
+        return moved
+    finally:
+        poison.close()
+        queue.close()
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Retraitement du container raw / rejeu de la queue poison")
+    ap.add_argument("-v", "--verbose", action="store_true", help="logs du pipeline pour chaque job")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    raw = sub.add_parser("raw", help="retraite les images de raw/ jour par jour")
+    raw.add_argument("--from", dest="day_from", help="premier jour (YYYYMMDD, inclus)")
+    raw.add_argument("--to", dest="day_to", help="dernier jour (YYYYMMDD, inclus)")
+    raw.add_argument("--workers", type=int, default=int(os.getenv("WORKER_COUNT", "16")),
+                     help="jobs en parallèle (I/O : blob, IA, Mongo)")
+    raw.add_argument("--rate", type=float, default=0, help="jobs/s max (protège les endpoints IA ; 0 = illimité)")
+    raw.add_argument("--checkpoint", default=f"backfill-v{AI_MODEL_VERSION}.json",
+                     help="fichier de reprise, propre à AI_MODEL_VERSION (défaut : %(default)s)")
+    raw.add_argument("--force", action="store_true",
+                     help="ignore le cache ai_results (sinon : incrémenter AI_MODEL_VERSION)")
+    raw.add_argument("--orphans", action="store_true", help="traite aussi les blobs sans post")
+    raw.add_argument("--dry-run", action="store_true", help="compte les blobs sans rien traiter")
+
+    poison = sub.add_parser("poison", help=f"renvoie {POISON_QUEUE_NAME} dans {QUEUE_NAME}")
+    poison.add_argument("--limit", type=int, default=1000, help="messages max")
+    poison.add_argument("--rate", type=float, default=0, help="messages/s max (0 = illimité)")
+    poison.add_argument("--dry-run", action="store_true", help="affiche le nombre de messages en poison")
+
+    args = ap.parse_args()
+    logging.getLogger("process_image").setLevel(logging.INFO if args.verbose else logging.WARNING)
+    logger.setLevel(logging.INFO)
+
+    if args.cmd == "poison":
+        n = replay_poison(args.limit, args.rate, args.dry_run)
+        print(f"{n} messages {'in ' + POISON_QUEUE_NAME if args.dry_run else 'requeued'}")
+        return
+
+    for d in (args.day_from, args.day_to):
+        if d and not DAY_RE.match(d):
+            ap.error(f"bad day {d!r}, expected YYYYMMDD")
+    clients = Clients()
+    try:
+        days = list_days(clients.blob.get_container_client(RAW_CONT), args.day_from, args.day_to)
+        try:
+            checkpoint = Checkpoint(args.checkpoint)
+        except ValueError as e:
+            ap.error(str(e))
+        totals = backfill_raw(clients, days, checkpoint, max(1, args.workers), args.rate,
+                              args.force, args.orphans, args.dry_run)
+    finally:
+        clients.close()
+    print(f"days={len(days)} " + " ".join(f"{k}={v}" for k, v in totals.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""
+Index local des véhicules de référence (data/cars/img) : reconnaissance de
+secours quand IA_PREDICT_URL est absent, lent ou en panne.
+
+Chaque image du catalogue est réduite à une signature compacte (forme en
+niveaux de gris 16x16 + histogramme couleur 4x4x4), stockée en float16 dans un
+.npy et convertie une fois en float32 au chargement (~2 Mo pour 1 700
+références). La recherche est un produit matrice-vecteur : similarité cosinus
+contre tout le catalogue.
+
+Repli désactivé par défaut (LOCAL_MATCH_ENABLED) : le seuil n'est pas validé
+sur de vraies photos (test.jpg : meilleur score 0.506 ; des modèles voisins
+dépassent 0.85). Activé, ses résultats restent marqués basse confiance et
+n'alimentent ni turbodex ni vehicle_stats (cf. pipeline.build_outcome).
+
+Construction (hors ligne, à relancer quand data/cars/img change) :
+
+    cd functions && python -m process_image.car_index --src ../data/cars/img
+"""
+import argparse
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+import numpy as np
+from PIL import Image
+
+from .imaging import open_image
+
+logger = logging.getLogger("process_image")
+
+INDEX_PATH = os.getenv("CAR_INDEX_PATH") or os.path.join(os.path.dirname(__file__), "data", "car_index")
+LOCAL_MATCH_ENABLED = (os.getenv("LOCAL_MATCH_ENABLED") or "").strip().lower() in ("1", "true", "yes")
+MATCH_MIN_SCORE = float(os.getenv("LOCAL_MATCH_MIN_SCORE", "0.85"))
+SIGNATURE = "gray16+rgb444/v1"
+
+GRAY_EDGE = 16
+COLOR_LEVELS = 4
+SHAPE_WEIGHT, COLOR_WEIGHT = 0.8, 0.6
+DIMS = GRAY_EDGE * GRAY_EDGE + COLOR_LEVELS ** 3
+
+
+def load_makes(path: str) -> dict:
+    """
+    data/cars/makes.json : préfixe de nom de fichier -> marque (les fautes du
+    dataset y sont corrigées, ex. "BWM" -> "BMW"). Partagé avec le catalogue API.
+    """
+    with open(path, encoding="utf-8") as fh:
+        return json.load(fh)
+
+
+def parse_label(stem: str, makes: dict) -> tuple[str, str]:
+    """"Benz C Class AMG" -> ("Mercedes-Benz", "C Class AMG") ; "Accent" -> ("Unknown", "Accent")."""
+    # préfixes les plus longs d'abord ("AC Schnitzer" avant un éventuel "AC")
+    for prefix in sorted(makes, key=len, reverse=True):
+        if stem == prefix:
+            return makes[prefix], "Unknown"
+        if stem.startswith(prefix + " "):
+            return makes[prefix], stem[len(prefix) + 1:].strip()
+    return "Unknown", stem.strip()
+
+
+def signature(img: Image.Image) -> np.ndarray:
+    """Vecteur float32 de norme 1 (DIMS composantes)."""
+    gray = np.asarray(img.convert("L").resize((GRAY_EDGE, GRAY_EDGE), Image.BILINEAR), dtype=np.float32).ravel()
+    gray -= gray.mean()
+    gray /= np.linalg.norm(gray) or 1.0
+
+    rgb = np.asarray(img.convert("RGB").resize((64, 64), Image.BILINEAR), dtype=np.uint16)
+    q = rgb * COLOR_LEVELS // 256
+    bins = np.bincount(((q[..., 0] * COLOR_LEVELS + q[..., 1]) * COLOR_LEVELS + q[..., 2]).ravel(),
+                       minlength=COLOR_LEVELS ** 3).astype(np.float32)
+    hist = np.sqrt(bins)  # Hellinger : atténue les aplats (fond, carrosserie)
+    hist /= np.linalg.norm(hist) or 1.0
+
+    sig = np.concatenate([gray * SHAPE_WEIGHT, hist * COLOR_WEIGHT])
+    return sig / (np.linalg.norm(sig) or 1.0)
+
+
+def signature_from_bytes(data: bytes) -> np.ndarray:
+    # décodage JPEG réduit (draft) : seule une vignette 64 px est utile
+    return signature(open_image(data, max_edge=64))
+
+
+def _file_signature(path: str) -> Optional[np.ndarray]:
+    try:
+        with open(path, "rb") as f:
+            return signature_from_bytes(f.read())
+    except Exception as e:
+        logger.warning("car_index: skip %s (%s)", path, e)
+        return None
+
+
+def build(src: str, out: str = INDEX_PATH, workers: Optional[int] = None) -> int:
+    """Écrit <out>.npy (signatures float16) et <out>.json (libellés). Retourne le nombre d'images."""
+    makes = load_makes(os.path.join(src, "..", "makes.json"))
+    files = sorted(f for f in os.listdir(src) if f.lower().endswith((".jpg", ".jpeg", ".png", ".webp")))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        sigs = list(pool.map(_file_signature, [os.path.join(src, f) for f in files], chunksize=32))
+
+    labels, rows = [], []
+    for f, sig in zip(files, sigs):
+        if sig is None:
+            continue
+        make, model = parse_label(os.path.splitext(f)[0], makes)
+        labels.append({"file": f, "make": make, "model": model})
+        rows.append(sig)
+
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    np.save(out + ".npy", np.asarray(rows, dtype=np.float16).reshape(len(rows), DIMS))
+    with open(out + ".json", "w", encoding="utf-8") as fh:
+        json.dump({"signature": SIGNATURE, "labels": labels}, fh, ensure_ascii=False)
+    return len(labels)
+
+
+class CarIndex:
+    def __init__(self, path: str = INDEX_PATH):
+        with open(path + ".json", encoding="utf-8") as fh:
+            meta = json.load(fh)
+        if meta.get("signature") != SIGNATURE:
+            raise ValueError(f"car index built with {meta.get('signature')}, expected {SIGNATURE}")
+        self.labels = meta["labels"]
+        self.matrix = np.load(path + ".npy").astype(np.float32)   # pas de conversion par recherche
+        if self.matrix.shape != (len(self.labels), DIMS):
+            raise ValueError(f"car index shape {self.matrix.shape} does not match labels")
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    def search(self, sig: np.ndarray, k: int = 5) -> list[tuple[dict, float]]:
+        scores = self.matrix @ sig
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.labels[i], float(scores[i])) for i in top]
+
+    def match(self, data: bytes, min_score: float = MATCH_MIN_SCORE) -> Optional[dict]:
+        """
+        Payload au format du predict ({make, model, confidence, ...}) pour la
+        meilleure référence, ou None sous `min_score`.
+        """
+        hits = self.search(signature_from_bytes(data), k=2)
+        if not hits or hits[0][1] < min_score:
+            return None
+        label, score = hits[0]
+        runner_up = hits[1][1] if len(hits) > 1 else min_score
+        # proche du seuil ou à égalité avec la 2e référence -> confiance faible
+        confidence = (score - min_score) / (1.0 - min_score) if min_score < 1.0 else 1.0
+        confidence *= min(1.0, 0.5 + (score - runner_up) * 10)
+        return {
+            "make": label["make"],
+            "model": label["model"],
+            "confidence": round(max(0.0, min(1.0, confidence)), 3),
+            "score": round(score, 4),
+            "reference": label["file"],
+            "source": "local_index",
+            "low_confidence": True,
+        }
+
+
+_index: Optional[CarIndex] = None
+_index_loaded = False
+_index_lock = threading.Lock()
+
+
+def get_index() -> Optional[CarIndex]:
+    """Index du process (chargé au premier appel), None s'il n'a pas été construit."""
+    global _index, _index_loaded
+    if _index_loaded:
+        return _index
+    with _index_lock:
+        if not _index_loaded:
+            try:
+                _index = CarIndex()
+                logger.info("car index loaded: %d references", len(_index))
+            except FileNotFoundError:
+                logger.info("car index not built (%s), local matching disabled", INDEX_PATH)
+            except Exception as e:
+                logger.warning("car index unusable: %s", e)
+            _index_loaded = True
+    return _index
+
+
+def main() -> None:
+    default_src = os.path.join(os.path.dirname(__file__), "..", "..", "data", "cars", "img")
+    ap = argparse.ArgumentParser(description="Construit l'index local des véhicules de référence")
+    ap.add_argument("--src", default=os.path.normpath(default_src), help="dossier des images de référence")
+    ap.add_argument("--out", default=INDEX_PATH, help="préfixe de sortie (.npy + .json)")
+    ap.add_argument("--workers", type=int, default=None, help="process de calcul (défaut : un par cœur)")
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    n = build(args.src, args.out, args.workers)
+    print(f"{n} references -> {args.out}.npy / {args.out}.json")
+
+
+if __name__ == "__main__":
+    main()
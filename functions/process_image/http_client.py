@@ -0,0 +1,134 @@
+"""
+Client HTTP des modèles IA (blur / predict) : session poolée keep-alive,
+retries bornés avec backoff, et un circuit breaker par endpoint pour sauter
+vite une étape dont le serveur est en panne au lieu d'attendre HTTP_TIMEOUT
+à chaque image.
+"""
+import mimetypes
+import os
+import threading
+import time
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT_SECONDS", "20"))           # lecture
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT_SECONDS", "3"))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "2"))
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "32"))
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))               # échecs consécutifs
+BREAKER_RESET_SECONDS = float(os.getenv("BREAKER_RESET_SECONDS", "30"))
+
+
+class CircuitOpen(Exception):
+    """L'endpoint est considéré en panne : l'appel n'est pas tenté."""
+
+
+class CircuitBreaker:
+    """
+    closed -> open après BREAKER_FAILURES échecs consécutifs ; open -> half-open
+    après BREAKER_RESET_SECONDS (un seul appel d'essai) ; succès -> closed.
+    """
+
+    def __init__(self, name: str, failures: int = BREAKER_FAILURES, reset_after: float = BREAKER_RESET_SECONDS):
+        self.name = name
+        self.failures = failures
+        self.reset_after = reset_after
+        self._lock = threading.Lock()
+        self._count = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.reset_after:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def success(self) -> None:
+        with self._lock:
+            self._count = 0
+            self._opened_at = None
+            self._probing = False
+
+    def failure(self) -> None:
+        with self._lock:
+            self._count += 1
+            if self._probing or self._count >= self.failures:
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+
+_breakers: dict = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker_for(url: str) -> CircuitBreaker:
+    with _breakers_lock:
+        b = _breakers.get(url)
+        if b is None:
+            b = _breakers[url] = CircuitBreaker(url)
+        return b
+
+
+def make_session() -> requests.Session:
+    retry = Retry(
+        total=HTTP_RETRIES,
+        connect=HTTP_RETRIES,
+        read=0,                       # pas de retry après un timeout de lecture (déjà payé)
+        status=HTTP_RETRIES,
+        backoff_factor=0.3,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset({"POST"}),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE, max_retries=retry)
+    s = requests.Session()
+    s.mount("http://", adapter)
+    s.mount("https://", adapter)
+    return s
+
+
+def post_image(session: requests.Session, url: str, field_name: str, filename: str, content: bytes,
+               mime: Optional[str] = None, accept: Optional[str] = None) -> requests.Response:
+    """
+    POST multipart d'une image. Lève CircuitOpen sans appel réseau si le
+    breaker de l'endpoint est ouvert ; les erreurs réseau et 5xx l'alimentent
+    (un 4xx vient de la requête, pas du serveur).
+    """
+    breaker = breaker_for(url)
+    if not breaker.allow():
+        raise CircuitOpen(url)
+    mime = mime or (mimetypes.guess_type(filename)[0] or "application/octet-stream")
+    headers = {"Accept": accept} if accept else {}
+    try:
+        r = session.post(
+            url,
+            files={field_name: (filename, content, mime)},
+            headers=headers,
+            timeout=(HTTP_CONNECT_TIMEOUT, HTTP_TIMEOUT),
+        )
+    except BaseException:
+        # toute erreur (pas seulement réseau) : un essai half-open ne reste jamais en cours
+        breaker.failure()
+        raise
+    if r.status_code >= 500:
+        breaker.failure()
+    else:
+        breaker.success()
+    r.raise_for_status()
+    return r
@@ -0,0 +1,67 @@
+"""
+Traitements d'image locaux (Pillow) : normalisation avant inférence et
+dérivés multi-résolution pour le feed.
+"""
+import os
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+# (nom, plus grand côté en px) — du plus grand au plus petit : chaque taille est
+# réduite depuis la précédente, pas depuis l'original.
+DERIVATIVES = (("full", 2048), ("feed", 1080), ("thumb", 320))
+WEBP_QUALITY = int(os.getenv("WEBP_QUALITY", "80"))
+DERIVATIVE_MIME = "image/webp"
+
+# Entrées des modèles : le blur rend l'image affichée (jusqu'au dérivé "full"),
+# le predict n'a besoin que d'une vignette.
+BLUR_MAX_EDGE = int(os.getenv("BLUR_MAX_EDGE", "2048"))
+PREDICT_MAX_EDGE = int(os.getenv("PREDICT_MAX_EDGE", "1024"))
+INFER_JPEG_QUALITY = int(os.getenv("INFER_JPEG_QUALITY", "88"))
+INFER_MIME = "image/jpeg"
+
+
+def open_image(data: bytes, max_edge: int | None = None) -> Image.Image:
+    img = Image.open(BytesIO(data))
+    if max_edge:
+        # JPEG : décodage directement à 1/2, 1/4 ou 1/8 si ça reste >= max_edge
+        img.draft("RGB", (max_edge, max_edge))
+    img = ImageOps.exif_transpose(img)  # orientation appliquée, tag EXIF retiré
+    if img.mode not in ("RGB", "RGBA"):
+        img = img.convert("RGB")
+    return img
+
+
+def prepare_for_inference(data: bytes, max_edge: int) -> bytes:
+    """
+    JPEG orienté (EXIF appliqué), sans métadonnées (GPS, appareil...), plus
+    grand côté <= max_edge. Lève si l'image n'est pas décodable.
+    """
+    img = open_image(data, max_edge)
+    if img.mode != "RGB":
+        img = img.convert("RGB")  # JPEG : pas d'alpha
+    if max(img.size) > max_edge:
+        img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+    buf = BytesIO()
+    img.save(buf, format="JPEG", quality=INFER_JPEG_QUALITY, optimize=True)
+    return buf.getvalue()
+
+
+def make_derivatives(data: bytes) -> dict:
+    """{nom: octets WebP} pour chaque taille de DERIVATIVES (jamais agrandie)."""
+    img = open_image(data)
+    out = {}
+    for name, edge in DERIVATIVES:
+        if max(img.size) > edge:
+            img = img.copy()
+            img.thumbnail((edge, edge), Image.LANCZOS)
+        buf = BytesIO()
+        img.save(buf, format="WEBP", quality=WEBP_QUALITY, method=4)
+        out[name] = buf.getvalue()
+    return out
+
+
+def derivative_blob_name(blob_name: str, name: str) -> str:
+    # 20250101/<uuid>.jpg -> 20250101/<uuid>/feed.webp
+    stem = os.path.splitext(blob_name)[0]
+    return f"{stem}/{name}.webp"
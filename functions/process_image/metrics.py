@@ -0,0 +1,122 @@
+"""
+Temps par étape du pipeline (download, decode, blur, predict, local_match,
+upload, derivatives, mongo, job) et des commandes Mongo.
+
+- Chaque job logge une ligne `timings` (Function : visible dans les logs
+  Azure) ;
+- le worker expose les histogrammes au format Prometheus avec
+  `--metrics-port` (GET /metrics, un port par process).
+"""
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterable, Optional
+
+try:
+    from pymongo import monitoring
+except Exception:
+    monitoring = None
+
+BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+# même rendu que app/services/metrics.py (l'app Functions est déployée sans le package `app`)
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Histogram:
+    def __init__(self, name: str, doc: str, labels: Iterable[str] = (), buckets: Iterable[float] = BUCKETS):
+        self.name, self.doc, self.labels = name, doc, tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series: dict = {}   # valeurs de labels -> [n par bucket..., somme, total]
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float, *label_values: str) -> None:
+        i = 0
+        while i < len(self.buckets) and seconds > self.buckets[i]:
+            i += 1
+        with self._lock:
+            series = self._series.setdefault(label_values, [0] * (len(self.buckets) + 3))
+            series[i] += 1
+            series[-2] += seconds
+            series[-1] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = {k: list(v) for k, v in self._series.items()}
+        for values, series in sorted(snapshot.items()):
+            base = ",".join(f'{k}="{_escape(v)}"' for k, v in zip(self.labels, values))
+            sep = "," if base else ""
+            cum = 0
+            for le, n in zip(self.buckets, series):
+                cum += n
+                lines.append(f'{self.name}_bucket{{{base}{sep}le="{le}"}} {cum}')
+            lines.append(f'{self.name}_bucket{{{base}{sep}le="+Inf"}} {series[-1]}')
+            lines.append(f"{self.name}_sum{{{base}}} {series[-2]:.6f}")
+            lines.append(f"{self.name}_count{{{base}}} {series[-1]}")
+        return lines
+
+
+STAGE_SECONDS = Histogram("process_image_stage_seconds", "Pipeline stage duration", ("stage",))
+MONGO_SECONDS = Histogram("mongo_command_duration_seconds", "MongoDB command latency", ("command", "outcome"))
+
+
+def render() -> str:
+    return "\n".join(STAGE_SECONDS.render() + MONGO_SECONDS.render()) + "\n"
+
+
+@contextmanager
+def timed(stage: str, timings: Optional[dict] = None):
+    """Mesure un bloc : histogramme + `timings[stage]` (cumulé) pour la ligne de log du job."""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        dt = time.perf_counter() - t0
+        STAGE_SECONDS.observe(dt, stage)
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + dt
+
+
+def format_timings(timings: dict) -> str:
+    return " ".join(f"{stage}={dt * 1000:.0f}ms" for stage, dt in timings.items())
+
+
+if monitoring is not None:
+    class MongoCommandTimer(monitoring.CommandListener):
+        def started(self, event) -> None:
+            pass
+
+        def succeeded(self, event) -> None:
+            MONGO_SECONDS.observe(event.duration_micros / 1e6, event.command_name, "ok")
+
+        def failed(self, event) -> None:
+            MONGO_SECONDS.observe(event.duration_micros / 1e6, event.command_name, "error")
+else:
+    MongoCommandTimer = None
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass  # pas un log par scrape
+
+
+def serve(port: int) -> ThreadingHTTPServer:
+    """Expose GET /metrics sur `port` (thread daemon)."""
+    server = ThreadingHTTPServer(("0.0.0.0", port), _Handler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
@@ -0,0 +1,695 @@
+"""
+Pipeline de traitement d'une image (download RAW -> blur -> predict -> upload
+PROCESSED -> updates Mongo), partagé par la Function (un message par appel)
+et par le worker autonome (`python -m process_image.worker`, lots de messages).
+
+Les clients (Blob, HTTP, Mongo) sont créés une fois par process et réutilisés ;
+les écritures Mongo d'un lot sont regroupées en `bulk_write`.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Optional
+
+import requests
+from azure.storage.blob import BlobServiceClient, ContentSettings
+
+from .http_client import CircuitOpen, make_session, post_image
+from .metrics import MongoCommandTimer, format_timings, timed
+from .rarity import UNKNOWN_KEY, rarity_table
+from .imaging import (
+    BLUR_MAX_EDGE,
+    DERIVATIVE_MIME,
+    INFER_MIME,
+    PREDICT_MAX_EDGE,
+    derivative_blob_name,
+    make_derivatives,
+    prepare_for_inference,
+)
+
+try:
+    from pymongo import DeleteOne, MongoClient, UpdateOne
+    from pymongo.errors import BulkWriteError
+except Exception:
+    MongoClient = None
+
+try:
+    from bson import ObjectId  # type: ignore
+except Exception:
+    ObjectId = None  # facultatif
+
+# ---------- Logger ----------
+logger = logging.getLogger("process_image")
+if not logger.handlers:
+    handler = logging.StreamHandler()
+    formatter = logging.Formatter("[%(name)s] %(levelname)s: %(message)s")
+    handler.setFormatter(formatter)
+    logger.addHandler(handler)
+logger.setLevel(logging.INFO)
+
+# ---------- Config ----------
+RAW_CONT = os.getenv("AZURE_BLOB_CONTAINER_RAW", "raw") or "raw"
+PROC_CONT = os.getenv("AZURE_BLOB_CONTAINER_PROCESSED", "processed") or "processed"
+
+BLUR_URL = (os.getenv("IA_BLUR_URL") or "").strip()
+PREDICT_URL = (os.getenv("IA_PREDICT_URL") or "").strip()
+# predict sur l'image brute, en parallèle du blur (au lieu de predict sur l'image floutée)
+PREDICT_ON_RAW = (os.getenv("PREDICT_ON_RAW") or "").strip().lower() in ("1", "true", "yes")
+TIMELINE_CAP = int(os.getenv("TIMELINE_CAP", "500"))
+# à incrémenter quand blur/predict changent : invalide le cache ai_results
+AI_MODEL_VERSION = os.getenv("AI_MODEL_VERSION", "1")
+MONGO_RETRY_SECONDS = 30.0
+
+
+def storage_conn_str() -> str:
+    cs = os.getenv("AzureWebJobsStorage") or os.getenv("StorageConn")
+    if not cs:
+        raise RuntimeError("AzureWebJobsStorage/StorageConn missing")
+    return cs
+
+
+def _blob_client() -> BlobServiceClient:
+    return BlobServiceClient.from_connection_string(storage_conn_str())
+
+
+def _mongo():
+    uri = os.getenv("MONGO_URI")
+    dbn = os.getenv("DB_NAME", "turbodex")
+    if not uri or MongoClient is None:
+        logger.info("Mongo disabled (no URI or pymongo missing)")
+        return None, None
+    try:
+        listeners = [MongoCommandTimer()] if MongoCommandTimer else []
+        cli = MongoClient(uri, serverSelectionTimeoutMS=3000, event_listeners=listeners)
+        cli.admin.command("ping")
+        return cli, cli[dbn]
+    except Exception as e:
+        logger.warning("Mongo unreachable: %s", e)
+        return None, None
+
+
+class Clients:
+    """Clients Blob / HTTP / Mongo partagés entre messages (thread-safe)."""
+
+    def __init__(self):
+        self.blob = _blob_client()
+        self.http = make_session()
+        self._lock = threading.Lock()
+        self._mongo_cli, self._db = _mongo()
+        self._mongo_checked = time.monotonic()
+
+    @property
+    def db(self):
+        # Mongo indisponible au démarrage : nouvel essai au plus toutes les 30 s
+        if self._db is None and time.monotonic() - self._mongo_checked > MONGO_RETRY_SECONDS:
+            with self._lock:
+                if self._db is None:
+                    self._mongo_cli, self._db = _mongo()
+                    self._mongo_checked = time.monotonic()
+        return self._db
+
+    def close(self) -> None:
+        self.http.close()
+        self.blob.close()
+        if self._mongo_cli is not None:
+            self._mongo_cli.close()
+
+
+_clients: Optional[Clients] = None
+_clients_lock = threading.Lock()
+
+
+def get_clients() -> Clients:
+    global _clients
+    if _clients is None:
+        with _clients_lock:
+            if _clients is None:
+                _clients = Clients()
+    return _clients
+
+
+# Étapes parallèles d'un même job (predict pendant le blur)
+_stage_pool = ThreadPoolExecutor(max_workers=int(os.getenv("STAGE_THREADS", "16")), thread_name_prefix="stage")
+# Jobs d'une même enveloppe (pool distinct : un job attend ses étapes sur _stage_pool)
+_job_pool = ThreadPoolExecutor(max_workers=int(os.getenv("ENVELOPE_THREADS", "8")), thread_name_prefix="envelope")
+
+
+def _http_post_image(http: requests.Session, url: str, field_name: str, filename: str, content: bytes,
+                     mime: Optional[str] = None, accept: Optional[str] = None):
+    try:
+        return post_image(http, url, field_name, filename, content, mime=mime, accept=accept)
+    except CircuitOpen:
+        raise
+    except requests.HTTPError as e:
+        r = e.response
+        logger.error("HTTP POST %s -> %s %s", url, r.status_code, (r.text or "")[:500])
+        raise
+
+
+def _prepare(content: bytes, mime: str, max_edge: int) -> tuple:
+    """(bytes, mime) réduits pour un modèle ; l'entrée telle quelle si Pillow ne la décode pas."""
+    try:
+        out = prepare_for_inference(content, max_edge)
+    except Exception as e:
+        logger.warning("preprocess skipped (decode): %s", e)
+        return content, mime
+    logger.info("preprocess %d -> %d bytes (max_edge=%d)", len(content), len(out), max_edge)
+    return out, INFER_MIME
+
+
+def _blur(clients: "Clients", blob_name: str, content: bytes, mime: str = "image/jpeg") -> Optional[tuple]:
+    """(bytes, mime) floutés, ou None si l'étape échoue / est court-circuitée."""
+    try:
+        r = _http_post_image(
+            clients.http,
+            url=BLUR_URL,
+            field_name="file",
+            filename=os.path.basename(blob_name) or "image.jpg",
+            content=content,
+            mime=mime,
+            accept="image/png",
+        )
+        mime = r.headers.get("Content-Type") or "image/png"
+        logger.info("blur ok bytes=%d mime=%s", len(r.content), mime)
+        return r.content, mime
+    except CircuitOpen:
+        logger.warning("blur skipped: circuit open")
+    except Exception as e:
+        logger.warning("blur failed, keep raw: %s", e)
+    return None
+
+
+def _predict(clients: "Clients", blob_name: str, content: bytes, mime: str) -> Optional[dict]:
+    try:
+        predict_url = PREDICT_URL if PREDICT_URL.endswith("/") else PREDICT_URL + "/"
+        r = _http_post_image(
+            clients.http,
+            url=predict_url,
+            field_name="file",
+            filename=os.path.basename(blob_name) or "image.png",
+            content=content,
+            mime=mime,
+        )
+        tags_payload = r.json()
+        if isinstance(tags_payload, dict):
+            logger.info("predict ok keys=%s", list(tags_payload.keys()))
+        else:
+            logger.info("predict ok type=%s", type(tags_payload))
+        return tags_payload
+    except CircuitOpen:
+        logger.warning("predict skipped: circuit open")
+    except Exception as e:
+        logger.warning("predict failed: %s", e)
+    return None
+
+
+def _timed_predict(clients: "Clients", blob_name: str, content: bytes, mime: str) -> tuple:
+    """_predict sur _stage_pool : (résultat, durée) pour les timings du job."""
+    t0 = time.perf_counter()
+    with timed("predict"):
+        result = _predict(clients, blob_name, content, mime)
+    return result, time.perf_counter() - t0
+
+
+def _local_match(content: bytes) -> Optional[dict]:
+    """Repli sans serveur IA : plus proche référence de data/cars/img (car_index), si LOCAL_MATCH_ENABLED."""
+    try:
+        from .car_index import LOCAL_MATCH_ENABLED, get_index  # numpy chargé seulement si le repli sert
+    except ImportError:
+        return None
+    if not LOCAL_MATCH_ENABLED:
+        return None
+    index = get_index()
+    if index is None:
+        return None
+    try:
+        match = index.match(content)
+    except Exception as e:
+        logger.warning("local match failed: %s", e)
+        return None
+    if match:
+        logger.info("local match %s %s (score=%.3f)", match["make"], match["model"], match["score"])
+    return match
+
+
+def _upload_derivatives(clients: "Clients", blob_name: str, processed_bytes: bytes) -> dict:
+    """
+    Dérivés WebP (thumb / feed / full) de l'image traitée, uploadés en parallèle
+    sous processed/<date>/<uuid>/<taille>.webp. Retourne {taille: url} ({} si échec).
+    """
+    try:
+        derivatives = make_derivatives(processed_bytes)
+    except Exception as e:
+        logger.warning("derivatives skipped (decode/encode): %s", e)
+        return {}
+
+    def _put(name: str, data: bytes) -> str:
+        bc = clients.blob.get_blob_client(container=PROC_CONT, blob=derivative_blob_name(blob_name, name))
+        bc.upload_blob(
+            data,
+            overwrite=True,
+            content_settings=ContentSettings(
+                content_type=DERIVATIVE_MIME,
+                cache_control="public, max-age=31536000, immutable",
+            ),
+        )
+        return bc.url
+
+    futures = {name: _stage_pool.submit(_put, name, data) for name, data in derivatives.items()}
+    try:
+        images = {name: fut.result() for name, fut in futures.items()}
+    except Exception as e:
+        logger.warning("derivatives upload failed: %s", e)
+        return {}
+    logger.info("derivatives ok %s", {n: len(d) for n, d in derivatives.items()})
+    return images
+
+
+def safe_json_loads(s: str) -> Optional[dict]:
+    try:
+        return json.loads(s)
+    except Exception as e:
+        logger.error("JSON parse error: %s / payload head=%r", e, s[:200])
+        return None
+
+
+def unpack_jobs(data: dict) -> list:
+    """
+    Jobs d'un message de queue : {"post_id", "blob_name"} (un job) ou
+    l'enveloppe {"v": 2, "jobs": [...]} envoyée par l'enqueuer groupé de l'API.
+    """
+    if isinstance(data, dict) and data.get("v") == 2:
+        jobs = data.get("jobs")
+        if not isinstance(jobs, list):
+            logger.error("envelope without jobs list")
+            return []
+        return [j for j in jobs if isinstance(j, dict)]
+    return [data] if isinstance(data, dict) else []
+
+
+def pack_jobs(jobs: list) -> str:
+    """Inverse de unpack_jobs : un job seul garde le format simple."""
+    return json.dumps(jobs[0] if len(jobs) == 1 else {"v": 2, "jobs": jobs})
+
+
+class JobFailed(Exception):
+    """Échec bloquant d'un job (download, upload, erreur inattendue) : à rejouer."""
+
+
+@dataclass
+class MessageResult:
+    outcomes: list = field(default_factory=list)   # Outcome des jobs réussis
+    failed: list = field(default_factory=list)     # jobs en échec bloquant (le message ne doit pas être supprimé)
+
+
+def _run_job(clients: "Clients", job: dict) -> tuple:
+    try:
+        return process_job(clients, job), False
+    except JobFailed:
+        return None, True
+
+
+def process_message(clients: "Clients", data: dict) -> MessageResult:
+    """Jobs du message (en parallèle s'il y en a plusieurs) : outcomes et jobs en échec."""
+    jobs = unpack_jobs(data)
+    if len(jobs) > 1:
+        logger.info("envelope jobs=%d", len(jobs))
+        results = list(_job_pool.map(lambda j: _run_job(clients, j), jobs))
+    else:
+        results = [_run_job(clients, j) for j in jobs]
+    result = MessageResult()
+    for job, (outcome, failed) in zip(jobs, results):
+        if failed:
+            result.failed.append(job)
+        elif outcome is not None:
+            result.outcomes.append(outcome)
+    return result
+
+
+@dataclass
+class Outcome:
+    """Résultat d'un job, en attente d'écriture Mongo (groupée par lot)."""
+    post_id: Optional[str]
+    blob_name: str
+    processed_url: str
+    update_doc: dict
+    vehicle: dict = field(default_factory=dict)
+    vehicle_key: Optional[str] = None
+    ai_result: Optional[dict] = None    # à mettre en cache (ai_results) après un traitement complet
+
+
+def _cached_result(db, digest: str) -> Optional[dict]:
+    """Résultat IA déjà calculé pour ce contenu (même version des modèles)."""
+    if db is None:
+        return None
+    try:
+        return db.ai_results.find_one({"_id": digest, "model_version": AI_MODEL_VERSION})
+    except Exception as e:
+        logger.warning("ai_results lookup skipped: %s", e)
+        return None
+
+
+def process_job(clients: Clients, data: dict) -> Optional[Outcome]:
+    """
+    Étapes 1 à 4 pour un message {"post_id", "blob_name"} ; "force": true
+    (backfill) ignore le cache ai_results. Retourne None si le message est
+    inexploitable (rien à rejouer) ; lève JobFailed sur un échec bloquant
+    (download, upload, erreur inattendue), déjà loggé.
+    Logge le temps passé par étape (ligne `timings`).
+    """
+    timings: dict = {}
+    outcome = None
+    try:
+        with timed("job", timings):
+            outcome = _process_job(clients, data, timings)
+    finally:
+        logger.info("timings post_id=%s ok=%s %s", data.get("post_id"), outcome is not None,
+                    format_timings(timings))
+    return outcome
+
+
+def _process_job(clients: Clients, data: dict, timings: dict) -> Optional[Outcome]:
+    try:
+        post_id = data.get("post_id")
+        blob_name = data.get("blob_name")
+        if not blob_name:
+            logger.error("missing blob_name in message")
+            return None
+        logger.info("parsed post_id=%s blob_name=%s", post_id, blob_name)
+
+        # 1) Télécharger RAW
+        try:
+            raw_blob = clients.blob.get_blob_client(container=RAW_CONT, blob=blob_name)
+            with timed("download", timings):
+                raw_bytes = raw_blob.download_blob().readall()
+            logger.info("downloaded raw bytes=%d", len(raw_bytes))
+        except Exception as e:
+            logger.exception("failed to download raw: %s", e)
+            raise JobFailed("download") from e
+
+        # 1') Dédup par contenu : même image déjà traitée -> on réutilise le blob
+        #     processed et la prédiction, sans appeler les modèles ni réécrire.
+        digest = hashlib.sha256(raw_bytes).hexdigest()
+        cached = None if data.get("force") else _cached_result(clients.db, digest)
+        if cached:
+            logger.info("dedup hit sha256=%s -> %s", digest[:12], cached.get("processed_blob"))
+            return build_outcome(post_id, blob_name, cached["processed_url"], cached.get("prediction"), digest,
+                                 cached.get("images"))
+
+        # 1'') Normalisation : orientation EXIF appliquée, métadonnées retirées,
+        #      réduit à BLUR_MAX_EDGE. Sert d'entrée au blur et d'image processed
+        #      si le blur échoue (plus de GPS publié avec le RAW).
+        with timed("decode", timings):
+            base_bytes, base_mime = _prepare(raw_bytes, "image/jpeg", BLUR_MAX_EDGE)
+        processed_bytes = base_bytes
+        blur_mime: Optional[str] = None
+        tags_payload: Optional[dict] = None
+
+        # 3') Predict sur le RAW, lancé pendant le blur (optionnel)
+        predict_fut = None
+        if PREDICT_URL and PREDICT_ON_RAW:
+            with timed("decode", timings):
+                predict_input = _prepare(base_bytes, base_mime, PREDICT_MAX_EDGE)
+            predict_fut = _stage_pool.submit(_timed_predict, clients, blob_name, *predict_input)
+
+        # 2) Blur (optionnel)
+        if BLUR_URL:
+            with timed("blur", timings):
+                blurred = _blur(clients, blob_name, base_bytes, base_mime)
+            if blurred:
+                processed_bytes, blur_mime = blurred
+
+        # 3) Predict (optionnel) sur une version réduite de l'image floutée
+        if predict_fut is not None:
+            tags_payload, timings["predict"] = predict_fut.result()
+        elif PREDICT_URL:
+            with timed("decode", timings):
+                predict_input = _prepare(processed_bytes, blur_mime or base_mime, PREDICT_MAX_EDGE)
+            with timed("predict", timings):
+                tags_payload = _predict(clients, blob_name, *predict_input)
+
+        # 3'') Predict absent / en panne : index local (make/model + confiance)
+        predicted = tags_payload is not None
+        if not predicted:
+            with timed("local_match", timings):
+                tags_payload = _local_match(base_bytes)
+
+        # 4) Upload PROCESSED
+        try:
+            proc_blob = clients.blob.get_blob_client(container=PROC_CONT, blob=blob_name)
+            content_type = blur_mime or base_mime
+            with timed("upload", timings):
+                proc_blob.upload_blob(
+                    processed_bytes,
+                    overwrite=True,
+                    content_settings=ContentSettings(content_type=content_type),
+                )
+            logger.info("uploaded processed %s/%s (ct=%s)", PROC_CONT, blob_name, content_type)
+        except Exception as e:
+            logger.exception("failed to upload processed: %s", e)
+            raise JobFailed("upload") from e
+
+        # 4b) Dérivés multi-résolution pour le feed et le détail
+        with timed("derivatives", timings):
+            images = _upload_derivatives(clients, blob_name, processed_bytes)
+
+        outcome = build_outcome(post_id, blob_name, proc_blob.url, tags_payload, digest, images)
+        # cache seulement un traitement complet (pas un blur/predict en échec)
+        if (not BLUR_URL or blur_mime) and (not PREDICT_URL or predicted) and images:
+            outcome.ai_result = {
+                "_id": digest,
+                "model_version": AI_MODEL_VERSION,
+                "processed_blob": blob_name,
+                "processed_url": proc_blob.url,
+                "content_type": content_type,
+                "prediction": tags_payload,
+                "images": images,
+                "created_at": datetime.utcnow(),
+            }
+        return outcome
+    except JobFailed:
+        raise
+    except Exception as e:
+        logger.exception("FATAL (caught): %s", e)
+        raise JobFailed("unexpected") from e
+
+
+def build_outcome(post_id: Optional[str], blob_name: str, processed_url: str,
+                  tags_payload: Optional[dict], digest: Optional[str] = None,
+                  images: Optional[dict] = None) -> Outcome:
+    vehicle = {"make": "Unknown", "model": "Unknown"}
+    rarity = "common"
+    vehicle_key = None
+    if isinstance(tags_payload, dict):
+        nested = tags_payload.get("vehicle") if isinstance(tags_payload.get("vehicle"), dict) else {}
+        make = (tags_payload.get("vehicle_make") or tags_payload.get("make")
+                or nested.get("make") or nested.get("brand") or "").strip() or "Unknown"
+        model = (tags_payload.get("vehicle_model") or tags_payload.get("model")
+                 or nested.get("model") or "").strip() or "Unknown"
+        rarity = (tags_payload.get("rarity") or "common").lower()
+        vehicle = {"make": make, "model": model}
+        # repli local (basse confiance) : affiché, mais ni turbodex ni vehicle_stats
+        if not tags_payload.get("low_confidence"):
+            vehicle_key = f"{make}::{model}".lower()
+
+    update_doc = {
+        "status": "processed",
+        "processed_blob_url": processed_url,
+        "vehicle": vehicle,
+        "vehicle_key": vehicle_key,
+        "rarity": rarity,
+    }
+    if digest:
+        update_doc["content_sha256"] = digest
+    if images:
+        update_doc["images"] = images
+    if isinstance(tags_payload, dict):
+        update_doc["ai"] = {
+            "raw": tags_payload,
+            "tags": tags_payload.get("tags")
+        }
+    return Outcome(post_id, blob_name, processed_url, update_doc, vehicle, vehicle_key)
+
+
+# ---------- Écritures Mongo (groupées) ----------
+
+def _valid_post_id(post_id) -> bool:
+    return bool(post_id) and isinstance(post_id, str) and len(post_id) == 24 and ObjectId is not None
+
+
+def flush_outcomes(db, outcomes: list) -> int:
+    """
+    Applique les résultats d'un lot : cache ai_results, un `find` pour les
+    posts, puis un `bulk_write` posts, turbodex et vehicle_stats. La rareté vient
+    des statistiques de captures (rarity.py) dès qu'elles existent. Retourne le nombre de posts mis à jour.
+    Lève en cas d'erreur Mongo (le worker ne supprime alors pas les messages).
+    """
+    if db is None:
+        return 0
+    with timed("mongo"):
+        return _flush_outcomes(db, outcomes)
+
+
+def _flush_outcomes(db, outcomes: list) -> int:
+    cache_ops = [
+        UpdateOne({"_id": o.ai_result["_id"]}, {"$set": o.ai_result}, upsert=True)
+        for o in outcomes if o is not None and o.ai_result
+    ]
+    if cache_ops:
+        db.ai_results.bulk_write(cache_ops, ordered=False)
+
+    outcomes = [o for o in outcomes if o is not None and _valid_post_id(o.post_id)]
+    if not outcomes:
+        return 0
+
+    ids = [ObjectId(o.post_id) for o in outcomes]
+    posts = {p["_id"]: p for p in db.posts.find(
+        {"_id": {"$in": ids}},
+        {"_id": 1, "user_id": 1, "created_at": 1, "status": 1, "vehicle": 1, "vehicle_key": 1, "fanned_out": 1},
+    )}
+    rarity_table.maybe_refresh(db)
+
+    now = datetime.utcnow()
+    # retraitements qui changent de véhicule : leur ancienne clé ne compte plus
+    old_keys, leaving = {}, []
+    for o in outcomes:
+        post = posts.get(ObjectId(o.post_id))
+        if post and post.get("status") == "processed":
+            old_keys[post["_id"]] = _stored_vehicle_key(post)
+            if old_keys[post["_id"]] != o.vehicle_key:
+                leaving.append(post["_id"])
+
+    post_ops, dex_ops, dex_drops, stat_ops, to_fan_out = [], [], [], [], []
+    for o in outcomes:
+        pid = ObjectId(o.post_id)
+        post = posts.get(pid)
+        if not post:
+            logger.warning("mongo: post not found, id=%s", o.post_id)
+            continue
+        reprocessed = pid in old_keys
+        update_doc = o.update_doc
+        rarity = rarity_table.rarity_for(o.vehicle_key)
+        if rarity:
+            update_doc = {**update_doc, "rarity": rarity}
+        if reprocessed:
+            # retraitement (backfill, message rejoué) : processed_at garde la date
+            # du premier traitement, le notifier et les classements ne recomptent pas
+            update_doc = {**update_doc, "reprocessed_at": now}
+        else:
+            # horodaté à l'écriture Mongo, pas à la fin du job (parfois bien avant) :
+            # le poll du notifier suit processed_at
+            update_doc = {**update_doc, "processed_at": now, "fanned_out": False}
+        post_ops.append(UpdateOne({"_id": pid}, {"$set": update_doc}))
+        # fan-out une seule fois (repris si le lot précédent a échoué avant la fin)
+        if post.get("created_at") and (not reprocessed or post.get("fanned_out") is False):
+            to_fan_out.append(post)
+
+        old_key = old_keys.get(pid)
+        changed = not reprocessed or old_key != o.vehicle_key
+        if reprocessed and changed and old_key:
+            # le véhicule a changé : la capture quitte l'ancienne clé
+            if old_key != UNKNOWN_KEY:
+                stat_ops.append(UpdateOne({"_id": old_key}, {"$inc": {"count": -1}}))
+            if not _has_other_capture(db, post, leaving):
+                dex_drops.append(DeleteOne({"user_id": post["user_id"], "vehicle_key": old_key}))
+        # compteur de fréquence : une fois par post et par véhicule
+        if changed and o.vehicle_key and o.vehicle_key != UNKNOWN_KEY:
+            stat_ops.append(UpdateOne(
+                {"_id": o.vehicle_key},
+                {
+                    "$inc": {"count": 1},
+                    "$set": {"make": o.vehicle.get("make"), "model": o.vehicle.get("model"), "last_seen": now},
+                },
+                upsert=True,
+            ))
+        if o.vehicle_key:
+            captured_at = (post.get("created_at") or now) if reprocessed else now
+            entry = {"make": o.vehicle.get("make"), "model": o.vehicle.get("model"),
+                     "last_post_id": pid, "last_captured_at": captured_at}
+            if changed:
+                update = {"$setOnInsert": {"first_post_id": pid, "captured_at": captured_at}, "$set": entry}
+            else:
+                # même véhicule : recrée l'entrée si elle manque, sans la marquer comme nouvelle capture
+                update = {"$setOnInsert": {"first_post_id": pid, "captured_at": captured_at, **entry}}
+            dex_ops.append(UpdateOne({"user_id": post["user_id"], "vehicle_key": o.vehicle_key}, update, upsert=True))
+
+    if post_ops:
+        db.posts.bulk_write(post_ops, ordered=False)
+    if dex_drops:
+        db.turbodex.bulk_write(dex_drops, ordered=False)
+    if dex_ops:
+        db.turbodex.bulk_write(dex_ops, ordered=False)
+    if stat_ops:
+        db.vehicle_stats.bulk_write(stat_ops, ordered=False)
+
+    fanned = 0
+    for post in to_fan_out:
+        fanned += _fanout_timelines(db, post)
+    if to_fan_out:
+        db.posts.update_many({"_id": {"$in": [p["_id"] for p in to_fan_out]}}, {"$set": {"fanned_out": True}})
+    logger.info("mongo updated posts=%d; turbodex upserts=%d drops=%d; vehicle_stats=%d; timelines=%d",
+                len(post_ops), len(dex_ops), len(dex_drops), len(stat_ops), fanned)
+    return len(post_ops)
+
+
+def _stored_vehicle_key(post: dict) -> Optional[str]:
+    """vehicle_key écrit au traitement précédent (déduit de vehicle pour les posts plus anciens)."""
+    if "vehicle_key" in post:
+        return post["vehicle_key"]
+    vehicle = post.get("vehicle") or {}
+    if not vehicle.get("make") or not vehicle.get("model"):
+        return None
+    return f"{vehicle['make']}::{vehicle['model']}".lower()
+
+
+def _has_other_capture(db, post: dict, leaving: list) -> bool:
+    """Un autre post traité de l'utilisateur garde-t-il l'ancien véhicule (hors posts du lot qui en changent) ?"""
+    vehicle = post.get("vehicle") or {}
+    return db.posts.find_one({
+        "user_id": post["user_id"],
+        "status": "processed",
+        "vehicle.make": vehicle.get("make"),
+        "vehicle.model": vehicle.get("model"),
+        "_id": {"$nin": leaving},
+    }, {"_id": 1}) is not None
+
+
+def _flush_timelines(db, ops: list) -> None:
+    try:
+        db.timelines.bulk_write(ops, ordered=False)
+    except BulkWriteError as e:
+        # 11000 = post déjà présent (message rejoué) : ignoré
+        if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+            raise
+
+
+def _fanout_timelines(db, post: dict) -> int:
+    """
+    Push du post traité dans la timeline de chaque follower (feed scope=following).
+    Les auteurs en mode pull (très suivis, cf. API timeline_service) sont ignorés.
+    """
+    author = db.users.find_one({"_id": post["user_id"]}, {"fanout": 1})
+    if author and author.get("fanout") == "pull":
+        return 0
+    entry = {"post_id": post["_id"], "author_id": post["user_id"], "created_at": post["created_at"]}
+    update = {
+        "$push": {"items": {"$each": [entry], "$sort": {"created_at": -1}, "$slice": TIMELINE_CAP}},
+        "$set": {"updated_at": datetime.utcnow()},
+    }
+    ops, n = [], 0
+    for f in db.follows.find({"followee_id": post["user_id"]}, {"follower_id": 1}):
+        ops.append(UpdateOne({"_id": f["follower_id"], "items.post_id": {"$ne": post["_id"]}}, update, upsert=True))
+        if len(ops) >= 500:
+            _flush_timelines(db, ops)
+            n += len(ops)
+            ops = []
+    if ops:
+        _flush_timelines(db, ops)
+        n += len(ops)
+    return n
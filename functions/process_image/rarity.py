@@ -0,0 +1,92 @@
+"""
+Rareté calculée sur les captures réelles plutôt que fournie par le predict.
+
+- `vehicle_stats` {_id: vehicle_key, count, make, model, last_seen} : compteur
+  incrémenté par flush_outcomes à chaque premier traitement d'un post.
+- Paliers : véhicules classés du moins au plus capturé (à égalité, par
+  vehicle_key) ; ceux qui cumulent les 1 % de captures les plus rares sont
+  "legendary", puis 4 % "epic", 10 % "rare", le reste "common" (mêmes
+  proportions que l'ancien tirage 85/10/4/1). Le palier est fixé par le rang,
+  pas par le nombre de captures : des ex aequo peuvent tomber dans deux paliers
+  voisins, mais un palier ne dépasse jamais sa part.
+  Recalculés au plus toutes les RARITY_REFRESH_SECONDS et gardés en mémoire
+  (vehicle_key -> palier).
+- `rarity_for(key)` : une lecture de dict.
+"""
+import logging
+import os
+import threading
+import time
+from typing import Optional
+
+logger = logging.getLogger("process_image")
+
+RARITY_REFRESH_SECONDS = float(os.getenv("RARITY_REFRESH_SECONDS", "300"))
+RARITY_MIN_CAPTURES = int(os.getenv("RARITY_MIN_CAPTURES", "500"))  # en dessous : rareté du predict
+# (palier, part cumulée des captures la plus rare couverte par ce palier)
+TIERS = (("legendary", 0.01), ("epic", 0.05), ("rare", 0.15))
+UNKNOWN_KEY = "unknown::unknown"
+
+
+def compute_tiers(counts: dict) -> Optional[dict]:
+    """{vehicle_key: palier} pour tous les véhicules comptés, None si trop peu de données."""
+    total = sum(counts.values())
+    if total < RARITY_MIN_CAPTURES:
+        return None
+    tiers = {}
+    cum = 0
+    t = 0
+    for key, count in sorted(counts.items(), key=lambda kv: (kv[1], kv[0])):
+        cum += count
+        while t < len(TIERS) and cum > TIERS[t][1] * total:
+            t += 1
+        tiers[key] = TIERS[t][0] if t < len(TIERS) else "common"
+    return tiers
+
+
+class RarityTable:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._refreshing = threading.Lock()
+        self._tiers: Optional[dict] = None
+        self._loaded_at = 0.0
+
+    def refresh(self, db) -> None:
+        counts = {d["_id"]: d.get("count", 0) for d in db.vehicle_stats.find({}, {"count": 1})}
+        counts.pop(UNKNOWN_KEY, None)
+        tiers = compute_tiers(counts)
+        with self._lock:
+            self._tiers = tiers
+            self._loaded_at = time.monotonic()
+        per_tier = {}
+        for tier in (tiers or {}).values():
+            per_tier[tier] = per_tier.get(tier, 0) + 1
+        logger.info("rarity tiers refreshed: vehicles=%d captures=%d per_tier=%s",
+                    len(counts), sum(counts.values()), per_tier if tiers is not None else None)
+
+    def maybe_refresh(self, db) -> None:
+        if db is None or time.monotonic() - self._loaded_at < RARITY_REFRESH_SECONDS:
+            return
+        if not self._refreshing.acquire(blocking=False):
+            return  # un autre thread recalcule déjà
+        try:
+            self.refresh(db)
+        except Exception as e:
+            # on garde la table précédente ; nouvel essai au prochain intervalle
+            self._loaded_at = time.monotonic()
+            logger.warning("rarity refresh failed: %s", e)
+        finally:
+            self._refreshing.release()
+
+    def rarity_for(self, vehicle_key: Optional[str]) -> Optional[str]:
+        """Rareté du véhicule, None si pas encore de statistiques exploitables."""
+        if not vehicle_key or vehicle_key == UNKNOWN_KEY:
+            return "common"
+        tiers = self._tiers
+        if tiers is None:
+            return None
+        # jamais capturé (absent des stats) : 0 capture, le palier le plus rare
+        return tiers.get(vehicle_key, TIERS[0][0])
+
+
+rarity_table = RarityTable()
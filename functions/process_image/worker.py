@@ -0,0 +1,176 @@
+"""
+Worker autonome : même pipeline que la Function, sans un appel par message.
+
+    cd functions && python -m process_image.worker --workers 16 --processes 4
+
+Chaque process tire des lots de 32 messages max, les traite en parallèle
+(pool de threads), réutilise ses clients Blob/HTTP/Mongo, écrit les résultats
+du lot en `bulk_write` puis supprime les messages. Un message dont un job
+échoue n'est pas supprimé : il ne garde que ses jobs en échec et redevient
+visible après le timeout ; au-delà de MAX_DEQUEUE_COUNT, ces jobs partent en
+poison, comme avec le trigger.
+
+--metrics-port N : histogrammes par étape (metrics.py) sur GET :N/metrics,
+N+1, N+2... pour les process suivants.
+"""
+import argparse
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from azure.storage.queue import QueueClient, TextBase64DecodePolicy, TextBase64EncodePolicy
+
+from .metrics import serve as serve_metrics
+from .pipeline import (
+    Clients,
+    MessageResult,
+    flush_outcomes,
+    logger,
+    pack_jobs,
+    process_message,
+    safe_json_loads,
+    storage_conn_str,
+    unpack_jobs,
+)
+
+QUEUE_NAME = os.getenv("AZURE_QUEUE_NAME", "process-image") or "process-image"
+POISON_QUEUE_NAME = f"{QUEUE_NAME}-poison"
+MAX_BATCH = 32                    # limite du service Queue
+MAX_DEQUEUE_COUNT = int(os.getenv("MAX_DEQUEUE_COUNT", "5"))   # cf. host.json
+VISIBILITY_TIMEOUT = int(os.getenv("WORKER_VISIBILITY_TIMEOUT", "300"))
+MAX_IDLE_SLEEP = 5.0
+
+
+def _queue(name: str) -> QueueClient:
+    # Base64 : même encodage que l'API et le trigger (host.json)
+    return QueueClient.from_connection_string(
+        storage_conn_str(),
+        queue_name=name,
+        message_encode_policy=TextBase64EncodePolicy(),
+        message_decode_policy=TextBase64DecodePolicy(),
+    )
+
+
+def _handle(clients: Clients, msg) -> MessageResult:
+    data = safe_json_loads(msg.content or "")
+    if not data:
+        return MessageResult()   # illisible : rien à rejouer
+    try:
+        return process_message(clients, data)
+    except Exception as e:
+        logger.exception("message failed id=%s: %s", msg.id, e)
+        return MessageResult(failed=unpack_jobs(data))
+
+
+def handle_batch(clients: Clients, queue, poison, pool, msgs: list) -> dict:
+    """
+    Traite un lot reçu : écrit les outcomes dans Mongo, puis
+    - supprime les messages dont tous les jobs ont réussi ;
+    - laisse dans la queue ceux qui ont un job en échec, réduits à ces jobs ;
+    - au-delà de MAX_DEQUEUE_COUNT, envoie ces jobs en poison et supprime le message.
+    Mongo en échec : aucun message n'est touché (tout sera rejoué).
+    """
+    futures = [(m, pool.submit(_handle, clients, m)) for m in msgs]
+    outcomes, done, retry, poisoned = [], [], [], []
+    for m, fut in futures:
+        result = fut.result()
+        outcomes.extend(result.outcomes)
+        if not result.failed:
+            done.append(m)
+            continue
+        logger.warning("message id=%s dequeue=%s: %d/%d jobs failed", m.id, m.dequeue_count,
+                       len(result.failed), len(result.failed) + len(result.outcomes))
+        if (m.dequeue_count or 0) >= MAX_DEQUEUE_COUNT:
+            poisoned.append((m, result.failed))
+        elif result.outcomes:
+            retry.append((m, result.failed))
+
+    # Mongo d'abord : si l'écriture échoue, les messages seront rejoués
+    flush_outcomes(clients.db, outcomes)
+    for m in done:
+        queue.delete_message(m)
+    for m, failed in poisoned:
+        poison.send_message(pack_jobs(failed))
+        queue.delete_message(m)   # après l'envoi : au pire un doublon, jamais une perte
+    for m, failed in retry:
+        # les jobs réussis sont écrits : seul le reste sera rejoué (dequeue_count conservé)
+        queue.update_message(m, content=pack_jobs(failed), visibility_timeout=VISIBILITY_TIMEOUT)
+    return {"msgs": len(msgs), "ok": len(done), "poisoned": len(poisoned), "jobs": len(outcomes)}
+
+
+def run(workers: int, batch: int = MAX_BATCH, stop: threading.Event | None = None) -> None:
+    stop = stop or threading.Event()
+    batch = max(1, min(MAX_BATCH, batch))
+    clients = Clients()
+    queue, poison = _queue(QUEUE_NAME), _queue(POISON_QUEUE_NAME)
+    idle = 0.5
+    logger.info("worker started pid=%d workers=%d batch=%d", os.getpid(), workers, batch)
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job") as pool:
+        while not stop.is_set():
+            msgs = list(queue.receive_messages(
+                messages_per_page=batch, max_messages=batch, visibility_timeout=VISIBILITY_TIMEOUT
+            ))
+            if not msgs:
+                stop.wait(idle)
+                idle = min(MAX_IDLE_SLEEP, idle * 2)
+                continue
+            idle = 0.5
+
+            t0 = time.perf_counter()
+            try:
+                stats = handle_batch(clients, queue, poison, pool, msgs)
+            except Exception as e:
+                logger.exception("batch failed, messages left in queue: %s", e)
+                continue
+            logger.info("batch done msgs=%d ok=%d poisoned=%d jobs=%d in %.2fs",
+                        stats["msgs"], stats["ok"], stats["poisoned"], stats["jobs"], time.perf_counter() - t0)
+
+    clients.close()
+    queue.close()
+    poison.close()
+
+
+def _run_process(workers: int, batch: int, metrics_port: int = 0) -> None:
+    stop = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: stop.set())
+    if metrics_port:
+        serve_metrics(metrics_port)
+        logger.info("metrics on :%d/metrics", metrics_port)
+    run(workers, batch, stop)
+
+
+def main() -> None:
+    cpus = os.cpu_count() or 1
+    ap = argparse.ArgumentParser(description="Worker batch process-image")
+    ap.add_argument("--workers", type=int, default=int(os.getenv("WORKER_COUNT", "8")),
+                    help="jobs en parallèle par process (I/O : blob, IA, Mongo)")
+    ap.add_argument("--processes", type=int, default=int(os.getenv("WORKER_PROCESSES", str(cpus))),
+                    help="process indépendants (défaut : un par cœur)")
+    ap.add_argument("--batch", type=int, default=MAX_BATCH, help="messages par réception (max 32)")
+    ap.add_argument("--metrics-port", type=int, default=int(os.getenv("WORKER_METRICS_PORT", "0")),
+                    help="port Prometheus du premier process (0 = désactivé)")
+    args = ap.parse_args()
+
+    if args.processes <= 1:
+        _run_process(args.workers, args.batch, args.metrics_port)
+        return
+    procs = [multiprocessing.Process(target=_run_process,
+                                     args=(args.workers, args.batch, args.metrics_port and args.metrics_port + i))
+             for i in range(args.processes)]
+    for p in procs:
+        p.start()
+    try:
+        for p in procs:
+            p.join()
+    except KeyboardInterrupt:
+        for p in procs:
+            p.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,17 @@
+from process_image.metrics import Histogram
+
+
+def test_render_without_labels():
+    h = Histogram("job_seconds", "Job duration", buckets=(0.1, 1.0))
+    h.observe(0.5)
+    lines = h.render()
+    assert 'job_seconds_bucket{le="0.1"} 0' in lines
+    assert 'job_seconds_bucket{le="1.0"} 1' in lines
+    assert 'job_seconds_bucket{le="+Inf"} 1' in lines
+    assert "job_seconds_count{} 1" in lines
+
+
+def test_render_escapes_label_values():
+    h = Histogram("stage_seconds", "Stage duration", ("stage",), buckets=(1.0,))
+    h.observe(0.2, 'a"b\\c\nd')
+    assert 'stage_seconds_bucket{stage="a\\"b\\\\c\\nd",le="1.0"} 1' in h.render()
@@ -0,0 +1,50 @@
+import random
+
+from process_image import rarity
+from process_image.rarity import TIERS, RarityTable, compute_tiers
+
+
+def _tied_counts() -> dict:
+    # 64 véhicules à 1 capture (6,4 %), puis une longue traîne : 1 000 captures
+    counts = {f"tied::{i:02d}": 1 for i in range(64)}
+    counts.update({f"mid::{i:02d}": 23 for i in range(8)})
+    counts["popular::a"] = 1000 - sum(counts.values())
+    return counts
+
+
+def _cumulative_share(counts: dict, tiers: dict, upto: str) -> float:
+    names = [t for t, _ in TIERS]
+    rarer = set(names[:names.index(upto) + 1])
+    return sum(c for k, c in counts.items() if tiers[k] in rarer) / sum(counts.values())
+
+
+def test_ties_do_not_overflow_a_tier():
+    counts = _tied_counts()
+    tiers = compute_tiers(counts)
+    for tier, share in TIERS:
+        assert _cumulative_share(counts, tiers, tier) <= share
+    assert [k for k, t in tiers.items() if t == "legendary"] == [f"tied::{i:02d}" for i in range(10)]
+    assert sum(t == "epic" for t in tiers.values()) == 40
+    assert tiers["popular::a"] == "common"
+
+
+def test_ties_are_broken_by_vehicle_key_whatever_the_input_order():
+    counts = _tied_counts()
+    items = list(counts.items())
+    random.Random(7).shuffle(items)
+    assert compute_tiers(dict(items)) == compute_tiers(counts)
+
+
+def test_not_enough_captures():
+    assert compute_tiers({"a::b": rarity.RARITY_MIN_CAPTURES - 1}) is None
+
+
+def test_rarity_for():
+    table = RarityTable()
+    assert table.rarity_for("tied::00") is None   # pas encore de stats
+    table._tiers = compute_tiers(_tied_counts())
+    assert table.rarity_for("tied::00") == "legendary"
+    assert table.rarity_for("mid::00") == "rare"
+    assert table.rarity_for("never::seen") == "legendary"
+    assert table.rarity_for(rarity.UNKNOWN_KEY) == "common"
+    assert table.rarity_for(None) == "common"
@@ -0,0 +1,114 @@
+import io
+import json
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+from PIL import Image
+
+from process_image import pipeline, worker
+
+
+class FakeBlob:
+    def __init__(self, store, container, name):
+        self.store, self.key = store, (container, name)
+        self.url = f"https://acc.blob.core.windows.net/{container}/{name}"
+
+    def download_blob(self):
+        data = self.store[self.key]   # KeyError : blob absent
+        return SimpleNamespace(readall=lambda: data)
+
+    def upload_blob(self, data, overwrite=False, content_settings=None):
+        self.store[self.key] = data
+
+
+class FakeBlobService:
+    def __init__(self):
+        self.store = {}
+
+    def get_blob_client(self, container, blob):
+        return FakeBlob(self.store, container, blob)
+
+
+class FakeQueue:
+    def __init__(self):
+        self.sent, self.deleted, self.updated = [], [], []
+
+    def send_message(self, content):
+        self.sent.append(content)
+
+    def delete_message(self, msg):
+        self.deleted.append(msg.id)
+
+    def update_message(self, msg, content=None, visibility_timeout=None):
+        self.updated.append((msg.id, content))
+
+
+def _jpeg() -> bytes:
+    buf = io.BytesIO()
+    Image.new("RGB", (64, 48), (200, 30, 30)).save(buf, "JPEG")
+    return buf.getvalue()
+
+
+def _msg(id_, jobs, dequeue_count=1):
+    return SimpleNamespace(id=id_, content=pipeline.pack_jobs(jobs), dequeue_count=dequeue_count)
+
+
+@pytest.fixture
+def env(monkeypatch):
+    monkeypatch.setattr(pipeline, "BLUR_URL", "")
+    monkeypatch.setattr(pipeline, "PREDICT_URL", "")
+    monkeypatch.setattr(pipeline, "_local_match", lambda content: None)
+    flushed = []
+    monkeypatch.setattr(worker, "flush_outcomes", lambda db, outcomes: flushed.extend(outcomes))
+    blob = FakeBlobService()
+    blob.store[(pipeline.RAW_CONT, "20250801/ok.jpg")] = _jpeg()
+    clients = SimpleNamespace(blob=blob, db=None, http=None)
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        yield SimpleNamespace(clients=clients, queue=FakeQueue(), poison=FakeQueue(), pool=pool, flushed=flushed)
+
+
+OK = {"post_id": "a" * 24, "blob_name": "20250801/ok.jpg"}
+MISSING = {"post_id": "b" * 24, "blob_name": "20250801/missing.jpg"}
+
+
+def _run(env, msgs):
+    return worker.handle_batch(env.clients, env.queue, env.poison, env.pool, msgs)
+
+
+def test_successful_message_is_deleted(env):
+    _run(env, [_msg("m1", [OK])])
+    assert env.queue.deleted == ["m1"]
+    assert [o.blob_name for o in env.flushed] == [OK["blob_name"]]
+
+
+def test_failed_job_keeps_message_in_queue(env):
+    _run(env, [_msg("m1", [MISSING])])
+    assert env.queue.deleted == []
+    assert env.queue.updated == []
+    assert env.poison.sent == []
+
+
+def test_envelope_with_a_failed_job_is_not_deleted(env):
+    _run(env, [_msg("m1", [OK, MISSING])])
+    assert env.queue.deleted == []
+    # le job réussi est écrit, le message ne garde que le job en échec
+    assert [o.blob_name for o in env.flushed] == [OK["blob_name"]]
+    assert env.queue.updated == [("m1", json.dumps(MISSING))]
+
+
+def test_failed_jobs_go_to_poison_after_max_dequeue(env):
+    _run(env, [_msg("m1", [OK, MISSING], dequeue_count=worker.MAX_DEQUEUE_COUNT)])
+    assert env.poison.sent == [json.dumps(MISSING)]
+    assert env.queue.deleted == ["m1"]
+
+
+def test_mongo_failure_leaves_batch_in_queue(env, monkeypatch):
+    def boom(db, outcomes):
+        raise RuntimeError("mongo down")
+
+    monkeypatch.setattr(worker, "flush_outcomes", boom)
+    with pytest.raises(RuntimeError):
+        _run(env, [_msg("m1", [OK]), _msg("m2", [OK, MISSING], dequeue_count=worker.MAX_DEQUEUE_COUNT)])
+    assert env.queue.deleted == []
+    assert env.poison.sent == []